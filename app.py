@@ -1,62 +1,39 @@
 import streamlit as st
-from gemini_backend import get_gemini_response
-from webscrapping import extract_content, format_with_gemini 
-from vector_store_api import upload_pdf_to_chroma
-from vector_rag import query_rag
+# Feature backends (Gemini, LangChain/Chroma, pandas) are imported inside the page
+# functions that use them, so the login page starts without loading any of them
+from document_registry import collection_name_for, session_documents
 from session_manager import (
-    list_sessions, create_new_session,
+    list_sessions, count_sessions, create_new_session,
     load_session, save_message
 )
-import mysql.connector
-from mysql.connector import Error
-import hashlib
+from user_store import get_user_store, auth_tokens, login, UserStoreError
+from metrics import request_context, current_trace, summarize_trace, start_exporters, registry, DEBUG_PANEL
 
 # Global variables
 context = None
 current_session_id = None
+# Sessions listed in the sidebar per page
+SESSION_PAGE_SIZE = 25
+# Upper bound for the crawl page limit selector
+MAX_CRAWL_PAGES = 500
+# Rows of an uploaded table shown as a preview
+DATA_PREVIEW_ROWS = 100
 # --- AUTHENTICATION FUNCTIONS (from login.py) ---
-def create_connection():
-    return mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password="root",
-        database="smartlexicon"
-    )
-
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
+# Accounts live in the configured user store (pooled MySQL or SQLite, see user_store.py)
 def authenticate_user(username, password):
+    """Returns a session token for valid credentials, otherwise None."""
     try:
-        connection = create_connection()
-        cursor = connection.cursor()
-        hashed_pw = hash_password(password)
-        cursor.execute("SELECT * FROM users WHERE username = %s AND password = %s", (username, hashed_pw))
-        result = cursor.fetchone()
-        return result is not None
-    except Error as e:
+        return login(username, password)
+    except UserStoreError as e:
         st.error(f"Database error: {e}")
-        return False
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
+        return None
 
 def insert_user(username, password):
     try:
-        connection = create_connection()
-        cursor = connection.cursor()
-        hashed_pw = hash_password(password)
-        cursor.execute("INSERT INTO users (username, password) VALUES (%s, %s)", (username, hashed_pw))
-        connection.commit()
-        return True
-    except Error as e:
+        return get_user_store().create_user(username, password)
+    except UserStoreError as e:
         st.error(f"Database error: {e}")
         return False
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 def auth_style():
     st.markdown("""
@@ -88,9 +65,11 @@ def show_auth_page():
         username = st.text_input("Username", key="login_user")
         password = st.text_input("Password", type="password", key="login_pass")
         if st.button("Login", key="login_btn"):
-            if authenticate_user(username, password):
+            token = authenticate_user(username, password)
+            if token:
                 st.session_state.logged_in = True
                 st.session_state.username = username
+                st.session_state.auth_token = token
                 st.rerun()
             else:
                 st.error("Invalid credentials")
@@ -138,7 +117,9 @@ def initialize_app():
 
         # Session Selector
         st.markdown("### 💬 Chat Sessions")
-        existing_sessions = list_sessions(context, st.session_state.username)
+        page_size_key = f"session_page_size_{context}"
+        page_size = st.session_state.setdefault(page_size_key, SESSION_PAGE_SIZE)
+        existing_sessions = list_sessions(context, st.session_state.username, limit=page_size)
         session_options = [s["title"] + f" ({s['id'][:6]})" for s in existing_sessions]
         session_map = {s["title"] + f" ({s['id'][:6]})": s["id"] for s in existing_sessions}
 
@@ -146,6 +127,10 @@ def initialize_app():
         previous_session_id = st.session_state.get(f"current_session_id_{context}", None)
 
         selected_option = st.selectbox("Select a session:", session_options) if session_options else None
+        if len(existing_sessions) == page_size and count_sessions(context, st.session_state.username) > page_size:
+            if st.button("⬇️ Show older sessions"):
+                st.session_state[page_size_key] = page_size + SESSION_PAGE_SIZE
+                st.rerun()
         current_session_id = session_map[selected_option] if selected_option else None
         st.session_state[f"current_session_id_{context}"] = current_session_id
 
@@ -163,8 +148,10 @@ def initialize_app():
 
         # Logout button
         if st.button("🚪 Logout"):
+            auth_tokens.revoke(st.session_state.get("auth_token"))
             st.session_state.logged_in = False
             st.session_state.username = None
+            st.session_state.auth_token = None
             st.rerun()
 
     # --- SESSION DATA LOADING ---
@@ -174,8 +161,12 @@ def initialize_app():
             st.error("Failed to load selected session.")
             st.stop()
 
-        # Always replace session chat history on session change
-        st.session_state[f"chat_history_{context}"] = session_data["messages"]
+        # Replace the chat history only when the session or its messages changed;
+        # load_session returns a shared cached object, so keep a private copy
+        loaded_stamp = (current_session_id, id(session_data), len(session_data["messages"]))
+        if st.session_state.get(f"loaded_session_{context}") != loaded_stamp:
+            st.session_state[f"chat_history_{context}"] = list(session_data["messages"])
+            st.session_state[f"loaded_session_{context}"] = loaded_stamp
     else:
         st.warning("Please create or select a session to continue.")
         st.stop()
@@ -191,7 +182,18 @@ def initialize_app():
         data_analysis()
 
 # --- All your existing page functions remain exactly the same ---
-def chat_interface(chat_context, pdf_mode=False):
+def render_stream(chunks):
+    """Renders streamed model output incrementally in place and returns the full text."""
+    placeholder = st.empty()
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        placeholder.markdown("".join(parts) + "▌")
+    text = "".join(parts)
+    placeholder.markdown(text)
+    return text
+
+def chat_interface(chat_context, pdf_mode=False, data_frame=None, data_info=None, data_profile=None):
     st.subheader("💬 Chat with AI")
 
     for chat in st.session_state[chat_context]:
@@ -204,18 +206,34 @@ def chat_interface(chat_context, pdf_mode=False):
         st.session_state[chat_context].append({"role": "user", "content": user_input})
         save_message(context, current_session_id, "user", user_input, st.session_state.username)
 
-        if pdf_mode:
-            bot_response = query_rag(user_input, chat_history=st.session_state[chat_context])
+        with st.chat_message("user"):
+            st.markdown(user_input)
 
-        else:
-            bot_response = get_gemini_response(user_input, st.session_state[chat_context])
+        # Stream the answer into the chat, then persist it once complete
+        with st.chat_message("assistant"):
+            if data_frame is not None:
+                from data_query import stream_data_answer
+
+                # Questions about an uploaded table are planned by the model and run locally
+                stream = stream_data_answer(user_input, data_frame, data_info,
+                                            chat_history=st.session_state[chat_context],
+                                            username=st.session_state.username, session_id=current_session_id,
+                                            profile=data_profile)
+            elif pdf_mode:
+                from vector_rag import stream_rag
+
+                stream = stream_rag(user_input, chat_history=st.session_state[chat_context],
+                                    username=st.session_state.username, session_id=current_session_id)
+            else:
+                from gemini_backend import stream_gemini_response
 
+                stream = stream_gemini_response(user_input, st.session_state[chat_context],
+                                                username=st.session_state.username, context=context,
+                                                session_id=current_session_id)
+            bot_response = render_stream(stream).strip()
 
         st.session_state[chat_context].append({"role": "assistant", "content": bot_response})
         save_message(context, current_session_id, "assistant", bot_response, st.session_state.username)
-
-        with st.chat_message("assistant"):
-            st.markdown(bot_response)
     # ... (rest of your existing chat_interface function) ...
     
 def personalized_chatbot():
@@ -227,8 +245,19 @@ def document_upload():
     st.title("📄 Document Upload")
     uploaded_file = st.file_uploader("Upload your document here", type=["pdf", "txt", "docx"])
     if uploaded_file:
+        from vector_store_api import upload_pdf_to_chroma
+
+        progress_bar = st.progress(0.0, text="Uploading and indexing your document...")
+
+        def show_progress(stats):
+            progress_bar.progress(min(stats["pages_done"] / max(stats["pages_total"], 1), 1.0),
+                                  text=f"Indexed {stats['chunks_written']} chunks from {stats['pages_done']} pages...")
+
         with st.spinner("Uploading and indexing your document..."):
-            response_message = upload_pdf_to_chroma(uploaded_file)
+            response_message = upload_pdf_to_chroma(uploaded_file, username=st.session_state.username,
+                                                    session_id=current_session_id,
+                                                    progress_callback=show_progress)
+        progress_bar.empty()
         if "successfully" in response_message:
             st.success(response_message)
         else:
@@ -236,14 +265,61 @@ def document_upload():
     chat_interface("chat_history_doc", pdf_mode=True)
 
 def url_upload():
+    from webscrapping import extract_content, stream_format_with_gemini
+    from vector_store_api import crawl_to_chroma
+    from vector_rag import stream_rag
+
     st.title("🌐 URL Upload")
 
+    session_id = st.session_state["current_session_id_url"]
+    mode = st.radio("Mode:", ["Single page", "Crawl site"], horizontal=True, key="url_mode")
+    url_input = None
+
+    if mode == "Crawl site":
+        # --- Crawl a list of pages or a sitemap into the vector store ---
+        st.markdown("### 🕸️ Enter URLs or a Sitemap")
+        crawl_input = st.text_area("One URL per line (pages and/or sitemap.xml):", key="crawl_input")
+        col1, col2 = st.columns(2)
+        with col1:
+            max_pages = st.number_input("Max pages", min_value=1, max_value=MAX_CRAWL_PAGES, value=50, key="crawl_max_pages")
+        with col2:
+            pages_per_sec = st.number_input("Pages per second", min_value=0.5, max_value=50.0, value=5.0, key="crawl_rate")
+
+        if st.button("🕸️ Crawl and Index"):
+            targets = [line.strip() for line in crawl_input.splitlines() if line.strip()]
+            if targets:
+                progress_bar = st.progress(0.0, text="Crawling...")
+
+                def show_progress(stats):
+                    progress_bar.progress(min(stats["pages_done"] / max(stats["pages_total"], 1), 1.0),
+                                          text=f"Fetched {stats['pages_done']} of {stats['pages_total']} pages, "
+                                               f"indexed {stats['chunks_written']} chunks...")
+
+                with st.spinner("Crawling and indexing pages..."):
+                    response_message = crawl_to_chroma(targets, username=st.session_state.username,
+                                                       session_id=session_id, progress_callback=show_progress,
+                                                       max_pages=int(max_pages), pages_per_sec=pages_per_sec)
+                progress_bar.empty()
+
+                user_msg = "Crawl and index these URLs:\n" + "\n".join(targets)
+                st.session_state["chat_history_url"].append({"role": "user", "content": user_msg})
+                save_message("url", session_id, "user", user_msg, st.session_state.username)
+                st.session_state["chat_history_url"].append({"role": "assistant", "content": response_message})
+                save_message("url", session_id, "assistant", response_message, st.session_state.username)
+                if "successfully" in response_message:
+                    st.success(response_message)
+                else:
+                    st.error(response_message)
+            else:
+                st.warning("Please provide at least one URL or sitemap.")
+
     # --- Always-visible input fields ---
-    st.markdown("### 🔗 Enter URL and Your Requirement")
-    url_input = st.text_input("Enter URL here:", key="url_input")
-    custom_requirement = st.text_area("Describe your scraping requirements:", key="custom_requirement")
+    if mode == "Single page":
+        st.markdown("### 🔗 Enter URL and Your Requirement")
+        url_input = st.text_input("Enter URL here:", key="url_input")
+        custom_requirement = st.text_area("Describe your scraping requirements:", key="custom_requirement")
 
-    if st.button("🚀 Scrape and Format"):
+    if mode == "Single page" and st.button("🚀 Scrape and Format"):
         if url_input and custom_requirement:
             with st.spinner("Scraping content..."):
                 scraped_content = extract_content(url_input)
@@ -261,9 +337,12 @@ def url_upload():
                 st.session_state["chat_history_url"].append({"role": "assistant", "content": success_msg})
                 save_message("url", st.session_state["current_session_id_url"], "assistant", success_msg, st.session_state.username)
 
-                # Immediately format with Gemini
-                with st.spinner("Formatting with Gemini..."):
-                    formatted_output = format_with_gemini(scraped_content, custom_requirement)
+                # Immediately format with Gemini, streaming the output as it arrives
+                with st.chat_message("assistant"):
+                    formatted_output = render_stream(stream_format_with_gemini(
+                        scraped_content, custom_requirement, username=st.session_state.username,
+                        session_id=st.session_state["current_session_id_url"]
+                    ))
 
                 if formatted_output:
                     st.session_state.formatted_output = formatted_output
@@ -294,24 +373,34 @@ def url_upload():
             with st.chat_message(chat["role"]):
                 st.markdown(chat["content"])
 
-        # Follow-up chat input
+        # Follow-up chat input; questions about crawled sites are answered from the vector store
+        crawled_docs = session_documents(collection_name_for(st.session_state.username), session_id)
         user_input = st.chat_input("Ask about the scraped content...")
-        if user_input and st.session_state.get("scraped_content"):
+        if user_input and (crawled_docs or st.session_state.get("scraped_content")):
             st.session_state["chat_history_url"].append({"role": "user", "content": user_input})
             save_message("url", st.session_state["current_session_id_url"], "user", user_input, st.session_state.username)
 
-            with st.spinner("Thinking..."):
-                followup_response = format_with_gemini(
-    st.session_state.scraped_content,
-    user_input,
-    chat_history=st.session_state["chat_history_url"]
-)
+            with st.chat_message("user"):
+                st.markdown(user_input)
+
+            with st.chat_message("assistant"):
+                if crawled_docs:
+                    stream = stream_rag(user_input, chat_history=st.session_state["chat_history_url"],
+                                        username=st.session_state.username, session_id=session_id,
+                                        context="url")
+                else:
+                    stream = stream_format_with_gemini(
+                        st.session_state.scraped_content,
+                        user_input,
+                        chat_history=st.session_state["chat_history_url"],
+                        username=st.session_state.username,
+                        session_id=st.session_state["current_session_id_url"]
+                    )
+                followup_response = render_stream(stream)
 
             if followup_response:
                 st.session_state["chat_history_url"].append({"role": "assistant", "content": followup_response})
                 save_message("url", st.session_state["current_session_id_url"], "assistant", followup_response, st.session_state.username)
-                with st.chat_message("assistant"):
-                    st.markdown(followup_response)
             else:
                 err_msg = "❌ Gemini failed to respond."
                 st.session_state["chat_history_url"].append({"role": "assistant", "content": err_msg})
@@ -348,25 +437,86 @@ def url_upload():
             st.info("No content scraped yet. Enter a URL to begin.")
 
 def data_analysis():
+    from data_loader import load_table, load_session_table
+    from data_profile import get_profile, load_profile, profile_frame
+
     st.title("📊 Data Analysis")
     uploaded_excel = st.file_uploader("Upload your Excel file here", type=["xlsx", "csv"])
     if uploaded_excel:
-        st.success("Excel file uploaded successfully! 🟢")
-    chat_interface("chat_history_data")
+        # Parsed once per file; reruns are served from the in-process cache or the Parquet copy
+        with st.spinner("Loading your data..."):
+            try:
+                df, info = load_table(uploaded_excel.getvalue(), uploaded_excel.name,
+                                      st.session_state.username, session_id=current_session_id)
+            except Exception as e:
+                df, info = None, None
+                st.error(f"Error: Failed to read {uploaded_excel.name}: {e}")
+            profile = None
+            if df is not None:
+                # One streaming pass over the file, cached by its hash like the table itself
+                try:
+                    profile = get_profile(uploaded_excel.getvalue(), uploaded_excel.name,
+                                          st.session_state.username, data_hash=info["file_hash"])
+                except Exception as e:
+                    st.warning(f"Column profile unavailable for {uploaded_excel.name}: {e}")
+        if df is not None:
+            st.success("Excel file uploaded successfully! 🟢")
+    else:
+        df, info = load_session_table(st.session_state.username, current_session_id)
+        profile = load_profile(st.session_state.username, info["file_hash"]) if info else None
+
+    if df is not None:
+        st.caption(f"{info['filename']}: {info['rows']:,} rows × {info['columns']} columns, "
+                   f"{info['memory_bytes'] / 1e6:.1f} MB in memory")
+        st.dataframe(df.head(DATA_PREVIEW_ROWS))
+        if profile is not None:
+            with st.expander("📈 Column profile"):
+                st.dataframe(profile_frame(profile))
+    chat_interface("chat_history_data", data_frame=df, data_info=info, data_profile=profile)
     
 
+def debug_panel(request_id):
+    """Sidebar breakdown of where this rerun spent its time, stage by stage."""
+    with st.sidebar.expander("🛠️ Timings"):
+        st.caption(f"Request ID: {request_id}")
+        rows = summarize_trace(current_trace())
+        if rows:
+            st.dataframe(rows)
+        else:
+            st.write("No stages recorded in this run.")
+        if st.checkbox("Show model usage (24h)", key="show_model_usage"):
+            from llm_accounting import accountant
+
+            st.dataframe(accountant.report(hours=24, group_by="feature"))
+        if st.checkbox("Show process metrics", key="show_process_metrics"):
+            st.code(registry.render_prometheus(), language="text")
+
 # --- MAIN APP FLOW CONTROL ---
 def main():
+    # /metrics endpoint and metrics file, when configured
+    start_exporters()
+
     # Initialize session state for auth
     if 'logged_in' not in st.session_state:
         st.session_state.logged_in = False
         st.session_state.username = None
     
+    # Reruns check the cached session token instead of the database; an expired token logs the user out
+    if st.session_state.logged_in and auth_tokens.validate(st.session_state.get("auth_token")) != st.session_state.username:
+        st.session_state.logged_in = False
+        st.session_state.username = None
+        st.session_state.auth_token = None
+        st.info("Your session has expired. Please log in again.")
+
     # Show auth page if not logged in, else show main app
     if not st.session_state.logged_in:
         show_auth_page()
     else:
-        initialize_app()
+        # Every stage timed during this rerun shares one correlation ID
+        with request_context() as request_id:
+            initialize_app()
+            if DEBUG_PANEL:
+                debug_panel(request_id)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,78 @@
+# benchmarks/bench_html_parsing.py
+"""
+Times parse_html for each installed backend on the saved pages in
+fixtures/html, plus synthetic multi-megabyte pages made by repeating a
+fixture's body.
+
+    python benchmarks/bench_html_parsing.py [repeats]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from html_parsing import available_backends, parse_html
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "html")
+# Approximate sizes of the synthetic large pages, in bytes
+SCALED_SIZES = (1 * 1024 * 1024, 4 * 1024 * 1024)
+
+def load_fixtures():
+    fixtures = {}
+    for fname in sorted(os.listdir(FIXTURES_DIR)):
+        if fname.endswith(".html"):
+            with open(os.path.join(FIXTURES_DIR, fname), "rb") as f:
+                fixtures[fname[:-5]] = f.read()
+    return fixtures
+
+def scale_page(content, target_bytes):
+    """Repeats the body of a page until the document is about target_bytes long."""
+    start = content.index(b"<body")
+    start = content.index(b">", start) + 1
+    end = content.rindex(b"</body>")
+    body = content[start:end]
+    copies = max(target_bytes // max(len(body), 1), 1)
+    return content[:start] + body * copies + content[end:]
+
+def time_parse(content, backend, repeats):
+    parse_html(content, backend=backend, max_bytes=len(content))  # warm-up
+    started = time.perf_counter()
+    for _ in range(repeats):
+        result = parse_html(content, backend=backend, max_bytes=len(content))
+    return (time.perf_counter() - started) * 1000 / repeats, len(result["text_content"])
+
+def run(repeats=5):
+    backends = available_backends()
+    fixtures = load_fixtures()
+    cases = list(fixtures.items())
+    largest = max(fixtures, key=lambda name: len(fixtures[name]))
+    for size in SCALED_SIZES:
+        cases.append((f"{largest}_x{size // (1024 * 1024)}MB", scale_page(fixtures[largest], size)))
+
+    rows = []
+    for name, content in cases:
+        baseline = None
+        # Fewer repeats for the multi-megabyte pages
+        case_repeats = repeats if len(content) < 1024 * 1024 else max(repeats // 5, 1)
+        timings = {backend: time_parse(content, backend, case_repeats) for backend in backends}
+        if "html.parser" in timings:
+            baseline = timings["html.parser"][0]
+        for backend, (ms, text_chars) in timings.items():
+            rows.append({
+                "page": name,
+                "bytes": len(content),
+                "backend": backend,
+                "ms_per_parse": round(ms, 2),
+                "text_chars": text_chars,
+                "speedup": round(baseline / ms, 1) if baseline else None
+            })
+    return rows
+
+if __name__ == "__main__":
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f"{'page':<28} {'bytes':>9} {'backend':<12} {'ms/parse':>9} {'text':>8} {'speedup':>8}")
+    for row in run(repeats):
+        speedup = f"{row['speedup']}x" if row["speedup"] else "-"
+        print(f"{row['page']:<28} {row['bytes']:>9} {row['backend']:<12} {row['ms_per_parse']:>9} "
+              f"{row['text_chars']:>8} {speedup:>8}")
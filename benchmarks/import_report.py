@@ -0,0 +1,103 @@
+# benchmarks/import_report.py
+"""
+Reports cold-start import cost of the app and its backend modules, each
+measured in a fresh interpreter, and which heavy packages every module
+pulls in at import time. Importing app.py is what the login page pays.
+
+    python benchmarks/import_report.py [--runs N] [--top N] [--budget-ms MS] [module ...]
+
+Exits with status 1 when importing app takes longer than --budget-ms.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_MODULES = ("app", "gemini_backend", "webscrapping", "vector_rag", "vector_store_api",
+                   "data_query", "session_manager")
+# Packages that should only load once a feature actually needs them
+HEAVY_PACKAGES = ("langchain", "langchain_core", "langchain_community", "langchain_chroma",
+                  "langchain_google_genai", "chromadb", "google.generativeai", "pandas", "numpy",
+                  "pyarrow", "PyPDF2", "openpyxl", "bs4", "lxml", "selectolax")
+# Cold-start budget for importing app.py, in milliseconds
+DEFAULT_BUDGET_MS = 1500
+
+def _run(code, extra_args=()):
+    return subprocess.run([sys.executable, *extra_args, "-c", code], cwd=REPO_ROOT,
+                          capture_output=True, text=True)
+
+def wall_time_ms(module, runs):
+    """Median wall-clock time of importing module in a fresh interpreter, minus interpreter startup."""
+    code = ("import time; started = time.perf_counter(); import {module}; "
+            "print((time.perf_counter() - started) * 1000)").format(module=module)
+    samples = []
+    for _ in range(runs):
+        result = _run(code)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed")
+        samples.append(float(result.stdout.strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+def heavy_modules_loaded(module):
+    code = ("import sys, json; import {module}; "
+            "print(json.dumps(sorted(name for name in {heavy!r} if name in sys.modules)))").format(
+                module=module, heavy=HEAVY_PACKAGES)
+    result = _run(code)
+    return json.loads(result.stdout.strip().splitlines()[-1]) if result.returncode == 0 else []
+
+def _import_times(code):
+    result = _run(code, ("-X", "importtime"))
+    totals = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if not cumulative.isdigit():
+            continue
+        package = name.split(".")[0]
+        # The outermost entry of a package carries its cumulative time
+        totals[package] = max(totals.get(package, 0), int(cumulative))
+    return totals
+
+def slowest_imports(module, top):
+    """Top-level packages with the largest cumulative import time, excluding interpreter startup."""
+    startup = _import_times("pass")
+    totals = {package: micros for package, micros in _import_times(f"import {module}").items()
+              if package not in startup and package != module}
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    args = parser.parse_args()
+
+    app_ms = None
+    print(f"{'module':<18} {'import ms':>10}  heavy packages loaded")
+    for module in args.modules:
+        try:
+            ms = wall_time_ms(module, args.runs)
+        except RuntimeError as e:
+            print(f"{module:<18} {'error':>10}  {e}")
+            continue
+        if module == "app":
+            app_ms = ms
+        print(f"{module:<18} {ms:>10.1f}  {', '.join(heavy_modules_loaded(module)) or '-'}")
+
+    for module in args.modules[:1]:
+        print(f"\nSlowest imports under {module} (cumulative ms):")
+        for package, micros in slowest_imports(module, args.top):
+            print(f"  {package:<28} {micros / 1000:>8.1f}")
+
+    if app_ms is not None and app_ms > args.budget_ms:
+        print(f"\nFAIL: importing app took {app_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
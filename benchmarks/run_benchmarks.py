@@ -0,0 +1,366 @@
+# benchmarks/run_benchmarks.py
+"""
+Offline benchmark suite. Remote models are replaced by the deterministic
+fakes in fakes.py and every store (Chroma, sessions, caches) lives in a
+temporary directory, so runs are repeatable and never touch real data.
+
+Suites:
+    ingest    upload_pdf_to_chroma throughput on generated PDFs
+    rag       query_rag latency against collections of increasing size
+    sessions  save_message / load_session / list_sessions latency vs history length and session count
+    html      extract_content (local HTTP fetch + parse) time on the saved HTML fixtures
+
+    python benchmarks/run_benchmarks.py [--only ingest,rag] [--quick]
+        [--output results.json] [--baseline baseline.json] [--tolerance 0.25] [--save-baseline path]
+
+Results are written as JSON. With --baseline every metric is compared to
+the stored value and the run exits with status 1 when any metric regressed
+by more than the tolerance (throughputs "*_per_sec" must not drop, latencies
+"*_ms" must not rise).
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import shutil
+import tempfile
+import statistics
+import subprocess
+import threading
+from datetime import datetime, timezone
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, REPO_ROOT)
+
+FIXTURES_DIR = os.path.join(REPO_ROOT, "benchmarks", "fixtures", "html")
+DEFAULT_OUTPUT = os.path.join(REPO_ROOT, "benchmarks", "results", "latest.json")
+SUITES = ("ingest", "rag", "sessions", "html")
+# Relative change beyond which a metric counts as a regression
+DEFAULT_TOLERANCE = 0.25
+
+WORDS = ("contract warranty clause delivery invoice policy section customer support shipping returns "
+         "performance latency memory parser document index retrieval answer summary report revenue "
+         "growth market analysis pump housing component").split()
+
+def _sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + f" ref {rng.randint(1000, 9999)}."
+
+def make_pdf(num_pages, seed=0, lines_per_page=45):
+    """Builds a text PDF with num_pages pages of pseudo-random sentences, without any PDF library."""
+    rng = random.Random(seed)
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for _ in range(num_pages):
+        lines = " T* ".join(f"({_sentence(rng)}) Tj" for _ in range(lines_per_page))
+        stream = f"BT /F1 9 Tf 40 760 Td 16 TL {lines} ET".encode("latin-1")
+        page_number = len(objects) + 1
+        kids.append(f"{page_number} 0 R")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+            f"/Contents {page_number + 1} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {num_pages} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+class _Upload:
+    """Minimal stand-in for Streamlit's UploadedFile."""
+
+    def __init__(self, data, name):
+        self._data = data
+        self.name = name
+
+    def getvalue(self):
+        return self._data
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def _latency_stats(samples_ms, prefix=""):
+    return {
+        f"{prefix}p50_ms": round(statistics.median(samples_ms), 3),
+        f"{prefix}p95_ms": round(_percentile(samples_ms, 0.95), 3)
+    }
+
+def _use_fake_models(embed_latency, chat_latency):
+    import vector_rag
+    import vector_store_api
+    from fakes import FakeEmbeddings, make_fake_chat_model
+
+    embedder = FakeEmbeddings(dim=256, latency=embed_latency)
+    chat_model = make_fake_chat_model(latency=chat_latency)
+    vector_store_api.get_cached_embeddings = lambda *args: embedder
+    vector_rag.get_cached_embeddings = lambda *args: embedder
+    vector_rag.get_chat_model = lambda: chat_model
+    return embedder
+
+def bench_ingest(quick, embed_latency):
+    from vector_store_api import upload_pdf_to_chroma
+
+    _use_fake_models(embed_latency, 0.0)
+    results = {}
+    for num_pages in ((10, 50) if quick else (10, 100, 300)):
+        pdf = make_pdf(num_pages, seed=num_pages)
+        chunks = {}
+        started = time.perf_counter()
+        message = upload_pdf_to_chroma(_Upload(pdf, f"bench_{num_pages}.pdf"), username="bench_ingest",
+                                       progress_callback=lambda stats: chunks.update(stats))
+        elapsed = time.perf_counter() - started
+        if message.startswith("Error"):
+            raise RuntimeError(message)
+        results[f"pages_{num_pages}"] = {
+            "pages_per_sec": round(num_pages / elapsed, 2),
+            "chunks_per_sec": round(chunks.get("chunks_written", 0) / elapsed, 2),
+            "elapsed_ms": round(elapsed * 1000, 1)
+        }
+    return results
+
+def bench_rag(quick, embed_latency, chat_latency, queries):
+    from vector_rag import query_rag, get_vector_store
+    from vector_store_api import _index_sink
+    from document_registry import collection_name_for
+    from ingestion_pipeline import run_ingestion
+    from lexical_index import get_lexical_index
+
+    embedder = _use_fake_models(embed_latency, chat_latency)
+    rng = random.Random(7)
+    results = {}
+    for size in ((200, 2000) if quick else (200, 2000, 10000)):
+        username = f"bench_rag_{size}"
+        collection = collection_name_for(username)
+        records = ({"id": f"doc{size}:{i}", "text": " ".join(_sentence(rng) for _ in range(6)),
+                    "metadata": {"doc_id": f"doc{size}", "source": "bench"}} for i in range(size))
+        lexical_index = get_lexical_index(collection)
+        run_ingestion(records, embedder, _index_sink(get_vector_store(username), lexical_index), batch_size=64)
+        lexical_index.save()
+
+        samples = []
+        for i in range(queries):
+            # Distinct questions so the response cache never answers
+            question = f"What does the {rng.choice(WORDS)} {rng.choice(WORDS)} clause say about item {i}?"
+            started = time.perf_counter()
+            answer = query_rag(question, username=username)
+            samples.append((time.perf_counter() - started) * 1000)
+            if answer.startswith("Error"):
+                raise RuntimeError(answer)
+        results[f"chunks_{size}"] = _latency_stats(samples)
+    return results
+
+def bench_sessions(quick):
+    from session_manager import create_new_session, save_message, load_session, list_sessions
+
+    results = {}
+    for history in ((10, 500) if quick else (10, 500, 5000)):
+        session_id = create_new_session("chatbot", "bench_history")
+        for i in range(history):
+            save_message("chatbot", session_id, "user" if i % 2 == 0 else "assistant", _sentence(random.Random(i)), "bench_history")
+        save_samples, load_samples = [], []
+        for i in range(50):
+            started = time.perf_counter()
+            save_message("chatbot", session_id, "user", f"benchmark message {i}", "bench_history")
+            save_samples.append((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            load_session("chatbot", session_id, "bench_history")
+            load_samples.append((time.perf_counter() - started) * 1000)
+        results[f"history_{history}"] = {**_latency_stats(save_samples, "save_"), **_latency_stats(load_samples, "load_")}
+
+    created = 0
+    for count in ((10, 500) if quick else (10, 500, 5000)):
+        while created < count:
+            session_id = create_new_session("doc", "bench_list")
+            save_message("doc", session_id, "user", f"session {created}", "bench_list")
+            created += 1
+        samples = []
+        for _ in range(50):
+            started = time.perf_counter()
+            list_sessions("doc", "bench_list", limit=25)
+            samples.append((time.perf_counter() - started) * 1000)
+        results[f"sessions_{count}"] = _latency_stats(samples, "list_")
+    return results
+
+def bench_html(quick):
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+    from html_parsing import parse_html
+    from webscrapping import extract_content
+
+    class Handler(SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=FIXTURES_DIR, **kwargs)
+
+        def end_headers(self):
+            # Every request goes to the network and through the parser
+            self.send_header("Cache-Control", "no-store")
+            super().end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    results = {}
+    try:
+        for fname in sorted(os.listdir(FIXTURES_DIR)):
+            if not fname.endswith(".html"):
+                continue
+            url = f"http://127.0.0.1:{server.server_port}/{fname}"
+            with open(os.path.join(FIXTURES_DIR, fname), "rb") as f:
+                content = f.read()
+            extract_samples, parse_samples = [], []
+            for _ in range(5 if quick else 20):
+                started = time.perf_counter()
+                if extract_content(url) is None:
+                    raise RuntimeError(f"extract_content failed for {url}")
+                extract_samples.append((time.perf_counter() - started) * 1000)
+                started = time.perf_counter()
+                parse_html(content)
+                parse_samples.append((time.perf_counter() - started) * 1000)
+            results[fname[:-5]] = {**_latency_stats(extract_samples, "extract_"), **_latency_stats(parse_samples, "parse_")}
+    finally:
+        server.shutdown()
+    return results
+
+def flatten(results, prefix=""):
+    """Turns nested results into {"suite.case.metric": value} for numeric leaves."""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+def compare(current, baseline, tolerance):
+    """Returns rows (metric, baseline, current, change, regressed) for metrics present in both runs."""
+    rows = []
+    current_flat, baseline_flat = flatten(current), flatten(baseline)
+    for metric in sorted(set(current_flat) & set(baseline_flat)):
+        old, new = baseline_flat[metric], current_flat[metric]
+        if not old:
+            continue
+        change = (new - old) / old
+        if metric.endswith("_per_sec"):
+            regressed = change < -tolerance
+        elif metric.endswith("_ms"):
+            regressed = change > tolerance
+        else:
+            regressed = False
+        rows.append((metric, old, new, change, regressed))
+    return rows
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def _html_backend():
+    try:
+        from html_parsing import get_backend
+        return get_backend()
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite")
+    parser.add_argument("--only", default=",".join(SUITES), help="Comma-separated suites to run")
+    parser.add_argument("--quick", action="store_true", help="Smaller sizes for a fast smoke run")
+    parser.add_argument("--queries", type=int, default=20, help="query_rag calls per collection size")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Seconds per fake embedding call")
+    parser.add_argument("--chat-latency", type=float, default=0.0, help="Seconds per fake chat call")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", help="Results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--save-baseline", help="Also write the results to this baseline file")
+    args = parser.parse_args()
+
+    suites = [name.strip() for name in args.only.split(",") if name.strip()]
+    runners = {
+        "ingest": lambda: bench_ingest(args.quick, args.embed_latency),
+        "rag": lambda: bench_rag(args.quick, args.embed_latency, args.chat_latency, args.queries),
+        "sessions": lambda: bench_sessions(args.quick),
+        "html": lambda: bench_html(args.quick),
+    }
+
+    # All stores use relative paths, so a scratch working directory isolates them
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    previous_dir = os.getcwd()
+    os.chdir(workdir)
+    # The usage rollup is written lazily (background thread, atexit), after the cwd is restored;
+    # give metered fake calls their own file so they never reach the real one
+    import llm_accounting
+    real_accountant = llm_accounting.accountant
+    llm_accounting.accountant = llm_accounting.UsageAccountant(os.path.join(workdir, "llm_usage.sqlite3"))
+    results = {}
+    errors = {}
+    try:
+        for suite in suites:
+            started = time.perf_counter()
+            try:
+                results[suite] = runners[suite]()
+            except Exception as e:
+                errors[suite] = f"{type(e).__name__}: {e}"
+                print(f"{suite}: skipped ({errors[suite]})")
+                continue
+            print(f"{suite}: done in {time.perf_counter() - started:.1f}s")
+    finally:
+        llm_accounting.accountant.close()
+        llm_accounting.accountant = real_accountant
+        os.chdir(previous_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": args.quick,
+            "embed_latency": args.embed_latency,
+            "chat_latency": args.chat_latency,
+            "html_backend": _html_backend()
+        },
+        "results": results,
+        "errors": errors
+    }
+    for path in filter(None, (args.output, args.save_baseline)):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    print(f"\n{'metric':<52} {'value':>12}")
+    for metric, value in flatten(results).items():
+        print(f"{metric:<52} {value:>12}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline.get("results", {}), args.tolerance)
+        regressions = [row for row in rows if row[4]]
+        print(f"\nCompared with {args.baseline} (tolerance {args.tolerance:.0%}):")
+        for metric, old, new, change, regressed in rows:
+            print(f"{'REGRESSED' if regressed else 'ok':<10} {metric:<52} {old:>10} -> {new:<10} ({change:+.1%})")
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
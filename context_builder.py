@@ -0,0 +1,136 @@
+# context_builder.py
+import os
+import json
+import asyncio
+import hashlib
+from dotenv import load_dotenv
+from session_manager import load_session, save_session_summary
+
+load_dotenv()
+
+# Token budget for conversation history in a prompt (summary + recent turns)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Token budget for the rolling summary of older turns
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "300"))
+# Minimum number of messages folded into the summary at once, so it is not rewritten every turn
+SUMMARIZE_BATCH = 6
+# The most recent messages are always kept verbatim
+MIN_RECENT_MESSAGES = 2
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token), good enough for budgeting."""
+    return len(text) // 4 + 1
+
+def _truncate(text, tokens):
+    limit = tokens * 4
+    return text if len(text) <= limit else text[:limit] + " …"
+
+def _format_message(message):
+    speaker = "User" if message["role"] == "user" else "Assistant"
+    return f"{speaker}: {message['content']}"
+
+def _without_current(chat_history, current_question):
+    # Callers append the question to the history before asking; it is sent separately
+    if (chat_history and current_question is not None and chat_history[-1]["role"] == "user"
+            and chat_history[-1]["content"] == current_question):
+        return chat_history[:-1]
+    return chat_history
+
+async def _default_summarize(summary, messages, username=None):
+    from gemini_backend import get_model
+    from model_client import model_client
+
+    transcript = "\n".join(_format_message(message) for message in messages)
+    prompt = (
+        "You maintain a running summary of a conversation between a user and an assistant.\n"
+        f"Current summary:\n{summary or '(empty)'}\n\n"
+        f"New messages:\n{transcript}\n\n"
+        f"Write the updated summary in at most {SUMMARY_TOKEN_BUDGET * 3 // 4} words. Keep facts, names, "
+        "numbers, decisions and open questions; drop pleasantries."
+    )
+    return (await model_client.generate(get_model(), prompt, username=username, feature="summary")).strip()
+
+def history_fingerprint(chat_history, current_question=None):
+    """
+    Short hash of the conversation before the current question, or "" when
+    there is none. Cached answers are scoped by it, so a follow-up such as
+    "why?" is only reused within the same conversation state.
+    """
+    history = _without_current(chat_history or [], current_question)
+    if not history:
+        return ""
+    encoded = json.dumps([[m["role"], m["content"]] for m in history], ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:16]
+
+def _window_start(history, summarized_count, budget, summary):
+    """Index of the oldest unsummarized message that still fits the budget next to the summary."""
+    remaining = budget - (estimate_tokens(summary) if summary else 0)
+    window_start = len(history)
+    for index in range(len(history) - 1, summarized_count - 1, -1):
+        cost = estimate_tokens(_format_message(history[index]))
+        if cost > remaining and len(history) - index > MIN_RECENT_MESSAGES:
+            break
+        remaining -= cost
+        window_start = index
+    return window_start
+
+async def build_history_context(chat_history, current_question=None, context=None, session_id=None,
+                                username=None, budget=CONTEXT_TOKEN_BUDGET, summarize_fn=None):
+    """
+    Assembles conversation history for a prompt within a token budget.
+
+    The newest messages (user and assistant turns) are kept verbatim, newest
+    first, until the budget is spent. Older messages are folded into a
+    rolling summary that is stored with the session and only extended with
+    the messages that fell out of the window, never recomputed from scratch.
+    Folding waits until SUMMARIZE_BATCH messages have fallen out; until then,
+    and always without a session, the overflow is simply dropped.
+
+    Args:
+        chat_history (list): Messages as {"role", "content"} dicts, oldest first.
+        current_question (str, optional): Dropped from the end of the history if present.
+        context, session_id, username: Identify the session holding the summary.
+        budget (int): Token budget for the returned text.
+        summarize_fn (coroutine function, optional): (summary, messages, username) -> new summary.
+
+    Returns:
+        str: The history block for the prompt, or "" when there is none.
+    """
+    history = _without_current(chat_history or [], current_question)
+    if not history:
+        return ""
+
+    persistent = bool(context and session_id and username)
+    summary, summarized_count = "", 0
+    if persistent:
+        # Session files are read and written off the shared model loop
+        session = await asyncio.to_thread(load_session, context, session_id, username) or {}
+        state = session.get("summary") or {}
+        summary = state.get("summary", "")
+        summarized_count = min(state.get("summarized_count", 0), len(history))
+
+    window_start = _window_start(history, summarized_count, budget, summary)
+
+    # Fold the messages that fell out of the window into the summary once a full batch has
+    # accumulated; until then they are left out of the prompt rather than summarized every turn
+    if persistent and window_start - summarized_count >= SUMMARIZE_BATCH:
+        summarize_fn = summarize_fn or _default_summarize
+        summary = _truncate(
+            await summarize_fn(summary, history[summarized_count:window_start], username),
+            SUMMARY_TOKEN_BUDGET
+        )
+        summarized_count = window_start
+        await asyncio.to_thread(save_session_summary, context, session_id, username, summary, summarized_count)
+        # The new summary may take more of the budget than the old one did
+        window_start = _window_start(history, summarized_count, budget, summary)
+
+    # Messages kept regardless of size (the most recent ones) are truncated to their share of the budget
+    per_message = max(budget // MIN_RECENT_MESSAGES, 50)
+    recent = [_truncate(_format_message(message), per_message) for message in history[window_start:]]
+
+    parts = []
+    if summary:
+        parts.append(f"Summary of the earlier conversation:\n{summary}")
+    if recent:
+        parts.append("Recent conversation:\n" + "\n".join(recent))
+    return "\n\n".join(parts)
@@ -0,0 +1,308 @@
+# crawler.py
+import os
+import gzip
+import time
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+import requests
+from http_client import fetch, USER_AGENT
+from html_parsing import parse_html
+from document_registry import file_hash
+
+# Crawl limits, overridable from the environment
+CRAWL_MAX_IN_FLIGHT = int(os.getenv("CRAWL_MAX_IN_FLIGHT", "8"))
+CRAWL_PAGES_PER_SEC = float(os.getenv("CRAWL_PAGES_PER_SEC", "5"))
+CRAWL_MAX_PAGES = int(os.getenv("CRAWL_MAX_PAGES", "200"))
+# Politeness towards each host: concurrent requests and seconds between request starts
+CRAWL_PER_HOST = 2
+CRAWL_HOST_DELAY = 0.5
+# Nested sitemap indexes followed at most this deep
+MAX_SITEMAP_DEPTH = 3
+# Content types handed to the HTML parser
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+# Targets with these extensions are read as sitemaps; entries of a sitemap index always are
+SITEMAP_SUFFIXES = (".xml", ".xml.gz")
+
+def _host(url):
+    return urlsplit(url).netloc.lower()
+
+def is_sitemap_url(url):
+    return urlsplit(url).path.lower().endswith(SITEMAP_SUFFIXES)
+
+class RateLimiter:
+    """
+    Spaces request starts at most pages_per_sec overall and at least a
+    host's delay apart per host. One limiter is shared by sitemap discovery
+    and the page crawl, so both count against the same politeness budget.
+
+    Args:
+        pages_per_sec (float): Overall request start rate; 0 for unlimited.
+        host_delay (float): Minimum seconds between request starts to one host.
+    """
+
+    def __init__(self, pages_per_sec=CRAWL_PAGES_PER_SEC, host_delay=CRAWL_HOST_DELAY):
+        self.interval = 1.0 / pages_per_sec if pages_per_sec else 0.0
+        self.host_delay = host_delay
+        self._delays = {}
+        self._host_next_start = defaultdict(float)
+        self._next_start = 0.0
+        self._lock = threading.Lock()
+
+    def set_delay(self, host, delay):
+        """Raises a host's delay, e.g. to its robots.txt Crawl-delay."""
+        with self._lock:
+            self._delays[host] = max(self.host_delay, float(delay or 0))
+
+    def start_at(self, host):
+        """Monotonic time at which the next request to host may start."""
+        with self._lock:
+            return max(self._host_next_start[host], self._next_start)
+
+    def reserve(self, host, now=None):
+        """Records a request start to host at now."""
+        with self._lock:
+            now = time.monotonic() if now is None else now
+            self._host_next_start[host] = now + self._delays.get(host, self.host_delay)
+            self._next_start = now + self.interval
+
+    def wait(self, host):
+        """Blocks until a request to host may start, then reserves it."""
+        while True:
+            delay = self.start_at(host) - time.monotonic()
+            if delay <= 0:
+                self.reserve(host)
+                return
+            time.sleep(delay)
+
+def parse_sitemap(content):
+    """
+    Parses a sitemap or sitemap index, gzip-compressed or not.
+
+    Returns:
+        tuple: (page_urls, sitemap_urls) in document order.
+    """
+    if content[:2] == b"\x1f\x8b":
+        content = gzip.decompress(content)
+    root = ET.fromstring(content)
+    locs = [node.text.strip() for node in root.iter() if node.tag.endswith("loc") and node.text]
+    if root.tag.endswith("sitemapindex"):
+        return [], locs
+    return locs, []
+
+def discover_urls(targets, max_pages=CRAWL_MAX_PAGES, fetch_fn=fetch, limiter=None):
+    """
+    Expands a list of page and sitemap URLs into at most max_pages unique
+    page URLs, following sitemap indexes breadth-first. Sitemap requests go
+    through limiter (a new RateLimiter by default), like page requests.
+    """
+    limiter = limiter or RateLimiter()
+    pages = []
+    seen = set()
+    queue = deque((target.strip(), 0, is_sitemap_url(target.strip())) for target in targets if target.strip())
+    while queue and len(pages) < max_pages:
+        url, depth, sitemap = queue.popleft()
+        if url in seen or urlsplit(url).scheme not in ("http", "https"):
+            continue
+        seen.add(url)
+        if not sitemap:
+            pages.append(url)
+            continue
+        try:
+            limiter.wait(_host(url))
+            page_urls, sitemap_urls = parse_sitemap(fetch_fn(url).content)
+        except (requests.exceptions.RequestException, ET.ParseError, OSError, EOFError) as e:
+            print(f"Error reading sitemap {url}: {e}")
+            continue
+        if depth < MAX_SITEMAP_DEPTH:
+            queue.extend((sitemap_url, depth + 1, True) for sitemap_url in sitemap_urls)
+        for page_url in page_urls:
+            if page_url not in seen and len(pages) < max_pages:
+                seen.add(page_url)
+                pages.append(page_url)
+    return pages
+
+def _load_robots(host_url, fetch_fn):
+    """
+    Returns the host's robots.txt rules, or None when it has none (everything
+    allowed). A 401 or 403 on robots.txt means the whole host is off limits.
+    """
+    rules = RobotFileParser()
+    try:
+        response = fetch_fn(host_url + "/robots.txt")
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code in (401, 403):
+            rules.disallow_all = True
+            return rules
+        return None
+    except requests.exceptions.RequestException:
+        return None
+    rules.parse(response.text.splitlines())
+    return rules
+
+def _fetch_page(url, fetch_fn):
+    started = time.perf_counter()
+    result = {"url": url, "doc_id": None, "page": None, "error": None, "from_cache": False}
+    try:
+        response = fetch_fn(url)
+        content_type = (response.headers.get("Content-Type") or "text/html").split(";")[0].strip().lower()
+        if content_type not in HTML_CONTENT_TYPES:
+            result["error"] = f"Unsupported content type {content_type}"
+        else:
+            page = parse_html(response.content, encoding=response.encoding)
+            result["page"] = page
+            result["doc_id"] = file_hash(f"{url}\n{page['text_content']}".encode("utf-8"))
+            result["from_cache"] = response.from_cache
+    except requests.exceptions.RequestException as e:
+        result["error"] = str(e)
+    except Exception as e:
+        result["error"] = f"Error parsing page: {e}"
+    result["elapsed"] = time.perf_counter() - started
+    return result
+
+def crawl_pages(urls, max_in_flight=CRAWL_MAX_IN_FLIGHT, pages_per_sec=CRAWL_PAGES_PER_SEC,
+                per_host=CRAWL_PER_HOST, host_delay=CRAWL_HOST_DELAY, respect_robots=True, fetch_fn=fetch,
+                limiter=None):
+    """
+    Fetches and parses pages concurrently, yielding one result per URL as
+    each completes (not in input order).
+
+    A scheduler hands URLs to a pool of max_in_flight workers, round-robin
+    across hosts, so a slow or rate-limited host does not hold up the others.
+    Request starts are spaced to at most pages_per_sec overall, each host
+    gets at most per_host concurrent requests spaced host_delay seconds apart
+    (or its robots.txt Crawl-delay, if longer), and URLs disallowed by
+    robots.txt are reported without being fetched. The consumer applies
+    back-pressure: no new requests start while a result is being processed.
+
+    Args:
+        urls (list): Page URLs to fetch.
+        max_in_flight (int): Requests in progress at once across all hosts.
+        pages_per_sec (float): Overall request start rate; 0 for unlimited.
+        per_host (int): Concurrent requests per host.
+        host_delay (float): Minimum seconds between request starts to one host.
+        respect_robots (bool): Honour robots.txt rules and Crawl-delay.
+        fetch_fn (callable): Fetcher with the signature of http_client.fetch.
+        limiter (RateLimiter, optional): Limiter shared with discover_urls; when given,
+            it replaces pages_per_sec and host_delay.
+
+    Yields:
+        dict: {"url", "doc_id", "page", "error", "from_cache", "elapsed"}; "page" is
+            the parse_html result, or None when "error" is set.
+    """
+    queues = OrderedDict()
+    for url in dict.fromkeys(urls):
+        queues.setdefault(_host(url), deque()).append(url)
+    limiter = limiter or RateLimiter(pages_per_sec, host_delay)
+    robots = {}
+    host_in_flight = defaultdict(int)
+    in_flight = {}
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        while queues or in_flight:
+            blocked = []
+            wake_at = None
+            for host in list(queues):
+                if len(in_flight) >= max_in_flight:
+                    break
+                if host_in_flight[host] >= per_host:
+                    continue
+                if respect_robots and host not in robots:
+                    parts = urlsplit(queues[host][0])
+                    robots[host] = _load_robots(f"{parts.scheme}://{parts.netloc}", fetch_fn)
+                    if robots[host]:
+                        limiter.set_delay(host, robots[host].crawl_delay(USER_AGENT))
+                now = time.monotonic()
+                start_at = limiter.start_at(host)
+                if start_at > now:
+                    wake_at = start_at if wake_at is None else min(wake_at, start_at)
+                    continue
+                url = queues[host].popleft()
+                if not queues[host]:
+                    del queues[host]
+                else:
+                    queues.move_to_end(host)
+                if robots.get(host) and not robots[host].can_fetch(USER_AGENT, url):
+                    blocked.append({"url": url, "doc_id": None, "page": None, "error": "Disallowed by robots.txt",
+                                    "from_cache": False, "elapsed": 0.0})
+                    continue
+                host_in_flight[host] += 1
+                limiter.reserve(host, now)
+                in_flight[executor.submit(_fetch_page, url, fetch_fn)] = host
+
+            yield from blocked
+            if not in_flight:
+                if wake_at is not None:
+                    time.sleep(max(wake_at - time.monotonic(), 0))
+                continue
+            timeout = None if wake_at is None else max(wake_at - time.monotonic(), 0)
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                host_in_flight[in_flight.pop(future)] -= 1
+                yield future.result()
+
+
+# Manual check against a local HTTP server: crawls a sitemap across two hosts
+# and reports throughput and the peak number of concurrent requests per host
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    import http_client
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    num_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    active = defaultdict(int)
+    peak = defaultdict(int)
+    counter_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            port = self.server.server_port
+            if self.path == "/robots.txt":
+                body, content_type = b"User-agent: *\nDisallow: /private/\n", "text/plain"
+            elif self.path == "/sitemap.xml":
+                locs = "".join(f"<url><loc>http://127.0.0.1:{port}/page/{i}</loc></url>" for i in range(num_pages // 2))
+                locs += f"<url><loc>http://127.0.0.1:{port}/private/secret</loc></url>"
+                body = f'<?xml version="1.0"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{locs}</urlset>'.encode()
+                content_type = "application/xml"
+            else:
+                with counter_lock:
+                    active[port] += 1
+                    peak[port] = max(peak[port], active[port])
+                time.sleep(0.05)
+                with counter_lock:
+                    active[port] -= 1
+                body = (f"<html><head><title>{self.path}</title></head><body><main>"
+                        + f"<p>Page {self.path} served by port {port}.</p>" * 20 + "</main></body></html>").encode()
+                content_type = "text/html; charset=utf-8"
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    http_client.HTTP_CACHE_DIR = tempfile.mkdtemp()
+    servers = [ThreadingHTTPServer(("127.0.0.1", 0), Handler) for _ in range(2)]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    sitemaps = [f"http://127.0.0.1:{server.server_port}/sitemap.xml" for server in servers]
+    urls = discover_urls(sitemaps)
+    for pages_per_sec in (0, 20):
+        started = time.perf_counter()
+        results = list(crawl_pages(urls, max_in_flight=8, pages_per_sec=pages_per_sec, per_host=2, host_delay=0))
+        elapsed = time.perf_counter() - started
+        errors = [r for r in results if r["error"]]
+        print(f"pages_per_sec={pages_per_sec or 'unlimited'}: {len(results) - len(errors)} pages, "
+              f"{len(errors)} skipped ({errors[0]['error'] if errors else '-'}), "
+              f"{(len(results) - len(errors)) / elapsed:.1f} pages/s, peak per host {dict(peak)}")
+        peak.clear()
+    for server in servers:
+        server.shutdown()
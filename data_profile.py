@@ -0,0 +1,354 @@
+# data_profile.py
+import os
+import json
+import math
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from document_registry import file_hash
+from data_loader import iter_table_chunks, get_data_dir, CHUNK_ROWS
+
+# HyperLogLog precision: 2**12 registers, about 1.6% standard error on distinct counts
+HLL_PRECISION = 12
+# Candidate values tracked per column for the top-k list
+TOP_K = 10
+TOP_K_CAPACITY = 500
+# Values sampled per numeric column for quantiles and histograms
+RESERVOIR_SIZE = 10_000
+HISTOGRAM_BINS = 20
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+# Profiles kept in memory; they are small, the count bound is enough
+MAX_CACHED_PROFILES = 32
+# Bumped whenever the profile format changes, so stale files are recomputed
+PROFILE_VERSION = 2
+# Block size for hashing files given by path
+HASH_BLOCK_BYTES = 1024 * 1024
+
+_profiles = OrderedDict()
+_profiles_lock = threading.Lock()
+
+def _bit_length(values):
+    """Vectorized int.bit_length for a uint64 array."""
+    values = values.copy()
+    lengths = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        wide = values >= (np.uint64(1) << np.uint64(shift))
+        lengths[wide] += shift
+        values[wide] >>= np.uint64(shift)
+    return lengths + (values > 0)
+
+def _value_kind(dtype):
+    """Broad kind of a chunk's values; chunks of different kinds cannot share min/max or moments."""
+    if pd.api.types.is_bool_dtype(dtype):
+        return "bool"
+    if pd.api.types.is_numeric_dtype(dtype):
+        return "number"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "datetime"
+    return "text"
+
+def _text(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+class HyperLogLog:
+    """Mergeable distinct-count sketch over 64-bit hashes."""
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        if not len(hashes):
+            return
+        p = np.uint64(self.precision)
+        index = (hashes >> (np.uint64(64) - p)).astype(np.int64)
+        remainder = hashes & ((np.uint64(1) << (np.uint64(64) - p)) - np.uint64(1))
+        rank = (64 - self.precision) - _bit_length(remainder) + 1
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            return int(round(m * math.log(m / zeros)))
+        return int(round(raw))
+
+class ColumnProfiler:
+    """
+    Accumulates one column's statistics chunk by chunk in bounded memory:
+    exact counts, nulls, min/max, mean and standard deviation; approximate
+    distinct count (HyperLogLog), top values (heavy-hitter counters) and,
+    for numeric columns, quantiles and a histogram from a uniform sample.
+
+    The column's kind is fixed by its first non-empty chunk. If a later chunk
+    disagrees (numeric ids followed by "A..." ids), the column is profiled
+    as text from then on and its numeric statistics are dropped.
+    """
+
+    def __init__(self, name, rng):
+        self.name = name
+        self.rng = rng
+        self.dtype = None
+        self.kind = None
+        self.count = 0
+        self.nulls = 0
+        self.minimum = None
+        self.maximum = None
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.numeric_count = 0
+        self.hll = HyperLogLog()
+        self.top = {}
+        self.sample = np.empty(0)
+        self.sample_keys = np.empty(0)
+
+    def update(self, series):
+        self.count += len(series)
+        values = series.dropna()
+        self.nulls += len(series) - len(values)
+        if self.dtype is None:
+            self.dtype = str(series.dtype)
+        if not len(values):
+            return
+        kind = _value_kind(values.dtype)
+        if self.kind is None:
+            self.kind, self.dtype = kind, str(values.dtype)
+        elif kind != self.kind:
+            self._demote_to_text()
+        if self.kind == "text" and kind != "text":
+            values = values.astype(str)
+        elif kind == "number" and str(values.dtype) != self.dtype:
+            # e.g. an int64 chunk followed by one read as float64 because of a missing value
+            self.dtype = str(np.result_type(np.dtype(self.dtype), values.dtype))
+        self.hll.add_hashes(pd.util.hash_pandas_object(values, index=False).to_numpy())
+
+        numeric = pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype)
+        if numeric:
+            array = values.to_numpy(dtype=np.float64)
+            self._update_moments(array)
+            self._update_sample(array)
+        else:
+            try:
+                low, high = values.min(), values.max()
+                self.minimum = low if self.minimum is None else min(self.minimum, low)
+                self.maximum = high if self.maximum is None else max(self.maximum, high)
+            except TypeError:
+                pass
+        if not pd.api.types.is_float_dtype(values.dtype):
+            self._update_top(values)
+
+    def _update_moments(self, array):
+        # Chan et al. parallel combination of mean and sum of squared deviations
+        n, mean = len(array), float(array.mean())
+        m2 = float(((array - mean) ** 2).sum())
+        total = self.numeric_count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.numeric_count * n / total
+        self.numeric_count = total
+        low, high = float(array.min()), float(array.max())
+        self.minimum = low if self.minimum is None else min(self.minimum, low)
+        self.maximum = high if self.maximum is None else max(self.maximum, high)
+
+    def _update_sample(self, array):
+        # Keeping the values with the smallest random keys is a uniform sample without replacement
+        keys = self.rng.random(len(array))
+        values = np.concatenate([self.sample, array])
+        keys = np.concatenate([self.sample_keys, keys])
+        if len(keys) > RESERVOIR_SIZE:
+            keep = np.argpartition(keys, RESERVOIR_SIZE)[:RESERVOIR_SIZE]
+            values, keys = values[keep], keys[keep]
+        self.sample, self.sample_keys = values, keys
+
+    def _demote_to_text(self):
+        """Switches a column to text statistics once its chunks disagree on the type."""
+        self.kind, self.dtype = "text", "object"
+        if self.minimum is not None:
+            self.minimum, self.maximum = _text(self.minimum), _text(self.maximum)
+        self.mean, self.m2, self.numeric_count = 0.0, 0.0, 0
+        self.sample, self.sample_keys = np.empty(0), np.empty(0)
+        top = {}
+        for value, count in self.top.items():
+            top[_text(value)] = top.get(_text(value), 0) + count
+        self.top = top
+
+    def _update_top(self, values):
+        for value, count in values.value_counts(sort=False).items():
+            self.top[value] = self.top.get(value, 0) + int(count)
+        if len(self.top) > TOP_K_CAPACITY:
+            # Keep the TOP_K_CAPACITY most frequent candidates; a dropped value that comes back
+            # restarts from zero, so counts are lower bounds once a column exceeds the capacity
+            kept = sorted(self.top.items(), key=lambda item: item[1], reverse=True)[:TOP_K_CAPACITY]
+            self.top = dict(kept)
+
+    def result(self):
+        non_null = self.count - self.nulls
+        profile = {
+            "dtype": self.dtype,
+            "count": self.count,
+            "nulls": self.nulls,
+            "distinct": min(self.hll.estimate(), non_null),
+            "min": _json_value(self.minimum),
+            "max": _json_value(self.maximum)
+        }
+        if self.top:
+            top = sorted(self.top.items(), key=lambda item: item[1], reverse=True)[:TOP_K]
+            profile["top"] = [[_json_value(value), count] for value, count in top]
+        if self.numeric_count:
+            profile["mean"] = self.mean
+            profile["std"] = math.sqrt(self.m2 / (self.numeric_count - 1)) if self.numeric_count > 1 else 0.0
+            profile["quantiles"] = {str(q): float(np.quantile(self.sample, q)) for q in QUANTILES}
+            if self.maximum > self.minimum:
+                counts, edges = np.histogram(self.sample, bins=HISTOGRAM_BINS, range=(self.minimum, self.maximum))
+                scale = self.numeric_count / len(self.sample)
+                profile["histogram"] = {"edges": edges.tolist(), "counts": [int(round(c * scale)) for c in counts]}
+        return profile
+
+def _json_value(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+def profile_chunks(chunks, seed=0):
+    """
+    Profiles a table given as an iterable of DataFrame chunks in a single
+    pass; only one chunk plus fixed-size sketches are held in memory.
+
+    Returns:
+        dict: {"rows", "columns": {name: column profile}} where a column profile has
+            dtype, count, nulls, distinct (approximate), min, max, top and, for
+            numeric columns, mean, std, quantiles and histogram (sample based).
+    """
+    rng = np.random.default_rng(seed)
+    profilers = OrderedDict()
+    rows = 0
+    for chunk in chunks:
+        rows += len(chunk)
+        for name in chunk.columns:
+            profiler = profilers.get(name)
+            if profiler is None:
+                profiler = profilers[name] = ColumnProfiler(str(name), rng)
+            profiler.update(chunk[name])
+    return {"rows": rows, "columns": {str(name): profiler.result() for name, profiler in profilers.items()}}
+
+def _profile_path(username, data_hash):
+    return os.path.join(get_data_dir(username), f"{data_hash}.profile.json")
+
+def load_profile(username, data_hash):
+    """Returns the cached profile for a file hash, or None if it was never profiled."""
+    key = (username, data_hash)
+    with _profiles_lock:
+        if key in _profiles:
+            _profiles.move_to_end(key)
+            return _profiles[key]
+    path = _profile_path(username, data_hash)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        profile = json.load(f)
+    if profile.get("version") != PROFILE_VERSION:
+        return None
+    _remember(key, profile)
+    return profile
+
+def _remember(key, profile):
+    with _profiles_lock:
+        _profiles[key] = profile
+        _profiles.move_to_end(key)
+        while len(_profiles) > MAX_CACHED_PROFILES:
+            _profiles.popitem(last=False)
+
+def get_profile(source, filename, username, data_hash=None, chunk_rows=CHUNK_ROWS):
+    """
+    Returns the column profile of an uploaded table, computing it at most
+    once per file: profiles are keyed by the file's SHA-256 and stored as
+    JSON next to the dataset's Parquet copy.
+
+    Args:
+        source (bytes or str): File contents, or a path for files too large to hold in memory.
+        filename (str): Original name, which selects the CSV or Excel reader.
+        username (str): Owner of the upload.
+        data_hash (str, optional): Precomputed hash of the file (e.g. from data_loader info).
+    """
+    if data_hash is None:
+        if isinstance(source, bytes):
+            data_hash = file_hash(source)
+        else:
+            # Same digest as file_hash, without reading the whole file into memory
+            digest = hashlib.sha256()
+            with open(source, "rb") as f:
+                for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+                    digest.update(block)
+            data_hash = digest.hexdigest()
+    profile = load_profile(username, data_hash)
+    if profile is not None:
+        return profile
+
+    profile = profile_chunks(iter_table_chunks(source, filename, chunk_rows))
+    profile.update({"version": PROFILE_VERSION, "file_hash": data_hash, "filename": filename})
+    path = _profile_path(username, data_hash)
+    with open(path + ".tmp", "w") as f:
+        json.dump(profile, f)
+    os.replace(path + ".tmp", path)
+    _remember((username, data_hash), profile)
+    return profile
+
+def profile_frame(profile):
+    """Flattens a profile into one row per column, for display and for answering summary questions."""
+    rows = []
+    for name, column in profile["columns"].items():
+        quantiles = column.get("quantiles", {})
+        top = column.get("top") or []
+        rows.append({
+            "column": name,
+            "dtype": column["dtype"],
+            "count": column["count"],
+            "nulls": column["nulls"],
+            "distinct": column["distinct"],
+            "min": column["min"],
+            "median": quantiles.get("0.5"),
+            "max": column["max"],
+            "mean": column.get("mean"),
+            "std": column.get("std"),
+            "top": ", ".join(f"{value} ({count})" for value, count in top[:3])
+        })
+    return pd.DataFrame(rows)
+
+
+# Manual check: profiles a generated CSV against exact pandas statistics, then re-profiles it from cache
+if __name__ == "__main__":
+    import sys
+    import time
+    import tempfile
+    import session_manager
+
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rng = np.random.default_rng(1)
+    source = pd.DataFrame({
+        "customer": rng.integers(0, 200_000, num_rows),
+        "region": rng.choice(["north", "south", "east", "west"], num_rows, p=[0.4, 0.3, 0.2, 0.1]),
+        "amount": rng.lognormal(3, 1, num_rows)
+    })
+    data = source.to_csv(index=False).encode()
+    session_manager.BASE_DIR = tempfile.mkdtemp()
+
+    for label in ("first profile", "repeat"):
+        started = time.perf_counter()
+        profile = get_profile(data, "sales.csv", "bench")
+        print(f"{label + ':':<15} {time.perf_counter() - started:.2f}s")
+    customers = profile["columns"]["customer"]
+    amount = profile["columns"]["amount"]
+    print(f"distinct customer: {customers['distinct']} (exact {source['customer'].nunique()})")
+    print(f"amount median: {amount['quantiles']['0.5']:.2f} (exact {source['amount'].median():.2f}), "
+          f"p99: {amount['quantiles']['0.99']:.2f} (exact {source['amount'].quantile(0.99):.2f})")
+    print(f"amount mean/std: {amount['mean']:.3f}/{amount['std']:.3f} "
+          f"(exact {source['amount'].mean():.3f}/{source['amount'].std():.3f})")
+    print("region top:", profile["columns"]["region"]["top"])
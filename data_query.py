@@ -0,0 +1,371 @@
+# data_query.py
+import re
+import json
+import asyncio
+import numpy as np
+import pandas as pd
+from model_client import model_client
+from context_builder import build_history_context, history_fingerprint
+from response_cache import response_cache
+from data_profile import profile_chunks, profile_frame
+
+# Columns described to the planner; wider tables are cut off here so the prompt stays bounded
+MAX_SCHEMA_COLUMNS = 60
+# Example values shown per column
+SCHEMA_EXAMPLES = 5
+# Result rows sent to the model for the written answer and shown under it
+RESULT_SAMPLE_ROWS = 20
+# Hard cap on rows returned by a plan
+MAX_RESULT_ROWS = 1000
+# Planning attempts; a rejected plan is sent back with the error once
+MAX_PLAN_ATTEMPTS = 2
+
+FILTER_OPS = ("==", "!=", ">", ">=", "<", "<=", "in", "not_in", "contains", "between", "isnull", "notnull")
+AGG_FUNCS = ("count", "sum", "mean", "median", "min", "max", "nunique", "std")
+
+class PlanError(ValueError):
+    """Raised when a query plan is malformed or references unknown columns."""
+
+def describe_schema(df, max_columns=MAX_SCHEMA_COLUMNS, profile=None):
+    """
+    Returns a compact, size-bounded description of a frame: row count and,
+    per column, its dtype, null count and a few example values (categories
+    for categoricals, the range for numeric columns).
+
+    With a data_profile profile the column statistics come from it instead
+    of scanning the frame, and include distinct counts, frequent values and
+    quartiles.
+    """
+    columns = []
+    profiled = (profile or {}).get("columns", {})
+    for name in list(df.columns)[:max_columns]:
+        series = df[name]
+        if str(name) in profiled:
+            columns.append(_profile_entry(str(name), series, profiled[str(name)]))
+            continue
+        entry = {"name": str(name), "dtype": str(series.dtype), "nulls": int(series.isna().sum())}
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            top = series.value_counts().head(SCHEMA_EXAMPLES)
+            entry["values"] = [str(value) for value in top.index]
+            entry["distinct"] = len(series.cat.categories)
+        elif pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+            entry["min"] = _to_python(series.min())
+            entry["max"] = _to_python(series.max())
+        else:
+            entry["values"] = [str(value)[:40] for value in series.dropna().head(SCHEMA_EXAMPLES)]
+        columns.append(entry)
+    schema = {"rows": len(df), "columns": columns}
+    if len(df.columns) > max_columns:
+        schema["omitted_columns"] = len(df.columns) - max_columns
+    return schema
+
+def _profile_entry(name, series, column):
+    entry = {"name": name, "dtype": str(series.dtype), "nulls": column["nulls"], "distinct": column["distinct"]}
+    if column.get("top"):
+        entry["values"] = [str(value)[:40] for value, _ in column["top"][:SCHEMA_EXAMPLES]]
+    if column.get("quantiles"):
+        entry["min"], entry["max"] = column["min"], column["max"]
+        entry["quartiles"] = [round(column["quantiles"][q], 4) for q in ("0.25", "0.5", "0.75")]
+    return entry
+
+def _to_python(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+def _build_plan_prompt(question, schema, history_context="", error=None):
+    prompt = (
+        "You translate questions about a table into a JSON query plan that is executed with pandas.\n"
+        f"Table schema:\n{json.dumps(schema, default=str)}\n\n"
+        "Plan format (all keys optional):\n"
+        '{"filters": [{"column": str, "op": one of ' + json.dumps(FILTER_OPS) + ', "value": any}],\n'
+        ' "group_by": [column, ...],\n'
+        ' "aggregations": [{"column": column or "*", "func": one of ' + json.dumps(AGG_FUNCS) + ', "as": name}],\n'
+        ' "columns": [column, ...],\n'
+        ' "sort": [{"column": column or aggregation name, "descending": bool}],\n'
+        ' "limit": int}\n'
+        'For questions about the dataset as a whole (overview, columns, missing values, ranges, '
+        'distributions) reply with {"summary": true} instead.\n'
+        'Filters are ANDed. "between" takes [low, high]; "in"/"not_in" take a list. '
+        '"columns" selects output columns when there are no aggregations.\n'
+    )
+    if history_context:
+        prompt += f"\nConversation so far:\n{history_context}\n"
+    prompt += f"\nQuestion: {question}\n"
+    if error:
+        prompt += f"\nYour previous plan was rejected: {error}\nFix it.\n"
+    prompt += "Reply with the JSON plan only."
+    return prompt
+
+def parse_plan(text):
+    """Extracts the JSON object from a model reply, tolerating code fences and surrounding prose."""
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if not match:
+        raise PlanError("No JSON object in the reply")
+    try:
+        plan = json.loads(match.group(0))
+    except ValueError as e:
+        raise PlanError(f"Invalid JSON: {e}")
+    if not isinstance(plan, dict):
+        raise PlanError("The plan must be a JSON object")
+    return plan
+
+def _plan_entries(plan, key, entry_type=dict):
+    """Returns plan[key] as a list, raising PlanError unless every entry has the expected JSON type."""
+    entries = plan.get(key) or []
+    if not isinstance(entries, list):
+        raise PlanError(f"{key!r} must be a list")
+    for entry in entries:
+        if not isinstance(entry, entry_type):
+            kind = "object" if entry_type is dict else "string"
+            raise PlanError(f"Each {key!r} entry must be a JSON {kind}, got {entry!r}")
+    return entries
+
+def validate_plan(plan, df):
+    """Checks a plan against the frame and returns it with defaults filled in; raises PlanError."""
+    columns = set(map(str, df.columns))
+    if plan.get("summary"):
+        return {"summary": True, "filters": [], "group_by": [], "aggregations": [], "columns": [],
+                "sort": [], "limit": MAX_RESULT_ROWS}
+
+    def check_column(name, allowed=columns):
+        if name not in allowed:
+            raise PlanError(f"Unknown column {name!r}")
+
+    filters = _plan_entries(plan, "filters")
+    for condition in filters:
+        check_column(condition.get("column"))
+        if condition.get("op") not in FILTER_OPS:
+            raise PlanError(f"Unsupported filter op {condition.get('op')!r}")
+        if condition["op"] in ("in", "not_in", "between") and not isinstance(condition.get("value"), list):
+            raise PlanError(f"Filter op {condition['op']!r} needs a list value")
+
+    group_by = _plan_entries(plan, "group_by", str)
+    for name in group_by:
+        check_column(name)
+
+    aggregations = _plan_entries(plan, "aggregations")
+    names = set()
+    for aggregation in aggregations:
+        if aggregation.get("func") not in AGG_FUNCS:
+            raise PlanError(f"Unsupported aggregation {aggregation.get('func')!r}")
+        if aggregation.get("column") != "*" or aggregation["func"] != "count":
+            check_column(aggregation.get("column"))
+        aggregation.setdefault("as", f"{aggregation['func']}_{aggregation['column']}".replace("*", "rows"))
+        names.add(aggregation["as"])
+    if group_by and not aggregations:
+        aggregations = [{"column": "*", "func": "count", "as": "count"}]
+        names.add("count")
+
+    output_columns = _plan_entries(plan, "columns", str)
+    for name in output_columns:
+        check_column(name)
+
+    sort = _plan_entries(plan, "sort")
+    # Only columns present in the result can be sorted on
+    if aggregations:
+        sortable = names | set(group_by)
+    else:
+        sortable = set(output_columns) if output_columns else columns
+    for key in sort:
+        check_column(key.get("column"), sortable)
+
+    limit = plan.get("limit")
+    limit = MAX_RESULT_ROWS if limit is None else min(max(int(limit), 1), MAX_RESULT_ROWS)
+    return {"filters": filters, "group_by": group_by, "aggregations": aggregations,
+            "columns": output_columns, "sort": sort, "limit": limit}
+
+def _filter_mask(df, condition):
+    series = df[condition["column"]]
+    op, value = condition["op"], condition.get("value")
+    if op == "isnull":
+        return series.isna().to_numpy()
+    if op == "notnull":
+        return series.notna().to_numpy()
+    if op == "contains":
+        needle = str(value)
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Match against the (few) categories, then map back to rows by code
+            matches = series.cat.categories.astype(str).str.contains(needle, case=False, regex=False)
+            codes = series.cat.codes.to_numpy()
+            return np.append(np.asarray(matches, dtype=bool), False)[codes]
+        return series.astype(str).str.contains(needle, case=False, regex=False).to_numpy()
+    if op == "in":
+        return series.isin(value).to_numpy()
+    if op == "not_in":
+        return (~series.isin(value)).to_numpy()
+    if op == "between":
+        return series.between(value[0], value[1]).to_numpy()
+    if isinstance(series.dtype, pd.CategoricalDtype) and op not in ("==", "!="):
+        series = series.astype(series.cat.categories.dtype)
+    comparisons = {"==": series.eq, "!=": series.ne, ">": series.gt, ">=": series.ge, "<": series.lt, "<=": series.le}
+    return comparisons[op](value).to_numpy()
+
+def execute_plan(df, plan, profile=None):
+    """
+    Runs a validated plan with vectorized pandas/NumPy operations: the
+    filters are combined into one boolean mask, then the frame is grouped,
+    aggregated, sorted and limited. Summary plans are answered from the
+    column profile (computed on the spot when none is given).
+
+    Returns:
+        tuple: (result DataFrame, number of result rows before the limit).
+    """
+    if plan.get("summary"):
+        result = profile_frame(profile or profile_chunks([df]))
+        return result, len(result)
+
+    mask = np.ones(len(df), dtype=bool)
+    for condition in plan["filters"]:
+        mask &= _filter_mask(df, condition)
+    frame = df[mask] if not mask.all() else df
+
+    if plan["aggregations"]:
+        named = {}
+        for aggregation in plan["aggregations"]:
+            if aggregation["column"] == "*":
+                column = plan["group_by"][0] if plan["group_by"] else frame.columns[0]
+                named[aggregation["as"]] = pd.NamedAgg(column=column, aggfunc="size")
+            else:
+                named[aggregation["as"]] = pd.NamedAgg(column=aggregation["column"], aggfunc=aggregation["func"])
+        if plan["group_by"]:
+            result = frame.groupby(plan["group_by"], observed=True, sort=False).agg(**named).reset_index()
+        else:
+            row = {}
+            for name, aggregation in named.items():
+                row[name] = len(frame) if aggregation.aggfunc == "size" else frame[aggregation.column].agg(aggregation.aggfunc)
+            result = pd.DataFrame([row])
+    else:
+        result = frame[plan["columns"]] if plan["columns"] else frame
+
+    if plan["sort"]:
+        result = result.sort_values(
+            [key["column"] for key in plan["sort"]],
+            ascending=[not key.get("descending", False) for key in plan["sort"]]
+        )
+    total_rows = len(result)
+    return result.head(plan["limit"]).reset_index(drop=True), total_rows
+
+def format_table(df, max_rows=RESULT_SAMPLE_ROWS):
+    """Renders the first rows of a frame as a Markdown table."""
+    sample = df.head(max_rows)
+    header = "| " + " | ".join(str(column) for column in sample.columns) + " |"
+    divider = "| " + " | ".join("---" for _ in sample.columns) + " |"
+    rows = []
+    for values in sample.itertuples(index=False):
+        cells = []
+        for value in values:
+            value = _to_python(value)
+            if value is None:
+                cells.append("")
+                continue
+            cells.append(f"{value:.6g}" if isinstance(value, float) else str(value).replace("|", "\\|"))
+        rows.append("| " + " | ".join(cells) + " |")
+    return "\n".join([header, divider] + rows)
+
+def _build_answer_prompt(question, plan, result, total_rows):
+    return (
+        "A question about a table was answered by running this query plan locally:\n"
+        f"{json.dumps(plan, default=str)}\n\n"
+        f"The result has {total_rows} rows; the first {min(len(result), RESULT_SAMPLE_ROWS)} are:\n"
+        f"{format_table(result)}\n\n"
+        f"Question: {question}\n"
+        "Answer the question from the result in a few sentences. Quote the numbers you rely on "
+        "and do not invent values that are not in the result."
+    )
+
+def _default_model():
+    from gemini_backend import get_model
+    return get_model()
+
+async def plan_query(question, df, chat_history=None, username=None, session_id=None, model=None, profile=None):
+    """
+    Asks the model for a query plan, sending only the schema (plus the
+    budgeted conversation history), and validates it against the frame.
+
+    Returns:
+        dict: The validated plan; raises PlanError when no valid plan was produced.
+    """
+    model = model or _default_model()
+    # Without a profile this scans the whole frame; keep it off the shared model-client loop
+    schema = await asyncio.to_thread(describe_schema, df, profile=profile)
+    history_context = await build_history_context(chat_history, question, "data", session_id, username)
+    error = None
+    for _ in range(MAX_PLAN_ATTEMPTS):
+        reply = await model_client.generate(model, _build_plan_prompt(question, schema, history_context, error),
+                                            username=username, feature="data_plan")
+        try:
+            return validate_plan(parse_plan(reply), df)
+        except (PlanError, TypeError, ValueError) as e:
+            error = str(e)
+    raise PlanError(error)
+
+async def async_stream_data_answer(question, df, info=None, chat_history=None, username=None,
+                                   session_id=None, model=None, profile=None):
+    """
+    Answers a question about a loaded table. The model plans the query from
+    the schema, the plan runs locally on the full frame, and the model then
+    writes the answer from a small sample of the result, so prompt size does
+    not depend on the number of rows. Yields the answer as it streams,
+    followed by the result sample as a Markdown table.
+
+    Args:
+        question (str): The user's question.
+        df (DataFrame): The table loaded by data_loader.
+        info (dict, optional): data_loader info; its file hash scopes the response cache.
+        chat_history (list, optional): Messages used to resolve follow-up questions.
+        username, session_id: Identify the caller and the session.
+        model (optional): Model used for planning and answering; defaults to the Gemini model.
+        profile (dict, optional): data_profile profile grounding the schema and answering summary questions.
+    """
+    try:
+        cache_scope = ("data", username, (info or {}).get("file_hash"), history_fingerprint(chat_history, question))
+        cached = await response_cache.aget(question, cache_scope)
+        if cached is not None:
+            yield cached
+            return
+
+        model = model or _default_model()
+        plan = await plan_query(question, df, chat_history, username, session_id, model, profile)
+        # Filtering, grouping and sorting are CPU-bound; keep them off the shared model-client loop
+        result, total_rows = await asyncio.to_thread(execute_plan, df, plan, profile)
+
+        parts = []
+        async for fragment in model_client.stream(model, _build_answer_prompt(question, plan, result, total_rows),
+                                                  username=username, feature="data_answer"):
+            parts.append(fragment)
+            yield fragment
+        table = f"\n\n{format_table(result)}"
+        if total_rows > RESULT_SAMPLE_ROWS:
+            table += f"\n\n_Showing {min(len(result), RESULT_SAMPLE_ROWS)} of {total_rows} rows._"
+        yield table
+        await response_cache.aput(question, "".join(parts).strip() + table, cache_scope)
+
+    except PlanError as e:
+        yield f"Error: Could not turn the question into a query ({e})."
+    except Exception as e:
+        yield f"Error: {e}"
+
+async def async_answer_data_question(question, df, info=None, chat_history=None, username=None,
+                                     session_id=None, model=None, profile=None):
+    """Non-streaming variant of async_stream_data_answer."""
+    parts = []
+    async for fragment in async_stream_data_answer(question, df, info, chat_history, username, session_id,
+                                                   model, profile):
+        parts.append(fragment)
+    return "".join(parts).strip()
+
+def answer_data_question(question, df, info=None, chat_history=None, username=None, session_id=None,
+                         model=None, profile=None):
+    return model_client.run_sync(
+        async_answer_data_question(question, df, info, chat_history, username, session_id, model, profile)
+    )
+
+def stream_data_answer(question, df, info=None, chat_history=None, username=None, session_id=None,
+                       model=None, profile=None):
+    """Synchronous streaming wrapper for the Streamlit app."""
+    return model_client.iter_sync(
+        async_stream_data_answer(question, df, info, chat_history, username, session_id, model, profile)
+    )
@@ -0,0 +1,138 @@
+# document_registry.py
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime
+
+# Registry of documents already indexed in ChromaDB, keyed by collection and content hash
+REGISTRY_PATH = os.path.join("chroma_db", "document_registry.json")
+# LangChain's default collection, still used when no user is known
+DEFAULT_COLLECTION = "langchain"
+
+_lock = threading.Lock()
+
+def file_hash(data):
+    """Returns the SHA-256 hex digest of the raw file bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+def chunk_hash(text):
+    """Returns the SHA-256 hex digest of a text chunk."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def chunk_id(doc_id, text):
+    """Chroma ID of a chunk within one document, so every document owns its own copy."""
+    return f"{doc_id}:{chunk_hash(text)}"
+
+def collection_name_for(username):
+    """
+    Returns the Chroma collection holding one user's documents.
+
+    Usernames are hashed because Chroma only accepts short alphanumeric
+    collection names.
+    """
+    if not username:
+        return DEFAULT_COLLECTION
+    return "user_" + hashlib.sha1(username.encode("utf-8")).hexdigest()[:16]
+
+def _load_registry():
+    if os.path.exists(REGISTRY_PATH):
+        with open(REGISTRY_PATH, "r") as f:
+            return json.load(f)
+    return {"collections": {}}
+
+def _save_registry(registry):
+    os.makedirs(os.path.dirname(REGISTRY_PATH), exist_ok=True)
+    tmp_path = REGISTRY_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(registry, f, indent=2)
+    os.replace(tmp_path, REGISTRY_PATH)
+
+def _collection(registry, collection):
+    return registry.setdefault("collections", {}).setdefault(
+        collection, {"version": 0, "documents": {}, "sessions": {}}
+    )
+
+def get_document(collection, doc_hash):
+    """Returns the registry entry for a document hash, or None if it was never indexed."""
+    with _lock:
+        return _collection(_load_registry(), collection)["documents"].get(doc_hash)
+
+def is_document_indexed(collection, doc_hash):
+    return get_document(collection, doc_hash) is not None
+
+def collection_version(collection):
+    """Returns a counter that changes whenever chunks are written to the collection."""
+    with _lock:
+        return _collection(_load_registry(), collection)["version"]
+
+def bump_collection_version(collection):
+    """Marks the collection as changed, e.g. after a partially indexed upload."""
+    with _lock:
+        registry = _load_registry()
+        _collection(registry, collection)["version"] += 1
+        _save_registry(registry)
+
+def register_document(collection, doc_hash, filename, chunk_count):
+    """Records a fully indexed document so later uploads of the same bytes are skipped."""
+    with _lock:
+        registry = _load_registry()
+        entry = _collection(registry, collection)
+        entry["version"] += 1
+        entry["documents"][doc_hash] = {
+            "filename": filename,
+            "chunk_count": chunk_count,
+            "indexed_at": datetime.utcnow().isoformat()
+        }
+        _save_registry(registry)
+
+def link_session(collection, session_id, doc_id):
+    """Attaches an indexed document to a chat session so retrieval can be limited to it."""
+    if not session_id:
+        return
+    with _lock:
+        registry = _load_registry()
+        doc_ids = _collection(registry, collection)["sessions"].setdefault(session_id, [])
+        if doc_id not in doc_ids:
+            doc_ids.append(doc_id)
+            _save_registry(registry)
+
+def replace_page_version(collection, session_id, url, doc_id):
+    """
+    Records doc_id as the current version of a crawled page: links it to the
+    session and unlinks the session's other versions of the same URL.
+
+    Returns:
+        list: Earlier versions no session links any more; their chunks should be
+            deleted. They are already dropped from the registry.
+    """
+    with _lock:
+        registry = _load_registry()
+        entry = _collection(registry, collection)
+        versions = entry.setdefault("urls", {}).setdefault(url, [])
+        # Pages registered before versions were tracked carry their URL as the filename
+        for known_id, document in entry["documents"].items():
+            if document.get("filename") == url and known_id not in versions:
+                versions.append(known_id)
+        if doc_id not in versions:
+            versions.append(doc_id)
+        sessions = entry["sessions"]
+        if session_id:
+            doc_ids = sessions.setdefault(session_id, [])
+            doc_ids[:] = [linked for linked in doc_ids if linked == doc_id or linked not in versions]
+            if doc_id not in doc_ids:
+                doc_ids.append(doc_id)
+        linked = {linked for doc_ids in sessions.values() for linked in doc_ids}
+        orphaned = [version for version in versions if version != doc_id and version not in linked]
+        for version in orphaned:
+            versions.remove(version)
+            entry["documents"].pop(version, None)
+        if orphaned:
+            entry["version"] += 1
+        _save_registry(registry)
+        return orphaned
+
+def session_documents(collection, session_id):
+    """Returns the document IDs uploaded in a chat session."""
+    with _lock:
+        return list(_collection(_load_registry(), collection)["sessions"].get(session_id, []))
@@ -0,0 +1,179 @@
+# fakes.py
+# Deterministic local stand-ins for the remote Gemini models, used for
+# offline tuning and load tests.
+import time
+import random
+import asyncio
+import struct
+import hashlib
+import json
+import threading
+
+class FakeEmbeddings:
+    """
+    Embedding model with the same interface as GoogleGenerativeAIEmbeddings
+    (embed_documents / embed_query) that never leaves the process.
+
+    Args:
+        dim (int): Vector dimension.
+        latency (float): Seconds to sleep per embed call, simulating a network round-trip.
+        failure_rate (float): Probability that an embed_documents call raises.
+        seed (int): Seed for the failure injector.
+    """
+
+    def __init__(self, dim=768, latency=0.0, failure_rate=0.0, seed=0):
+        self.dim = dim
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.texts_embedded = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _vector(self, text):
+        values = []
+        counter = 0
+        while len(values) < self.dim:
+            digest = hashlib.sha256(f"{counter}:{text}".encode("utf-8")).digest()
+            values.extend(b / 127.5 - 1.0 for b in struct.unpack("32B", digest))
+            counter += 1
+        return values[:self.dim]
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.calls += 1
+            fail = self._random.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise RuntimeError("FakeEmbeddings: injected failure")
+        with self._lock:
+            self.texts_embedded += len(texts)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class _FakeAsyncStream:
+    def __init__(self, fragments, latency):
+        self._fragments = fragments
+        self._latency = latency
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for fragment in self._fragments:
+            if self._latency:
+                await asyncio.sleep(self._latency / max(len(self._fragments), 1))
+            yield FakeResponse(fragment)
+
+class FakeGenerativeModel:
+    """
+    Stand-in for genai.GenerativeModel supporting generate_content and
+    generate_content_async, with and without stream=True. Answers are a
+    deterministic echo of the prompt, and the highest number of concurrent
+    calls observed is tracked in max_in_flight.
+
+    Args:
+        latency (float): Seconds each call takes.
+        reply (callable, optional): Maps the prompt to the answer text.
+    """
+
+    def __init__(self, latency=0.0, reply=None):
+        self.latency = latency
+        self.reply = reply or (lambda prompt: f"Fake answer ({len(prompt)} prompt chars): {prompt[-80:]}")
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _enter(self):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    @staticmethod
+    def _fragments(text):
+        words = text.split(" ")
+        return [word + (" " if i < len(words) - 1 else "") for i, word in enumerate(words)]
+
+    def generate_content(self, prompt, stream=False):
+        self._enter()
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            text = self.reply(prompt)
+        finally:
+            self._exit()
+        if stream:
+            return [FakeResponse(fragment) for fragment in self._fragments(text)]
+        return FakeResponse(text)
+
+    async def generate_content_async(self, prompt, stream=False):
+        self._enter()
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            text = self.reply(prompt)
+        finally:
+            self._exit()
+        if stream:
+            return _FakeAsyncStream(self._fragments(text), 0.0)
+        return FakeResponse(text)
+
+class FakePlanner(FakeGenerativeModel):
+    """
+    FakeGenerativeModel for data_query: planning prompts are answered with a
+    JSON plan and answer prompts with a short canned summary, so the whole
+    plan-execute-answer loop runs offline. Prompt sizes are recorded in
+    prompt_sizes.
+
+    Args:
+        plans (dict, optional): Maps a question substring to the plan returned for it.
+        default_plan (dict, optional): Plan for questions matching nothing; counts rows by default.
+        latency (float): Seconds each call takes.
+    """
+
+    def __init__(self, plans=None, default_plan=None, latency=0.0):
+        super().__init__(latency=latency, reply=self._reply)
+        self.plans = plans or {}
+        self.default_plan = default_plan or {"aggregations": [{"column": "*", "func": "count", "as": "rows"}]}
+        self.prompt_sizes = []
+
+    def _reply(self, prompt):
+        self.prompt_sizes.append(len(prompt))
+        if "JSON query plan" not in prompt:
+            return "Fake answer based on the query result."
+        question = prompt.rsplit("Question:", 1)[-1].split("\n", 1)[0].strip().lower()
+        for key, plan in self.plans.items():
+            if key.lower() in question:
+                return json.dumps(plan)
+        return json.dumps(self.default_plan)
+
+def make_fake_chat_model(latency=0.0, reply=None):
+    """
+    LangChain runnable standing in for ChatGoogleGenerativeAI inside chains
+    (prompt | model | parser). It answers with a deterministic echo of the
+    rendered prompt after sleeping for latency seconds.
+    """
+    from langchain_core.runnables import RunnableLambda
+
+    reply = reply or (lambda prompt: f"Fake answer ({len(prompt)} prompt chars): {prompt[-80:]}")
+
+    def respond(prompt_value):
+        if latency:
+            time.sleep(latency)
+        text = prompt_value.to_string() if hasattr(prompt_value, "to_string") else str(prompt_value)
+        return reply(text)
+
+    return RunnableLambda(respond)
@@ -1,41 +1,96 @@
-import google.generativeai as genai
+from functools import lru_cache
 from dotenv import load_dotenv
 import os
+from response_cache import response_cache
+from model_client import model_client
+from context_builder import build_history_context, history_fingerprint
+from metrics import span, registry
 
 # Load API key from .env file
 load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
 
-# Configure Gemini
-genai.configure(api_key=api_key)
+GEMINI_MODEL = "models/gemini-2.0-flash"
 
-# Initialize model
-model = genai.GenerativeModel("models/gemini-2.0-flash")
+@lru_cache(maxsize=None)
+def get_model(model_name=GEMINI_MODEL):
+    """
+    Returns the process-wide Gemini model, shared by the chatbot, scraping,
+    summarization and data analysis. google-generativeai is only imported
+    and configured on the first call, so startup and the login page do not
+    pay for it.
+    """
+    import google.generativeai as genai
+
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return genai.GenerativeModel(model_name)
+
+def _build_prompt(user_query, history_context=""):
+    prompt = ""
+
+    if history_context:
+        prompt += f"Here is the conversation so far for context:\n{history_context}\n"
+
+    # Add the user's message
+    prompt += f"\nNow the user says:\n\"{user_query}\"\n"
+    prompt += "Please generate an appropriate and context-aware response."
+    return prompt
 
 # Function to generate response
-def get_gemini_response(user_query, chat_history=None):
+async def async_get_gemini_response(user_query, chat_history=None, username=None, context="chatbot", session_id=None):
+    """Async variant of get_gemini_response, running under the shared model client's concurrency limits."""
     try:
-        prompt = ""
+        # Serve repeated questions from the response cache, scoped per feature and user
+        # Scoped by the conversation so far, so follow-ups are never answered from another chat
+        cache_scope = (context, username, history_fingerprint(chat_history, user_query))
+        cached = await response_cache.aget(user_query, cache_scope)
+        registry.inc("response_cache_total", feature=context, result="miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
 
-        if chat_history:
-            # Get the last 3 assistant messages (most recent first)
-            assistant_msgs = [
-                msg["content"] for msg in chat_history
-                if msg["role"] == "assistant"
-            ][-3:]  # Take last 3
+        with span("chat.history"):
+            history_context = await build_history_context(chat_history, user_query, context, session_id, username)
+        with span("chat.prompt"):
+            prompt = _build_prompt(user_query, history_context)
 
-            if assistant_msgs:
-                prompt += "Here are some previous assistant responses for context:\n"
-                for i, msg in enumerate(assistant_msgs, 1):
-                    prompt += f"{i}. {msg}\n"
+        answer = (await model_client.generate(get_model(), prompt, username=username, feature=context)).strip()
+        await response_cache.aput(user_query, answer, cache_scope)
+        return answer
 
-        # Add the user's message
-        prompt += f"\nNow the user says:\n\"{user_query}\"\n"
-        prompt += "Please generate an appropriate and context-aware response."
+    except Exception as e:
+        return f"Error: {e}"
 
-        response = model.generate_content(prompt)
-        return response.text.strip()
+async def async_stream_gemini_response(user_query, chat_history=None, username=None, context="chatbot", session_id=None):
+    """
+    Yields text fragments as the model produces them. Cached answers are
+    yielded in one piece, and the complete answer is cached once the stream
+    finishes.
+    """
+    try:
+        # Scoped by the conversation so far, so follow-ups are never answered from another chat
+        cache_scope = (context, username, history_fingerprint(chat_history, user_query))
+        cached = await response_cache.aget(user_query, cache_scope)
+        registry.inc("response_cache_total", feature=context, result="miss" if cached is None else "hit")
+        if cached is not None:
+            yield cached
+            return
+
+        with span("chat.history"):
+            history_context = await build_history_context(chat_history, user_query, context, session_id, username)
+        with span("chat.prompt"):
+            prompt = _build_prompt(user_query, history_context)
+
+        parts = []
+        async for fragment in model_client.stream(get_model(), prompt, username=username, feature=context):
+            parts.append(fragment)
+            yield fragment
+        await response_cache.aput(user_query, "".join(parts).strip(), cache_scope)
 
     except Exception as e:
-        return f"Error: {e}"
+        yield f"Error: {e}"
+
+def get_gemini_response(user_query, chat_history=None, username=None, context="chatbot", session_id=None):
+    return model_client.run_sync(async_get_gemini_response(user_query, chat_history, username, context, session_id))
 
+def stream_gemini_response(user_query, chat_history=None, username=None, context="chatbot", session_id=None):
+    """Streaming variant of get_gemini_response for synchronous callers such as the Streamlit app."""
+    return model_client.iter_sync(async_stream_gemini_response(user_query, chat_history, username, context, session_id))
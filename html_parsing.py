@@ -0,0 +1,201 @@
+# html_parsing.py
+import os
+import re
+import codecs
+
+# Parser backend: "auto" picks the fastest installed one; or force "selectolax", "lxml" or "html.parser"
+HTML_PARSER = os.getenv("HTML_PARSER", "auto")
+# Bytes of HTML handed to the parser; anything beyond is ignored
+MAX_PARSE_BYTES = 5 * 1024 * 1024
+# Leading bytes searched for a <meta charset> when the response declares none
+SNIFF_BYTES = 4096
+# Elements removed before text extraction; <form> is kept because WebForms-style sites wrap the whole page in one
+BOILERPLATE_TAGS = ("script", "style", "noscript", "template", "svg", "iframe", "head", "title", "meta",
+                    "link", "nav", "footer", "header", "aside")
+# Containers that usually hold the main content, in order of preference
+MAIN_CONTENT_SELECTORS = ("main", "article", "[role=main]", "#content", "#main")
+# A main-content container is only used when it holds at least this much text
+MIN_MAIN_CONTENT_CHARS = 200
+
+_META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([a-zA-Z0-9_.:-]+)""", re.IGNORECASE)
+_BOMS = ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16"))
+
+def _collect_metadata(pairs):
+    metadata = {}
+    for attrs in pairs:
+        if "name" in attrs:
+            metadata[attrs["name"]] = attrs.get("content", "")
+        elif "property" in attrs:
+            metadata[attrs["property"]] = attrs.get("content", "")
+    return metadata
+
+def _parse_selectolax(content, encoding):
+    from selectolax.lexbor import LexborHTMLParser
+
+    markup = content.decode(encoding or _sniff_encoding(content) or "cp1252", errors="replace")
+    tree = LexborHTMLParser(markup)
+    title_node = tree.css_first("title")
+    title = title_node.text() if title_node else None
+    metadata = _collect_metadata(node.attributes for node in tree.css("meta"))
+    tree.strip_tags(list(BOILERPLATE_TAGS))
+    root = None
+    for selector in MAIN_CONTENT_SELECTORS:
+        node = tree.css_first(selector)
+        if node is not None and len(node.text(strip=True)) >= MIN_MAIN_CONTENT_CHARS:
+            root = node
+            break
+    root = root or tree.body or tree.root
+    text = root.text(separator="\n", strip=True) if root is not None else ""
+    return title, metadata, "\n".join(line for line in text.split("\n") if line)
+
+def _parse_lxml(content, encoding):
+    from lxml import html as lxml_html
+
+    # libxml2 assumes Latin-1 for undeclared charsets
+    encoding = encoding or _sniff_encoding(content)
+    parser = lxml_html.HTMLParser(encoding=encoding) if encoding else None
+    doc = lxml_html.document_fromstring(content, parser=parser)
+    title = doc.findtext(".//title")
+    metadata = _collect_metadata(dict(node.attrib) for node in doc.iter("meta"))
+    for node in doc.xpath("|".join(f"//{tag}" for tag in BOILERPLATE_TAGS)):
+        node.drop_tree()
+    root = None
+    for selector in MAIN_CONTENT_SELECTORS:
+        nodes = _select(doc, selector)
+        if nodes and len(nodes[0].text_content().strip()) >= MIN_MAIN_CONTENT_CHARS:
+            root = nodes[0]
+            break
+    root = root if root is not None else doc
+    text = "\n".join(part.strip() for part in root.itertext() if part.strip())
+    return title, metadata, text
+
+def _select(doc, selector):
+    # Enough of CSS for MAIN_CONTENT_SELECTORS without requiring cssselect
+    if selector.startswith("#"):
+        return doc.xpath(f'//*[@id="{selector[1:]}"]')
+    if selector.startswith("[role="):
+        return doc.xpath(f'//*[@role="{selector[6:-1]}"]')
+    return doc.xpath(f"//{selector}")
+
+def _parse_html_parser(content, encoding):
+    from bs4 import BeautifulSoup
+
+    # Without a hint, bs4 guesses statistically and can misread short UTF-8 snippets
+    soup = BeautifulSoup(content, "html.parser", from_encoding=encoding or _sniff_encoding(content))
+    title = soup.title.string if soup.title else None
+    metadata = _collect_metadata(tag.attrs for tag in soup.find_all("meta"))
+    for element in soup(list(BOILERPLATE_TAGS)):
+        element.decompose()
+    root = None
+    for selector in MAIN_CONTENT_SELECTORS:
+        node = soup.select_one(selector)
+        if node is not None and len(node.get_text(strip=True)) >= MIN_MAIN_CONTENT_CHARS:
+            root = node
+            break
+    root = root or soup
+    return title, metadata, root.get_text(separator="\n", strip=True)
+
+def _known_encoding(encoding):
+    """Returns the declared charset if Python knows it, else None so the parser sniffs it."""
+    if not encoding:
+        return None
+    try:
+        codecs.lookup(encoding)
+        return encoding
+    except LookupError:
+        return None
+
+def _declared_encoding(content):
+    """Charset from a byte-order mark or a <meta charset> near the top of the document, if Python knows it."""
+    for bom, name in _BOMS:
+        if content.startswith(bom):
+            return name
+    match = _META_CHARSET.search(content[:SNIFF_BYTES])
+    return _known_encoding(match.group(1).decode("ascii")) if match else None
+
+def _sniff_encoding(content):
+    """
+    Encoding of a document whose response declared none: its BOM or <meta
+    charset>, else UTF-8 when the bytes are valid UTF-8, else None.
+    """
+    declared = _declared_encoding(content)
+    if declared:
+        return declared
+    try:
+        content.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError:
+        return None
+
+def _truncate(content, max_bytes):
+    """Cuts content to at most max_bytes without splitting a UTF-8 multibyte character."""
+    if len(content) <= max_bytes:
+        return content
+    cut = max_bytes
+    # Step back over continuation bytes (10xxxxxx) of a character straddling the limit
+    while cut > max(max_bytes - 3, 0) and (content[cut] & 0xC0) == 0x80:
+        cut -= 1
+    return content[:cut]
+
+_BACKENDS = {
+    "selectolax": ("selectolax.lexbor", _parse_selectolax),
+    "lxml": ("lxml.html", _parse_lxml),
+    "html.parser": ("bs4", _parse_html_parser),
+}
+
+def available_backends():
+    """Returns the installed parser backends, fastest first."""
+    import importlib
+
+    available = []
+    for name, (module, _) in _BACKENDS.items():
+        try:
+            importlib.import_module(module)
+            available.append(name)
+        except ImportError:
+            continue
+    return available
+
+_selected_backend = None
+
+def get_backend():
+    """Resolves HTML_PARSER to an installed backend name (cached after the first call)."""
+    global _selected_backend
+    if _selected_backend is None:
+        available = available_backends()
+        if HTML_PARSER != "auto" and HTML_PARSER in available:
+            _selected_backend = HTML_PARSER
+        else:
+            _selected_backend = available[0] if available else "html.parser"
+    return _selected_backend
+
+def parse_html(content, encoding=None, backend=None, max_bytes=MAX_PARSE_BYTES):
+    """
+    Extracts the title, metadata and main text content from an HTML document.
+
+    Boilerplate elements (scripts, styles, navigation, headers, footers,
+    ...) are dropped before text extraction, and when the page has a
+    substantial <main>/<article>-style container only its text is kept.
+
+    Args:
+        content (bytes): The raw HTML.
+        encoding (str, optional): Declared charset; sniffed from the document when None.
+        backend (str, optional): Parser backend; defaults to get_backend().
+        max_bytes (int): Only the first max_bytes of the document are parsed.
+
+    Returns:
+        dict: {"title", "metadata", "text_content"} as returned by extract_content.
+    """
+    encoding = _known_encoding(encoding)
+    if isinstance(content, str):
+        content = content.encode(encoding or "utf-8")
+    content = _truncate(content, max_bytes)
+    if not content.strip():
+        return {"title": "No Title Found", "metadata": {}, "text_content": ""}
+    parse = _BACKENDS[backend or get_backend()][1]
+    title, metadata, text_content = parse(content, encoding)
+    return {
+        "title": title if title else "No Title Found",
+        "metadata": metadata,
+        "text_content": text_content
+    }
@@ -0,0 +1,224 @@
+# http_client.py
+import os
+import json
+import time
+import hashlib
+import threading
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Shared HTTP settings for scraping
+HTTP_CACHE_DIR = os.path.join("cache", "http")
+DEFAULT_TIMEOUT = (5, 20)  # (connect, read) seconds
+MAX_RESPONSE_BYTES = 10 * 1024 * 1024
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 20
+USER_AGENT = "Mozilla/5.0 (compatible; SmartLexiconBot/1.0)"
+READ_CHUNK_SIZE = 64 * 1024
+
+class ResponseTooLarge(requests.exceptions.RequestException):
+    """Raised when a response body exceeds the configured byte limit."""
+
+class HttpResponse:
+    """Minimal response object returned by fetch, whether it came from the network or the cache."""
+
+    def __init__(self, url, status_code, headers, content, encoding=None, from_cache=False, revalidated=False):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+        self.from_cache = from_cache
+        self.revalidated = revalidated
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Returns the process-wide requests session with keep-alive connection pooling and retries."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=("GET", "HEAD"))
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({
+                "User-Agent": USER_AGENT,
+                "Accept-Encoding": "gzip, deflate",
+                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"
+            })
+            _session = session
+        return _session
+
+def _cache_paths(url):
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return os.path.join(HTTP_CACHE_DIR, f"{key}.json"), os.path.join(HTTP_CACHE_DIR, f"{key}.body")
+
+def _parse_cache_control(headers):
+    directives = {}
+    for part in headers.get("Cache-Control", "").split(","):
+        name, _, value = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = value.strip('"')
+    return directives
+
+def _freshness_lifetime(headers, directives):
+    """Seconds the response may be served without revalidation (0 when it must be revalidated)."""
+    if "no-cache" in directives:
+        return 0
+    if "max-age" in directives:
+        try:
+            return max(int(directives["max-age"]), 0)
+        except ValueError:
+            return 0
+    if headers.get("Expires"):
+        try:
+            expires = parsedate_to_datetime(headers["Expires"]).timestamp()
+            return max(expires - time.time(), 0)
+        except (TypeError, ValueError):
+            return 0
+    return 0
+
+def _load_cached(url):
+    meta_path, body_path = _cache_paths(url)
+    if not (os.path.exists(meta_path) and os.path.exists(body_path)):
+        return None, None
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    with open(body_path, "rb") as f:
+        body = f.read()
+    return meta, body
+
+def _store_cached(url, response_headers, status_code, body, encoding):
+    directives = _parse_cache_control(response_headers)
+    if "no-store" in directives:
+        return
+    meta_path, body_path = _cache_paths(url)
+    os.makedirs(HTTP_CACHE_DIR, exist_ok=True)
+    meta = {
+        "url": url,
+        "status_code": status_code,
+        "encoding": encoding,
+        "etag": response_headers.get("ETag"),
+        "last_modified": response_headers.get("Last-Modified"),
+        "content_type": response_headers.get("Content-Type"),
+        "stored_at": time.time(),
+        "lifetime": _freshness_lifetime(response_headers, directives)
+    }
+    for path, data, mode in ((body_path, body, "wb"), (meta_path, json.dumps(meta), "w")):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, mode) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+def _refresh_cached(url, meta, response_headers):
+    """Records a successful revalidation (304), updating validators and freshness."""
+    directives = _parse_cache_control(response_headers)
+    meta["stored_at"] = time.time()
+    meta["lifetime"] = _freshness_lifetime(response_headers, directives)
+    meta["etag"] = response_headers.get("ETag", meta.get("etag"))
+    meta["last_modified"] = response_headers.get("Last-Modified", meta.get("last_modified"))
+    meta_path, _ = _cache_paths(url)
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+def _read_capped(response, max_bytes):
+    declared = response.headers.get("Content-Length")
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        raise ResponseTooLarge(f"Response of {declared} bytes exceeds the {max_bytes} byte limit")
+    chunks = []
+    total = 0
+    for chunk in response.iter_content(READ_CHUNK_SIZE):
+        total += len(chunk)
+        if total > max_bytes:
+            raise ResponseTooLarge(f"Response exceeds the {max_bytes} byte limit")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+def fetch(url, timeout=DEFAULT_TIMEOUT, max_bytes=MAX_RESPONSE_BYTES, use_cache=True):
+    """
+    GETs a URL through the pooled session and the on-disk response cache.
+
+    Fresh cached responses (per Cache-Control max-age / Expires) are served
+    locally. Stale ones are revalidated with If-None-Match / If-Modified-Since,
+    and a 304 reuses the stored body. Bodies are streamed and capped at
+    max_bytes.
+
+    Args:
+        url (str): The URL to fetch.
+        timeout (tuple): (connect, read) timeouts in seconds.
+        max_bytes (int): Largest body accepted.
+        use_cache (bool): Set to False to bypass the cache entirely.
+
+    Returns:
+        HttpResponse: The response; raises requests exceptions on network errors and 4xx/5xx statuses.
+    """
+    meta, body = _load_cached(url) if use_cache else (None, None)
+    if meta is not None and time.time() - meta["stored_at"] < meta["lifetime"]:
+        return HttpResponse(url, meta["status_code"], {"Content-Type": meta.get("content_type")},
+                            body, meta.get("encoding"), from_cache=True)
+
+    headers = {}
+    if meta is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    with get_session().get(url, headers=headers, timeout=timeout, stream=True) as response:
+        if response.status_code == 304 and meta is not None:
+            _refresh_cached(url, meta, response.headers)
+            return HttpResponse(url, meta["status_code"], {"Content-Type": meta.get("content_type")},
+                                body, meta.get("encoding"), from_cache=True, revalidated=True)
+        response.raise_for_status()
+        content = _read_capped(response, max_bytes)
+        # Only trust an explicit charset; otherwise let the parser sniff the bytes
+        encoding = response.encoding if "charset" in response.headers.get("Content-Type", "").lower() else None
+        if use_cache and response.status_code == 200:
+            _store_cached(url, response.headers, response.status_code, content, encoding)
+        return HttpResponse(response.url, response.status_code, dict(response.headers), content, encoding)
+
+
+# Manual check against a local HTTP server: 200, then a cache hit, then a 304 revalidation
+if __name__ == "__main__":
+    import tempfile
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            etag = '"v1"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            body = b"<html><title>Local</title><body>hello</body></html>"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "max-age=1" if self.path == "/fresh" else "no-cache")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    HTTP_CACHE_DIR = tempfile.mkdtemp()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    for path in ("/fresh", "/fresh", "/revalidate", "/revalidate"):
+        r = fetch(base + path)
+        print(path, r.status_code, "from_cache" if r.from_cache else "network", "(304)" if r.revalidated else "")
+    server.shutdown()
@@ -0,0 +1,162 @@
+# ingestion_pipeline.py
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metrics import registry, span
+
+# Default tuning for the embedding stage
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 1.0
+
+def iter_batches(records, batch_size):
+    """Groups an iterable of records into lists of at most batch_size items."""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def embed_batch_with_retry(embedder, texts, max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_RETRY_BACKOFF):
+    """Embeds one batch, retrying with exponential backoff before giving up."""
+    attempt = 0
+    while True:
+        try:
+            with span("embed.batch"):
+                return embedder.embed_documents(texts)
+        except Exception:
+            attempt += 1
+            if attempt > max_retries:
+                raise
+            registry.inc("embed_retries_total")
+            time.sleep(backoff * (2 ** (attempt - 1)))
+
+def chroma_sink(vector_store):
+    """
+    Returns a sink that writes pre-computed embeddings straight into the
+    Chroma collection behind a LangChain vector store.
+    """
+    def write(ids, texts, embeddings, metadatas):
+        vector_store._collection.upsert(
+            ids=ids,
+            documents=texts,
+            embeddings=embeddings,
+            metadatas=metadatas if any(metadatas) else None
+        )
+    return write
+
+def run_ingestion(records, embedder, sink, batch_size=DEFAULT_BATCH_SIZE,
+                  max_workers=DEFAULT_MAX_WORKERS, max_retries=DEFAULT_MAX_RETRIES,
+                  retry_backoff=DEFAULT_RETRY_BACKOFF, progress_callback=None, total=None):
+    """
+    Embeds records in batches across a bounded worker pool and writes each
+    batch to the sink as soon as it is ready, so a failing batch does not
+    discard the work already done.
+
+    Args:
+        records (iterable): Dicts with "id", "text" and optional "metadata" keys.
+        embedder: Object exposing embed_documents(texts).
+        sink (callable): Called as sink(ids, texts, embeddings, metadatas) per batch.
+        batch_size (int): Number of chunks per embedding call.
+        max_workers (int): Number of batches embedded concurrently.
+        max_retries (int): Retries per batch before it is recorded as failed.
+        retry_backoff (float): Base delay in seconds between retries.
+        progress_callback (callable, optional): Called with the running stats dict after each batch.
+        total (int, optional): Expected number of records, reported as "chunks_total" for progress display.
+
+    Returns:
+        dict: Counts of written and failed chunks/batches plus elapsed time and throughput.
+    """
+    stats = {
+        "chunks_total": total,
+        "chunks_written": 0,
+        "batches_written": 0,
+        "chunks_failed": 0,
+        "batches_failed": 0,
+        "errors": [],
+        "elapsed": 0.0,
+        "chunks_per_sec": 0.0
+    }
+    start = time.perf_counter()
+    # Keep at most two batches per worker in flight so memory stays bounded
+    max_in_flight = max_workers * 2
+
+    def finish(future, batch):
+        try:
+            embeddings = future.result()
+            sink(
+                [r["id"] for r in batch],
+                [r["text"] for r in batch],
+                embeddings,
+                [r.get("metadata") for r in batch]
+            )
+            stats["chunks_written"] += len(batch)
+            stats["batches_written"] += 1
+        except Exception as e:
+            stats["chunks_failed"] += len(batch)
+            stats["batches_failed"] += 1
+            stats["errors"].append(str(e))
+        stats["elapsed"] = time.perf_counter() - start
+        if progress_callback:
+            progress_callback(dict(stats))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = {}
+        for batch in iter_batches(records, batch_size):
+            # Workers run in a copy of the caller's context so their spans join its request trace
+            future = executor.submit(
+                contextvars.copy_context().run,
+                embed_batch_with_retry, embedder, [r["text"] for r in batch], max_retries, retry_backoff
+            )
+            in_flight[future] = batch
+            if len(in_flight) >= max_in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(future, in_flight.pop(future))
+        for future in list(in_flight):
+            finish(future, in_flight.pop(future))
+
+    stats["elapsed"] = time.perf_counter() - start
+    if stats["elapsed"] > 0:
+        stats["chunks_per_sec"] = stats["chunks_written"] / stats["elapsed"]
+    return stats
+
+def measure_throughput(num_chunks=2000, chunk_size=1000, batch_sizes=(8, 32, 64),
+                       worker_counts=(1, 4, 8), latency=0.05, failure_rate=0.0):
+    """
+    Runs the pipeline against a local fake embedder for every combination of
+    batch size and worker count and returns one stats row per combination.
+    """
+    from fakes import FakeEmbeddings
+
+    text = "x" * chunk_size
+    results = []
+    for batch_size in batch_sizes:
+        for max_workers in worker_counts:
+            embedder = FakeEmbeddings(dim=64, latency=latency, failure_rate=failure_rate)
+            records = ({"id": str(i), "text": f"{i} {text}"} for i in range(num_chunks))
+            stats = run_ingestion(
+                records, embedder, lambda *args: None,
+                batch_size=batch_size, max_workers=max_workers, retry_backoff=0.0
+            )
+            results.append({
+                "batch_size": batch_size,
+                "max_workers": max_workers,
+                "chunks_written": stats["chunks_written"],
+                "chunks_failed": stats["chunks_failed"],
+                "elapsed": round(stats["elapsed"], 3),
+                "chunks_per_sec": round(stats["chunks_per_sec"], 1)
+            })
+    return results
+
+
+# Offline tuning run
+if __name__ == "__main__":
+    print(f"{'batch':>6} {'workers':>8} {'written':>8} {'failed':>7} {'secs':>7} {'chunks/s':>9}")
+    for row in measure_throughput():
+        print(f"{row['batch_size']:>6} {row['max_workers']:>8} {row['chunks_written']:>8} "
+              f"{row['chunks_failed']:>7} {row['elapsed']:>7} {row['chunks_per_sec']:>9}")
@@ -0,0 +1,158 @@
+# lexical_index.py
+import os
+import re
+import json
+import math
+import threading
+from collections import Counter
+
+# BM25 indexes live next to the Chroma collections they mirror
+LEXICAL_INDEX_DIR = os.path.join("chroma_db", "lexical")
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Keeps identifiers such as "4.2.1", "AB-1234" or "v2/api" together as single tokens
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-/_][a-z0-9]+)*")
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+class BM25Index:
+    """
+    In-memory inverted index with BM25 scoring, persisted as JSON.
+
+    Only the chunk texts and metadata are stored on disk; postings and term
+    frequencies are rebuilt when the file is loaded.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.docs = {}
+        self.postings = {}
+        self.total_length = 0
+        self._mtime = None
+        self._lock = threading.RLock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _index(self, doc_id, text, metadata):
+        tf = Counter(tokenize(text))
+        length = sum(tf.values())
+        self.docs[doc_id] = {"text": text, "metadata": metadata or {}, "length": length}
+        self.total_length += length
+        for term, count in tf.items():
+            self.postings.setdefault(term, {})[doc_id] = count
+
+    def _unindex(self, doc_id):
+        doc = self.docs.pop(doc_id)
+        self.total_length -= doc["length"]
+        for term in set(tokenize(doc["text"])):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self.postings[term]
+
+    def _load(self):
+        with open(self.path, "r") as f:
+            data = json.load(f)
+        self.docs, self.postings, self.total_length = {}, {}, 0
+        for doc_id, doc in data["docs"].items():
+            self._index(doc_id, doc["text"], doc["metadata"])
+        self._mtime = os.path.getmtime(self.path)
+
+    def refresh(self):
+        """Reloads the index if another process rewrote the file."""
+        with self._lock:
+            if self.path and os.path.exists(self.path) and os.path.getmtime(self.path) != self._mtime:
+                self._load()
+
+    def add(self, ids, texts, metadatas=None):
+        """Adds chunks that are not already indexed."""
+        metadatas = metadatas or [None] * len(ids)
+        with self._lock:
+            for doc_id, text, metadata in zip(ids, texts, metadatas):
+                if doc_id not in self.docs:
+                    self._index(doc_id, text, metadata)
+
+    def remove_documents(self, doc_ids):
+        """Drops the chunks whose metadata doc_id is in doc_ids; returns how many were dropped."""
+        doc_ids = set(doc_ids)
+        with self._lock:
+            removed = [chunk_id for chunk_id, doc in self.docs.items() if doc["metadata"].get("doc_id") in doc_ids]
+            for chunk_id in removed:
+                self._unindex(chunk_id)
+        return len(removed)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"docs": {
+                    doc_id: {"text": doc["text"], "metadata": doc["metadata"]}
+                    for doc_id, doc in self.docs.items()
+                }}, f)
+            os.replace(tmp_path, self.path)
+            self._mtime = os.path.getmtime(self.path)
+
+    def search(self, query, k=10, doc_ids=None):
+        """
+        Returns up to k (chunk_id, score) pairs ranked by BM25.
+
+        Args:
+            query (str): Free-text query.
+            k (int): Number of results.
+            doc_ids (list, optional): Only chunks whose metadata doc_id is in this list.
+        """
+        allowed = set(doc_ids) if doc_ids else None
+        with self._lock:
+            n = len(self.docs)
+            if not n:
+                return []
+            avg_length = self.total_length / n
+            scores = Counter()
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    doc = self.docs[chunk_id]
+                    if allowed is not None and doc["metadata"].get("doc_id") not in allowed:
+                        continue
+                    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * doc["length"] / avg_length)
+                    scores[chunk_id] += idf * tf * (BM25_K1 + 1) / norm
+            return scores.most_common(k)
+
+    def get(self, chunk_id):
+        with self._lock:
+            return self.docs.get(chunk_id)
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_lexical_index(collection_name):
+    """Returns the process-wide BM25 index mirroring one Chroma collection."""
+    with _indexes_lock:
+        if collection_name not in _indexes:
+            _indexes[collection_name] = BM25Index(os.path.join(LEXICAL_INDEX_DIR, f"{collection_name}.json"))
+        index = _indexes[collection_name]
+    index.refresh()
+    return index
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuses several ranked lists of keys into one, scoring each key by the sum
+    of 1 / (k + rank) over the lists it appears in.
+    """
+    scores = Counter()
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, 1):
+            scores[key] += 1.0 / (k + rank)
+    return [key for key, _ in scores.most_common()]
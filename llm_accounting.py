@@ -0,0 +1,340 @@
+# llm_accounting.py
+import os
+import time
+import atexit
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from metrics import registry, current_request_id
+
+load_dotenv()
+
+# Local rollup of model usage, one row per hour, feature and user
+LLM_USAGE_DB = os.getenv("LLM_USAGE_DB", "llm_usage.sqlite3")
+# Used when the model does not report token counts (LangChain fakes, errors before a response)
+CHARS_PER_TOKEN = 4
+# Prompts above this many tokens raise an alert regardless of history
+PROMPT_TOKEN_ALERT = int(os.getenv("LLM_PROMPT_TOKEN_ALERT", "30000"))
+# ...as do prompts this many times larger than the feature's running average
+PROMPT_GROWTH_ALERT = 5.0
+# Calls seen for a feature before the growth alert applies
+PROMPT_GROWTH_MIN_CALLS = 20
+# Weight of the newest prompt in the running average
+PROMPT_AVERAGE_WEIGHT = 0.05
+# Pending rollup rows are written at most this often
+FLUSH_INTERVAL = 5.0
+
+def estimate_tokens(chars):
+    """Approximate token count of a text of the given length."""
+    return (chars + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def _prompt_text(prompt):
+    if isinstance(prompt, str):
+        return prompt
+    if isinstance(prompt, (list, tuple)):
+        return "\n".join(_prompt_text(part) for part in prompt)
+    if isinstance(prompt, dict):
+        return "\n".join(_prompt_text(value) for value in prompt.values())
+    return str(getattr(prompt, "content", prompt))
+
+class CallMeter:
+    """
+    Measures one model call: prompt and output tokens (as reported by the
+    model, or estimated from text length), latency, retries and the error, if
+    any. Used as a context manager around the call; the measurement is
+    recorded with the accountant on exit.
+
+    Args:
+        feature (str): Feature context making the call, e.g. "chatbot" or "rag_doc".
+        username (str, optional): Caller.
+        prompt (optional): The prompt sent, used to estimate its size when the model reports none.
+    """
+
+    def __init__(self, feature, username=None, prompt=None, accountant=None):
+        self.feature = feature
+        self.username = username or ""
+        self.prompt_chars = len(_prompt_text(prompt)) if prompt is not None else 0
+        self.prompt_tokens = None
+        self.output_tokens = None
+        self.output_chars = 0
+        self.retries = 0
+        self.accountant = accountant
+        self._started = None
+
+    def set_prompt(self, prompt):
+        """Replaces the prompt estimate, e.g. once a chain has rendered its final prompt."""
+        self.prompt_chars = len(_prompt_text(prompt))
+
+    def add_output(self, text):
+        self.output_chars += len(text or "")
+
+    def set_usage(self, prompt_tokens=None, output_tokens=None):
+        if prompt_tokens:
+            self.prompt_tokens = int(prompt_tokens)
+        if output_tokens:
+            self.output_tokens = int(output_tokens)
+
+    def record_response(self, response):
+        """Takes token counts from a Gemini response (or the last chunk of a stream) when present."""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            self.set_usage(getattr(usage, "prompt_token_count", None), getattr(usage, "candidates_token_count", None))
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        error = None
+        # A caller abandoning a stream is not a failed call
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+            error = exc_type.__name__
+        (self.accountant or accountant).record(
+            feature=self.feature,
+            username=self.username,
+            prompt_tokens=self.prompt_tokens or estimate_tokens(self.prompt_chars),
+            output_tokens=self.output_tokens or estimate_tokens(self.output_chars),
+            latency=time.perf_counter() - self._started,
+            retries=self.retries,
+            error=error,
+            estimated=self.prompt_tokens is None
+        )
+        return False
+
+def langchain_callback(meter):
+    """
+    Returns a LangChain callback handler feeding a CallMeter with the prompt
+    the chat model actually received (after retrieval and templating) and the
+    token usage it reported. LangChain is imported on first use.
+    """
+    from langchain_core.callbacks import AsyncCallbackHandler
+
+    class UsageCallback(AsyncCallbackHandler):
+        async def on_chat_model_start(self, serialized, messages, **kwargs):
+            meter.set_prompt([message for batch in messages for message in batch])
+
+        async def on_llm_start(self, serialized, prompts, **kwargs):
+            meter.set_prompt(prompts)
+
+        async def on_llm_end(self, response, **kwargs):
+            for generations in response.generations:
+                for generation in generations:
+                    usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                    if usage:
+                        meter.set_usage(usage.get("input_tokens"), usage.get("output_tokens"))
+
+    return UsageCallback()
+
+class UsageAccountant:
+    """
+    Rolls model call measurements up per hour, feature and user into a local
+    SQLite file, mirrors per-feature totals into the Prometheus metrics, and
+    raises an alert when a prompt is far larger than usual.
+
+    Rows are aggregated in memory and written every FLUSH_INTERVAL seconds
+    by a background thread, so recording a call (often on the shared model
+    loop) never waits on the disk.
+
+    Args:
+        path (str): SQLite file; ":memory:" for a throwaway store.
+    """
+
+    def __init__(self, path=LLM_USAGE_DB, prompt_token_alert=PROMPT_TOKEN_ALERT,
+                 growth_alert=PROMPT_GROWTH_ALERT, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.prompt_token_alert = prompt_token_alert
+        self.growth_alert = growth_alert
+        self.flush_interval = flush_interval
+        self._conn = None
+        self._pending = {}
+        self._pending_alerts = []
+        self._averages = {}
+        self._flusher = None
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS llm_usage (
+                    hour TEXT NOT NULL,
+                    feature TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    calls INTEGER NOT NULL,
+                    errors INTEGER NOT NULL,
+                    retries INTEGER NOT NULL,
+                    prompt_tokens INTEGER NOT NULL,
+                    output_tokens INTEGER NOT NULL,
+                    estimated_calls INTEGER NOT NULL,
+                    latency_total REAL NOT NULL,
+                    latency_max REAL NOT NULL,
+                    prompt_tokens_max INTEGER NOT NULL,
+                    PRIMARY KEY (hour, feature, username)
+                );
+                CREATE TABLE IF NOT EXISTS llm_prompt_alerts (
+                    created_at TEXT NOT NULL,
+                    feature TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    prompt_tokens INTEGER NOT NULL,
+                    reason TEXT NOT NULL,
+                    request_id TEXT
+                );
+            """)
+        return self._conn
+
+    def record(self, feature, username, prompt_tokens, output_tokens, latency, retries=0, error=None, estimated=False):
+        outcome = "error" if error else "ok"
+        registry.inc("llm_calls_total", feature=feature, outcome=outcome)
+        registry.inc("llm_prompt_tokens_total", prompt_tokens, feature=feature)
+        registry.inc("llm_output_tokens_total", output_tokens, feature=feature)
+        if retries:
+            registry.inc("llm_retries_total", retries, feature=feature)
+        registry.observe("llm_call_seconds", latency, feature=feature)
+
+        hour = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:00")
+        key = (hour, feature, username or "")
+        with self._lock:
+            row = self._pending.setdefault(key, [0, 0, 0, 0, 0, 0, 0.0, 0.0, 0])
+            row[0] += 1
+            row[1] += int(error is not None)
+            row[2] += retries
+            row[3] += prompt_tokens
+            row[4] += output_tokens
+            row[5] += int(estimated)
+            row[6] += latency
+            row[7] = max(row[7], latency)
+            row[8] = max(row[8], prompt_tokens)
+            reason = self._check_prompt_size(feature, prompt_tokens)
+            if reason:
+                self._pending_alerts.append((datetime.now(timezone.utc).isoformat(), feature, username or "",
+                                             prompt_tokens, reason, current_request_id()))
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, name="llm-usage-flush", daemon=True)
+                self._flusher.start()
+        if reason:
+            registry.inc("llm_prompt_alerts_total", feature=feature)
+            print(f"Warning: {feature} prompt of {prompt_tokens} tokens for user {username or '-'} ({reason})")
+
+    def _check_prompt_size(self, feature, prompt_tokens):
+        """Returns why the prompt is alarming, or None; also updates the feature's running average."""
+        calls, average = self._averages.get(feature, (0, 0.0))
+        reason = None
+        if prompt_tokens > self.prompt_token_alert:
+            reason = f"above {self.prompt_token_alert} tokens"
+        elif calls >= PROMPT_GROWTH_MIN_CALLS and prompt_tokens > self.growth_alert * average:
+            reason = f"{prompt_tokens / average:.1f}x the average of {average:.0f} tokens"
+        average = prompt_tokens if not calls else average + PROMPT_AVERAGE_WEIGHT * (prompt_tokens - average)
+        self._averages[feature] = (calls + 1, average)
+        return reason
+
+    def flush(self):
+        """Writes the pending rollup rows and alerts to the SQLite file."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            alerts, self._pending_alerts = self._pending_alerts, []
+        if not pending and not alerts:
+            return
+        try:
+            with self._db_lock:
+                conn = self._connect()
+                conn.executemany("""
+                    INSERT INTO llm_usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (hour, feature, username) DO UPDATE SET
+                        calls = calls + excluded.calls,
+                        errors = errors + excluded.errors,
+                        retries = retries + excluded.retries,
+                        prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                        output_tokens = output_tokens + excluded.output_tokens,
+                        estimated_calls = estimated_calls + excluded.estimated_calls,
+                        latency_total = latency_total + excluded.latency_total,
+                        latency_max = MAX(latency_max, excluded.latency_max),
+                        prompt_tokens_max = MAX(prompt_tokens_max, excluded.prompt_tokens_max)
+                """, [key + tuple(row) for key, row in pending.items()])
+                conn.executemany("INSERT INTO llm_prompt_alerts VALUES (?, ?, ?, ?, ?, ?)", alerts)
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error writing LLM usage rollup: {e}")
+
+    def close(self):
+        """Flushes pending rows and closes the SQLite file; a later record or report reopens it."""
+        self.flush()
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def report(self, hours=24, group_by="feature"):
+        """
+        Usage totals over the last hours, grouped by "feature", "username" or both ("feature,username").
+
+        Returns:
+            list: Dicts with calls, errors, retries, prompt/output tokens, average and
+                slowest latency in ms and the largest prompt, most prompt tokens first.
+        """
+        columns = [column.strip() for column in group_by.split(",")]
+        if not set(columns) <= {"feature", "username"}:
+            raise ValueError(f"Cannot group by {group_by!r}")
+        self.flush()
+        since = datetime.fromtimestamp(time.time() - hours * 3600, timezone.utc).strftime("%Y-%m-%dT%H:00")
+        keys = ", ".join(columns)
+        with self._db_lock:
+            rows = self._connect().execute(f"""
+                SELECT {keys}, SUM(calls), SUM(errors), SUM(retries), SUM(prompt_tokens), SUM(output_tokens),
+                       SUM(latency_total), MAX(latency_max), MAX(prompt_tokens_max), SUM(estimated_calls)
+                FROM llm_usage WHERE hour >= ? GROUP BY {keys} ORDER BY SUM(prompt_tokens) DESC
+            """, (since,)).fetchall()
+        report = []
+        for row in rows:
+            calls, errors, retries, prompt_tokens, output_tokens, latency_total, latency_max, prompt_max, estimated = row[len(columns):]
+            entry = dict(zip(columns, row[:len(columns)]))
+            entry.update({
+                "calls": calls,
+                "errors": errors,
+                "retries": retries,
+                "prompt_tokens": prompt_tokens,
+                "output_tokens": output_tokens,
+                "avg_latency_ms": round(latency_total / calls * 1000, 1),
+                "max_latency_ms": round(latency_max * 1000, 1),
+                "max_prompt_tokens": prompt_max,
+                "estimated_calls": estimated
+            })
+            report.append(entry)
+        return report
+
+    def recent_alerts(self, limit=20):
+        self.flush()
+        with self._db_lock:
+            rows = self._connect().execute(
+                "SELECT * FROM llm_prompt_alerts ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(zip(("created_at", "feature", "username", "prompt_tokens", "reason", "request_id"), row))
+                for row in rows]
+
+# Process-wide accountant used by model_client
+accountant = UsageAccountant()
+atexit.register(accountant.flush)
+
+
+# Prints the usage rollup: python llm_accounting.py [hours] [feature|username|feature,username]
+if __name__ == "__main__":
+    import sys
+
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 24
+    group_by = sys.argv[2] if len(sys.argv) > 2 else "feature"
+    rows = accountant.report(hours, group_by)
+    if not rows:
+        print(f"No model calls recorded in {LLM_USAGE_DB} in the last {hours:g} hours.")
+    for row in rows:
+        print(row)
+    alerts = accountant.recent_alerts()
+    if alerts:
+        print("\nRecent prompt-size alerts:")
+        for alert in alerts:
+            print(alert)
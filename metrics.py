@@ -0,0 +1,322 @@
+# metrics.py
+import os
+import time
+import uuid
+import inspect
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Prefix of every exported metric name
+METRIC_PREFIX = "smartlexicon"
+# Upper bounds (seconds) of the stage latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Serve /metrics on this port when set (0 disables the endpoint)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Rewrite this file with the Prometheus text every METRICS_FILE_INTERVAL seconds when set
+METRICS_FILE = os.getenv("METRICS_FILE")
+METRICS_FILE_INTERVAL = float(os.getenv("METRICS_FILE_INTERVAL", "15"))
+# Show the per-request timing panel in the app sidebar
+DEBUG_PANEL = os.getenv("METRICS_DEBUG_PANEL", "0") == "1"
+# Spans kept per request trace; later spans still feed the histograms
+MAX_TRACE_SPANS = 1000
+
+# Correlation ID and span list of the request being handled; copied into
+# model client tasks and ingestion worker threads along with the context
+_request_id = contextvars.ContextVar("request_id", default=None)
+_trace = contextvars.ContextVar("trace", default=None)
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+class MetricsRegistry:
+    """
+    Process-wide counters and histograms keyed by name and label set.
+
+    Label values should come from a small fixed set (stage names, feature
+    contexts, hit/miss); per-request values belong in the trace instead.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def counter_value(self, name, **labels):
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram_snapshot(self, name, **labels):
+        """Returns (count, sum) of a histogram, or (0, 0.0) if it was never observed."""
+        with self._lock:
+            histogram = self._histograms.get((name, tuple(sorted(labels.items()))))
+            return (histogram.count, histogram.sum) if histogram else (0, 0.0)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render_prometheus(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+            histograms = [(key, (h.buckets, list(h.counts), h.count, h.sum)) for key, h in histograms]
+
+        typed = set()
+        for (name, labels), value in counters:
+            full_name = f"{METRIC_PREFIX}_{name}"
+            if full_name not in typed:
+                typed.add(full_name)
+                lines.append(f"# TYPE {full_name} counter")
+            lines.append(f"{full_name}{_format_labels(labels)} {value}")
+        for (name, labels), (buckets, counts, count, total) in histograms:
+            full_name = f"{METRIC_PREFIX}_{name}"
+            if full_name not in typed:
+                typed.add(full_name)
+                lines.append(f"# TYPE {full_name} histogram")
+            for bound, bucket_count in zip(buckets, counts):
+                lines.append(f"{full_name}_bucket{_format_labels(labels + (('le', repr(float(bound))),))} {bucket_count}")
+            lines.append(f"{full_name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{full_name}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{full_name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels) + "}"
+
+# Process-wide registry used by every instrumented module
+registry = MetricsRegistry()
+
+def new_request_id():
+    return uuid.uuid4().hex[:12]
+
+def current_request_id():
+    return _request_id.get()
+
+def current_trace():
+    """Returns the spans recorded so far for the current request (empty outside one)."""
+    return list(_trace.get() or [])
+
+@contextmanager
+def request_context(request_id=None):
+    """
+    Starts a request: stages timed inside the block share one correlation ID
+    and are collected into its trace. Nested calls keep the outer request.
+
+    Yields:
+        str: The request's correlation ID.
+    """
+    if _request_id.get() is not None:
+        yield _request_id.get()
+        return
+    id_token = _request_id.set(request_id or new_request_id())
+    trace_token = _trace.set([])
+    try:
+        yield _request_id.get()
+    finally:
+        _trace.reset(trace_token)
+        _request_id.reset(id_token)
+
+def record(stage, seconds, error=False, **labels):
+    """Records one completed stage: latency histogram, error counter and a span in the request trace."""
+    registry.observe("stage_duration_seconds", seconds, stage=stage, **labels)
+    if error:
+        registry.inc("stage_errors_total", stage=stage, **labels)
+    trace = _trace.get()
+    if trace is not None and len(trace) < MAX_TRACE_SPANS:
+        trace.append({
+            "request_id": _request_id.get(),
+            "stage": stage,
+            "ms": round(seconds * 1000, 3),
+            "error": error,
+            **labels
+        })
+
+@contextmanager
+def span(stage, **labels):
+    """Times the enclosed block as one stage; exceptions are counted and re-raised."""
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException as e:
+        # A closed generator is not a failure of the stage
+        error = not isinstance(e, GeneratorExit)
+        raise
+    finally:
+        record(stage, time.perf_counter() - started, error=error, **labels)
+
+def timed(stage, **labels):
+    """Decorator timing every call of a function (or coroutine function) as a stage."""
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage, **labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+class StageTimer:
+    """
+    Accumulates the time of a stage that runs in many small slices, such as
+    pulling pages from a streaming extractor, and records it as one span.
+    """
+
+    def __init__(self, stage, **labels):
+        self.stage = stage
+        self.labels = labels
+        self.seconds = 0.0
+        self.calls = 0
+
+    @contextmanager
+    def measure(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.calls += 1
+
+    def wrap(self, iterable):
+        """Yields from iterable, counting the time spent producing each item."""
+        iterator = iter(iterable)
+        while True:
+            with self.measure():
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def record(self):
+        if self.calls:
+            record(self.stage, self.seconds, **self.labels)
+
+def write_metrics_file(path=METRICS_FILE):
+    """Writes the Prometheus text to path atomically, for node_exporter's textfile collector or scraping by hand."""
+    if not path:
+        return
+    with open(path + ".tmp", "w") as f:
+        f.write(registry.render_prometheus())
+    os.replace(path + ".tmp", path)
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+def _serve_metrics(port):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+def _write_periodically(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            write_metrics_file(path)
+        except OSError as e:
+            print(f"Error writing metrics file: {e}")
+
+def start_exporters(port=METRICS_PORT, path=METRICS_FILE, interval=METRICS_FILE_INTERVAL):
+    """Starts the /metrics endpoint and the metrics file writer if configured; safe to call on every rerun."""
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+        if port:
+            try:
+                _serve_metrics(port)
+            except OSError as e:
+                print(f"Error starting metrics endpoint on port {port}: {e}")
+        if path:
+            threading.Thread(target=_write_periodically, args=(path, interval),
+                             name="metrics-file", daemon=True).start()
+
+def summarize_trace(trace):
+    """Aggregates a request trace per stage: calls, total and slowest milliseconds, errors."""
+    stages = {}
+    for entry in trace:
+        summary = stages.setdefault(entry["stage"], {"stage": entry["stage"], "calls": 0, "total_ms": 0.0,
+                                                     "max_ms": 0.0, "errors": 0})
+        summary["calls"] += 1
+        summary["total_ms"] = round(summary["total_ms"] + entry["ms"], 3)
+        summary["max_ms"] = max(summary["max_ms"], entry["ms"])
+        summary["errors"] += int(entry["error"])
+    return list(stages.values())
+
+
+# Manual check: records a few nested stages and prints the trace and the Prometheus text
+if __name__ == "__main__":
+    with request_context() as request_id:
+        with span("demo.outer"):
+            timer = StageTimer("demo.produce")
+            for _ in timer.wrap(range(3)):
+                with span("demo.inner"):
+                    time.sleep(0.01)
+            timer.record()
+        print(f"request {request_id}:")
+        for row in summarize_trace(current_trace()):
+            print(f"  {row}")
+    print(registry.render_prometheus())
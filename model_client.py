@@ -0,0 +1,224 @@
+# model_client.py
+import os
+import time
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from metrics import span, record
+from llm_accounting import CallMeter, langchain_callback
+
+load_dotenv()
+
+# Limits shared by every Gemini call made by this process
+MAX_CONCURRENT_CALLS = int(os.getenv("MODEL_MAX_CONCURRENT_CALLS", "8"))
+MAX_CALLS_PER_USER = int(os.getenv("MODEL_MAX_CALLS_PER_USER", "2"))
+# Retries of a call that failed with a transient error (rate limit, timeout,
+# unavailable) before any output was returned, with exponential backoff
+MAX_RETRIES = int(os.getenv("MODEL_MAX_RETRIES", "2"))
+RETRY_BACKOFF = 1.0
+TRANSIENT_ERRORS = ("ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded",
+                    "InternalServerError", "GatewayTimeout")
+# Feature recorded for calls whose caller does not name one
+DEFAULT_FEATURE = "other"
+
+def is_transient(error):
+    """True for errors worth retrying: timeouts, dropped connections and the API's rate-limit/5xx errors."""
+    return isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)) or type(error).__name__ in TRANSIENT_ERRORS
+
+class ModelClient:
+    """
+    Asyncio gateway for model calls.
+
+    All calls run on one background event loop and pass through a global
+    semaphore (MAX_CONCURRENT_CALLS) and a per-user semaphore
+    (MAX_CALLS_PER_USER), so a single user cannot take every slot and
+    waiting Streamlit sessions do not each pin a thread on the network.
+    Synchronous callers use run_sync / iter_sync.
+
+    Every call is metered (prompt and output tokens, latency, retries,
+    errors) per feature and user by llm_accounting, and transient failures
+    are retried as long as nothing has been returned to the caller yet.
+    """
+
+    def __init__(self, max_concurrency=MAX_CONCURRENT_CALLS, per_user_limit=MAX_CALLS_PER_USER,
+                 max_retries=MAX_RETRIES, retry_backoff=RETRY_BACKOFF):
+        self.max_concurrency = max_concurrency
+        self.per_user_limit = per_user_limit
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._loop = None
+        self._global = None
+        self._users = {}
+        self._start_lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="model-client", daemon=True).start()
+                self._loop = loop
+        return self._loop
+
+    @asynccontextmanager
+    async def slot(self, username=None):
+        """Holds one per-user and one global concurrency slot for the duration of a call."""
+        if self._global is None:
+            self._global = asyncio.Semaphore(self.max_concurrency)
+        key = username or ""
+        entry = self._users.setdefault(key, [asyncio.Semaphore(self.per_user_limit), 0])
+        entry[1] += 1
+        waiting_since = time.perf_counter()
+        try:
+            async with entry[0]:
+                async with self._global:
+                    # Time spent queued behind the concurrency limits
+                    record("model.queue", time.perf_counter() - waiting_since)
+                    yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._users[key]
+
+    async def _backoff(self, meter, attempt, error):
+        """Waits before the next attempt, or re-raises when the error is final."""
+        if attempt >= self.max_retries or not is_transient(error):
+            raise error
+        meter.retries += 1
+        await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+
+    async def generate(self, model, prompt, username=None, feature=DEFAULT_FEATURE):
+        """Runs model.generate_content_async under the concurrency limits and returns the text."""
+        with CallMeter(feature, username, prompt) as meter:
+            attempt = 0
+            while True:
+                try:
+                    async with self.slot(username):
+                        with span("model.generate"):
+                            response = await model.generate_content_async(prompt)
+                            text = response.text
+                    meter.record_response(response)
+                    meter.add_output(text)
+                    return text
+                except Exception as e:
+                    await self._backoff(meter, attempt, e)
+                    attempt += 1
+
+    async def stream(self, model, prompt, username=None, feature=DEFAULT_FEATURE):
+        """Yields text fragments from a streaming generate_content_async call, holding a slot throughout."""
+        with CallMeter(feature, username, prompt) as meter:
+            attempt = 0
+            while True:
+                yielded = False
+                try:
+                    async with self.slot(username):
+                        started = time.perf_counter()
+                        with span("model.stream"):
+                            response = await model.generate_content_async(prompt, stream=True)
+                            async for chunk in response:
+                                # Token usage arrives with the last chunk
+                                meter.record_response(chunk)
+                                if chunk.text:
+                                    if not yielded:
+                                        record("model.first_token", time.perf_counter() - started)
+                                        yielded = True
+                                    meter.add_output(chunk.text)
+                                    yield chunk.text
+                    return
+                except Exception as e:
+                    if yielded:
+                        raise
+                    await self._backoff(meter, attempt, e)
+                    attempt += 1
+
+    async def invoke(self, runnable, inputs, username=None, feature=DEFAULT_FEATURE):
+        """Runs a LangChain runnable's ainvoke under the concurrency limits."""
+        with CallMeter(feature, username, inputs) as meter:
+            # The callback swaps the input estimate for the prompt the chat model actually receives
+            config = {"callbacks": [langchain_callback(meter)]}
+            attempt = 0
+            while True:
+                try:
+                    async with self.slot(username):
+                        with span("model.invoke"):
+                            result = await runnable.ainvoke(inputs, config=config)
+                    meter.add_output(result if isinstance(result, str) else getattr(result, "content", ""))
+                    return result
+                except Exception as e:
+                    await self._backoff(meter, attempt, e)
+                    attempt += 1
+
+    async def astream(self, runnable, inputs, username=None, feature=DEFAULT_FEATURE):
+        """Yields chunks from a LangChain runnable's astream, holding a slot throughout."""
+        with CallMeter(feature, username, inputs) as meter:
+            config = {"callbacks": [langchain_callback(meter)]}
+            attempt = 0
+            while True:
+                yielded = False
+                try:
+                    async with self.slot(username):
+                        with span("model.astream"):
+                            async for chunk in runnable.astream(inputs, config=config):
+                                yielded = True
+                                meter.add_output(chunk if isinstance(chunk, str) else getattr(chunk, "content", ""))
+                                yield chunk
+                    return
+                except Exception as e:
+                    if yielded:
+                        raise
+                    await self._backoff(meter, attempt, e)
+                    attempt += 1
+
+    def run_sync(self, coro):
+        """Runs a coroutine on the shared loop and blocks the calling thread for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop()).result()
+
+    def iter_sync(self, agen):
+        """Iterates an async generator on the shared loop from synchronous code."""
+        async def next_item():
+            return await agen.__anext__()
+
+        while True:
+            try:
+                item = self.run_sync(next_item())
+            except StopAsyncIteration:
+                return
+            yield item
+
+# Process-wide client used by gemini_backend, vector_rag and webscrapping
+model_client = ModelClient()
+
+def load_test(sessions=50, calls_per_session=5, latency=0.2, max_concurrency=MAX_CONCURRENT_CALLS,
+              per_user_limit=MAX_CALLS_PER_USER, users=10):
+    """
+    Drives many concurrent sessions against a local fake model and reports
+    throughput and the highest concurrency the model actually saw.
+    """
+    import time
+    from fakes import FakeGenerativeModel
+
+    fake = FakeGenerativeModel(latency=latency)
+    client = ModelClient(max_concurrency=max_concurrency, per_user_limit=per_user_limit)
+
+    async def session(index):
+        for call in range(calls_per_session):
+            await client.generate(fake, f"session {index} call {call}", username=f"user{index % users}")
+
+    async def main():
+        await asyncio.gather(*(session(i) for i in range(sessions)))
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    elapsed = time.perf_counter() - start
+    calls = sessions * calls_per_session
+    return {
+        "calls": calls,
+        "elapsed": round(elapsed, 3),
+        "calls_per_sec": round(calls / elapsed, 1),
+        "max_in_flight": fake.max_in_flight
+    }
+
+
+# Offline load test
+if __name__ == "__main__":
+    print(load_test())
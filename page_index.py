@@ -0,0 +1,83 @@
+# page_index.py
+import hashlib
+import threading
+from collections import OrderedDict
+from lexical_index import BM25Index
+
+# Chunking and prompt sizing for scraped pages
+PAGE_CHUNK_CHARS = 1200
+PAGE_CHUNK_OVERLAP = 150
+PAGE_TOP_K = 4
+# Pages with less text than this are still sent whole on the first formatting request
+FULL_PAGE_CHAR_LIMIT = 12000
+# Scraped pages kept indexed in memory
+MAX_INDEXED_PAGES = 64
+# Metadata keys worth sending to the model
+METADATA_KEYS = ("description", "og:description", "keywords", "og:title", "author")
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+def chunk_page_text(text, chunk_chars=PAGE_CHUNK_CHARS, overlap=PAGE_CHUNK_OVERLAP):
+    """Splits page text on line boundaries into chunks of about chunk_chars with some overlap."""
+    chunks = []
+    current = []
+    size = 0
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if size + len(line) > chunk_chars and current:
+            chunk = "\n".join(current)
+            chunks.append(chunk)
+            tail = chunk[-overlap:] if overlap else ""
+            current, size = ([tail] if tail else []), len(tail)
+        # Hard-wrap single lines longer than a chunk
+        while len(line) > chunk_chars:
+            chunks.append(line[:chunk_chars])
+            line = line[chunk_chars - overlap:]
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+def _page_key(scraped_content):
+    text = scraped_content.get("text_content", "")
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def get_page_index(scraped_content):
+    """
+    Returns (chunks, index) for a scraped page, chunking and indexing it only
+    the first time this content is seen.
+    """
+    key = _page_key(scraped_content)
+    with _lock:
+        if key in _indexes:
+            _indexes.move_to_end(key)
+            return _indexes[key]
+    chunks = chunk_page_text(scraped_content.get("text_content", ""))
+    index = BM25Index()
+    index.add([str(i) for i in range(len(chunks))], chunks)
+    with _lock:
+        _indexes[key] = (chunks, index)
+        while len(_indexes) > MAX_INDEXED_PAGES:
+            _indexes.popitem(last=False)
+    return chunks, index
+
+def relevant_page_content(scraped_content, question, k=PAGE_TOP_K):
+    """
+    Returns a compact view of a scraped page for a question: the title, a
+    few useful metadata fields and the k most relevant text excerpts, in
+    page order. Falls back to the opening excerpts when nothing matches.
+    """
+    chunks, index = get_page_index(scraped_content)
+    hits = index.search(question, k=k)
+    positions = sorted(int(chunk_id) for chunk_id, _ in hits) or list(range(min(k, len(chunks))))
+    metadata = scraped_content.get("metadata", {})
+    return {
+        "title": scraped_content.get("title"),
+        "metadata": {key: metadata[key] for key in METADATA_KEYS if metadata.get(key)},
+        "excerpts": [chunks[position] for position in positions],
+        "excerpt_count": f"{len(positions)} of {len(chunks)}"
+    }
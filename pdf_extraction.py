@@ -0,0 +1,80 @@
+# pdf_extraction.py
+import io
+from concurrent.futures import ProcessPoolExecutor
+from PyPDF2 import PdfReader
+
+# Pages handed to a worker process per task when extraction is parallelised
+PAGES_PER_TASK = 8
+
+def count_pages(source):
+    """Returns the number of pages in a PDF given as bytes or a file path."""
+    return len(_open_reader(source).pages)
+
+def _open_reader(source):
+    if isinstance(source, (bytes, bytearray)):
+        return PdfReader(io.BytesIO(source))
+    return PdfReader(source)
+
+def _extract_page_range(path, start, stop):
+    # Runs in a worker process: reopen the file rather than pickling page objects
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+def iter_pdf_pages(source):
+    """
+    Yields the text of each page in order, one page at a time.
+
+    Args:
+        source (bytes | str): The PDF contents or a path to the PDF file.
+    """
+    reader = _open_reader(source)
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+def iter_pdf_pages_parallel(path, max_workers=4, pages_per_task=PAGES_PER_TASK):
+    """
+    Yields page texts in order while extracting page ranges in a process pool.
+
+    At most two ranges per worker are outstanding at any time, so memory
+    stays bounded by the window rather than the document size.
+
+    Args:
+        path (str): Path to the PDF file (workers open it themselves).
+        max_workers (int): Number of extraction processes.
+        pages_per_task (int): Pages extracted per task.
+    """
+    total = count_pages(path)
+    ranges = [(start, min(start + pages_per_task, total)) for start in range(0, total, pages_per_task)]
+    window = max_workers * 2
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = []
+        next_range = 0
+        while next_range < len(ranges) or pending:
+            while next_range < len(ranges) and len(pending) < window:
+                start, stop = ranges[next_range]
+                pending.append(executor.submit(_extract_page_range, path, start, stop))
+                next_range += 1
+            for text in pending.pop(0).result():
+                yield text
+
+def iter_chunks(pages, text_splitter):
+    """
+    Splits a stream of page texts into chunks incrementally.
+
+    The trailing chunk of each page is carried into the next page instead of
+    being emitted, so chunks can still span page boundaries while only about
+    one page of text is held at a time.
+    """
+    carry = ""
+    for page_text in pages:
+        if not page_text:
+            continue
+        buffer = f"{carry}\n{page_text}" if carry else page_text
+        chunks = text_splitter.split_text(buffer)
+        if not chunks:
+            continue
+        for chunk in chunks[:-1]:
+            yield chunk
+        carry = chunks[-1]
+    if carry:
+        yield carry
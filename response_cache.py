@@ -0,0 +1,163 @@
+# response_cache.py
+import os
+import re
+import math
+import asyncio
+import time
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Defaults, overridable through the environment
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+# Cosine similarity above which a near-duplicate question reuses a stored answer; unset disables it
+RESPONSE_CACHE_SIMILARITY = os.getenv("RESPONSE_CACHE_SIMILARITY")
+
+def normalize_question(question):
+    """Lower-cases, collapses whitespace and drops trailing punctuation so trivial variants match."""
+    return re.sub(r"\s+", " ", question).strip().lower().rstrip("?!. ")
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+class ResponseCache:
+    """
+    In-memory answer cache with TTL and LRU eviction.
+
+    Entries live under a scope tuple whose first element is the feature
+    ("chatbot", "doc", ...) followed by whatever else the answer depends on,
+    such as the username, the document set and the conversation so far
+    (context_builder.history_fingerprint). A version tag stored with each
+    entry (e.g. the Chroma collection version) invalidates answers computed
+    against older data.
+
+    Args:
+        max_entries (int): Total entries kept across all scopes.
+        ttl (float): Seconds an answer stays valid.
+        similarity_threshold (float, optional): Enables near-duplicate matching when set.
+        embed_fn (callable, optional): Maps a question to a vector for near-duplicate matching.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL,
+                 similarity_threshold=None, embed_fn=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.embed_fn = embed_fn
+        self._entries = OrderedDict()
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _semantic_enabled(self):
+        return self.similarity_threshold is not None and self.embed_fn is not None
+
+    def _count(self, scope, outcome):
+        feature_stats = self._stats.setdefault(scope[0], {"hits": 0, "semantic_hits": 0, "misses": 0})
+        feature_stats[outcome] += 1
+
+    def _live(self, key, entry, version, now):
+        if now - entry["created"] > self.ttl or entry["version"] != version:
+            del self._entries[key]
+            return False
+        return True
+
+    def get(self, question, scope, version=None):
+        """Returns a stored answer for the question in this scope, or None."""
+        key = (scope, normalize_question(question))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._live(key, entry, version, now):
+                self._entries.move_to_end(key)
+                self._count(scope, "hits")
+                return entry["answer"]
+            if not self._semantic_enabled():
+                self._count(scope, "misses")
+                return None
+            candidates = [(k, e) for k, e in self._entries.items() if k[0] == scope and e["vector"] is not None]
+
+        # Embed outside the lock; the embedding cache makes repeats free
+        vector = self.embed_fn(key[1])
+        best_key, best_score = None, self.similarity_threshold
+        for candidate_key, candidate in candidates:
+            score = _cosine(vector, candidate["vector"])
+            if score >= best_score:
+                best_key, best_score = candidate_key, score
+
+        with self._lock:
+            entry = self._entries.get(best_key) if best_key else None
+            if entry is not None and self._live(best_key, entry, version, now):
+                self._entries.move_to_end(best_key)
+                self._count(scope, "semantic_hits")
+                return entry["answer"]
+            self._count(scope, "misses")
+            return None
+
+    def put(self, question, answer, scope, version=None):
+        """Stores an answer, evicting the least recently used entries beyond max_entries."""
+        normalized = normalize_question(question)
+        vector = self.embed_fn(normalized) if self._semantic_enabled() else None
+        with self._lock:
+            key = (scope, normalized)
+            self._entries[key] = {
+                "answer": answer,
+                "created": time.time(),
+                "version": version,
+                "vector": vector
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def aget(self, question, scope, version=None):
+        """
+        get for coroutines on the shared model-client loop: a near-duplicate
+        lookup embeds the question, so it runs in a worker thread instead of
+        stalling every other call.
+        """
+        if not self._semantic_enabled():
+            return self.get(question, scope, version)
+        return await asyncio.to_thread(self.get, question, scope, version)
+
+    async def aput(self, question, answer, scope, version=None):
+        """put counterpart of aget."""
+        if not self._semantic_enabled():
+            return self.put(question, answer, scope, version)
+        return await asyncio.to_thread(self.put, question, answer, scope, version)
+
+    def invalidate(self, feature=None, username=None):
+        """Drops entries for a feature and/or user (scope[0] / scope[1]); everything when both are None."""
+        with self._lock:
+            for key in list(self._entries):
+                scope = key[0]
+                if feature is not None and scope[0] != feature:
+                    continue
+                if username is not None and (len(scope) < 2 or scope[1] != username):
+                    continue
+                del self._entries[key]
+
+    def stats(self):
+        """Returns per-feature hit, near-duplicate hit and miss counts with the overall hit rate."""
+        with self._lock:
+            report = {}
+            for feature, counts in self._stats.items():
+                total = counts["hits"] + counts["semantic_hits"] + counts["misses"]
+                hit_rate = (counts["hits"] + counts["semantic_hits"]) / total if total else 0.0
+                report[feature] = dict(counts, hit_rate=round(hit_rate, 3))
+            report["entries"] = len(self._entries)
+            return report
+
+def _default_embed_fn(text):
+    from embedding_cache import get_cached_embeddings
+    return get_cached_embeddings().embed_query(text)
+
+# Process-wide cache used by gemini_backend and vector_rag
+response_cache = ResponseCache(
+    similarity_threshold=float(RESPONSE_CACHE_SIMILARITY) if RESPONSE_CACHE_SIMILARITY else None,
+    embed_fn=_default_embed_fn
+)
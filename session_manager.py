@@ -1,31 +1,154 @@
 # session_manager.py
 import os
 import json
+import sqlite3
+import threading
+from collections import OrderedDict
 from datetime import datetime
 import uuid
+from metrics import timed, registry
 
 # Base directory for storing all user chat sessions
 BASE_DIR = "chat_sessions"
+# Each session is a small header file plus an append-only message log:
+#   <session_id>.json   title and timestamps (rewritten atomically, never holds new messages)
+#   <session_id>.jsonl  one JSON message per line, only ever appended to
+# Sessions written by older versions keep their messages inside the header and are
+# migrated to the log on the next compaction.
+HEADER_SUFFIX = ".json"
+LOG_SUFFIX = ".jsonl"
+# Per-user SQLite catalog of session headers, so listing never opens session files
+CATALOG_NAME = "catalog.sqlite3"
+
+# Process-wide cache of loaded sessions, bounded by an approximate memory budget
+SESSION_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_catalogs = {}
+_catalog_lock = threading.RLock()
+_session_cache = OrderedDict()
+_session_cache_bytes = 0
+_session_cache_lock = threading.RLock()
+# Serializes the header read-modify-writes and log appends of this process, so concurrent
+# writers to a session neither lose header updates nor interleave with a compaction
+_write_lock = threading.RLock()
 
 def _get_context_dir(username, context):
     context_dir = os.path.join(BASE_DIR, username, context)
     os.makedirs(context_dir, exist_ok=True)
     return context_dir
 
-def list_sessions(context, username):
-    context_dir = _get_context_dir(username, context)
-    sessions = []
-    for fname in os.listdir(context_dir):
-        if fname.endswith(".json"):
-            with open(os.path.join(context_dir, fname), "r") as f:
-                data = json.load(f)
-                sessions.append({
-                    "id": data["session_id"],
-                    "title": data.get("title", "Untitled"),
-                    "updated_at": data.get("updated_at", data.get("created_at"))
-                })
-    sessions.sort(key=lambda x: x["updated_at"], reverse=True)
-    return sessions
+def _header_path(context, username, session_id):
+    return os.path.join(_get_context_dir(username, context), f"{session_id}{HEADER_SUFFIX}")
+
+def _log_path(context, username, session_id):
+    return os.path.join(_get_context_dir(username, context), f"{session_id}{LOG_SUFFIX}")
+
+def _read_header(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def _read_log(path):
+    """Returns (messages, clean); clean is False when a torn or corrupt line was skipped."""
+    messages = []
+    clean = True
+    if not os.path.exists(path):
+        return messages, clean
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A crash mid-append leaves at most a partial line; drop it
+                clean = False
+                continue
+            messages.append({"role": record["role"], "content": record["content"]})
+    return messages, clean
+
+def _get_catalog(username):
+    """Returns the (process-wide) connection to a user's session catalog, creating it if needed."""
+    with _catalog_lock:
+        conn = _catalogs.get(username)
+        if conn is None:
+            user_dir = os.path.join(BASE_DIR, username)
+            os.makedirs(user_dir, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(user_dir, CATALOG_NAME), check_same_thread=False)
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS sessions (
+                    context TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    created_at TEXT,
+                    updated_at TEXT,
+                    message_count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (context, session_id)
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(context, updated_at DESC)")
+            # Contexts whose existing session files have been imported into the catalog
+            conn.execute("CREATE TABLE IF NOT EXISTS indexed_contexts (context TEXT PRIMARY KEY)")
+            conn.commit()
+            _catalogs[username] = conn
+        return conn
+
+def _catalog_upsert(context, username, header):
+    with _catalog_lock:
+        conn = _get_catalog(username)
+        conn.execute(
+            """INSERT OR REPLACE INTO sessions
+               (context, session_id, title, created_at, updated_at, message_count)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (
+                context,
+                header["session_id"],
+                header.get("title", "Untitled"),
+                header.get("created_at"),
+                header.get("updated_at", header.get("created_at")),
+                header.get("message_count", len(header.get("messages", [])))
+            )
+        )
+        conn.commit()
+
+def _ensure_catalog(context, username):
+    """Imports session files written before the catalog existed, once per context."""
+    with _catalog_lock:
+        conn = _get_catalog(username)
+        if conn.execute("SELECT 1 FROM indexed_contexts WHERE context = ?", (context,)).fetchone():
+            return conn
+        context_dir = _get_context_dir(username, context)
+        for fname in os.listdir(context_dir):
+            if fname.endswith(HEADER_SUFFIX):
+                _catalog_upsert(context, username, _read_header(os.path.join(context_dir, fname)))
+        conn.execute("INSERT OR IGNORE INTO indexed_contexts (context) VALUES (?)", (context,))
+        conn.commit()
+        return conn
+
+@timed("session.list")
+def list_sessions(context, username, limit=None, offset=0):
+    """
+    Returns sessions for a context, most recently updated first, read from
+    the user's catalog.
+
+    Args:
+        context (str): Feature context ("chatbot", "doc", ...).
+        username (str): Owner of the sessions.
+        limit (int, optional): Page size; all sessions when None.
+        offset (int): Number of sessions to skip.
+    """
+    with _catalog_lock:
+        conn = _ensure_catalog(context, username)
+        rows = conn.execute(
+            """SELECT session_id, title, updated_at FROM sessions
+               WHERE context = ? ORDER BY updated_at DESC LIMIT ? OFFSET ?""",
+            (context, -1 if limit is None else limit, offset)
+        ).fetchall()
+    return [{"id": session_id, "title": title, "updated_at": updated_at} for session_id, title, updated_at in rows]
+
+def count_sessions(context, username):
+    with _catalog_lock:
+        conn = _ensure_catalog(context, username)
+        return conn.execute("SELECT COUNT(*) FROM sessions WHERE context = ?", (context,)).fetchone()[0]
 
 def create_new_session(context, username, title=None):
     session_id = str(uuid.uuid4())
@@ -35,29 +158,211 @@ def create_new_session(context, username, title=None):
         "title": title or "New Chat",
         "created_at": timestamp,
         "updated_at": timestamp,
-        "messages": []
+        "message_count": 0
     }
     _save_session(context, username, session)
     return session_id
 
+def _file_stamp(context, username, session_id):
+    """Change-detection key: modification time and size of both session files."""
+    stamp = []
+    for path in (_header_path(context, username, session_id), _log_path(context, username, session_id)):
+        try:
+            st = os.stat(path)
+            stamp.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            stamp.append(None)
+    return tuple(stamp)
+
+def _message_size(message):
+    return len(message["content"]) + len(message["role"]) + 64
+
+def _cache_put(key, session, stamp):
+    global _session_cache_bytes
+    with _session_cache_lock:
+        _cache_drop(key)
+        size = sum(_message_size(message) for message in session["messages"]) + 512
+        _session_cache[key] = {"session": session, "stamp": stamp, "size": size}
+        _session_cache_bytes += size
+        while _session_cache_bytes > SESSION_CACHE_MAX_BYTES and len(_session_cache) > 1:
+            _, evicted = _session_cache.popitem(last=False)
+            _session_cache_bytes -= evicted["size"]
+
+def _cache_drop(key):
+    global _session_cache_bytes
+    with _session_cache_lock:
+        entry = _session_cache.pop(key, None)
+        if entry is not None:
+            _session_cache_bytes -= entry["size"]
+
+def _load_session_from_disk(context, session_id, username):
+    header_path = _header_path(context, username, session_id)
+    if not os.path.exists(header_path):
+        return None
+    session = _read_header(header_path)
+    legacy_messages = session.pop("messages", None)
+    messages, clean = _read_log(_log_path(context, username, session_id))
+    # If a migration was interrupted after the log was written, the log already starts with the legacy messages
+    if legacy_messages and messages[:len(legacy_messages)] != legacy_messages:
+        messages = legacy_messages + messages
+    session["messages"] = messages
+    if legacy_messages is not None or not clean:
+        compact_session(context, session_id, username, session)
+    return session
+
+@timed("session.load")
 def load_session(context, session_id, username):
-    session_path = os.path.join(_get_context_dir(username, context), f"{session_id}.json")
-    if os.path.exists(session_path):
-        with open(session_path, "r") as f:
-            return json.load(f)
-    return None
+    """
+    Returns the session with its messages, served from the process-wide
+    cache while the files on disk are unchanged.
 
-def save_message(context, session_id, role, content, username):
-    session = load_session(context, session_id, username)
+    The returned object is shared between callers and must be treated as
+    read-only; copy the message list before modifying it.
+    """
+    key = (username, context, session_id)
+    # Taken before the read: a write landing during the read changes the files, so the next
+    # load sees a different stamp and re-reads instead of serving what was read here
+    stamp = _file_stamp(context, username, session_id)
+    with _session_cache_lock:
+        entry = _session_cache.get(key)
+        if entry is not None and entry["stamp"] == stamp:
+            _session_cache.move_to_end(key)
+            registry.inc("session_cache_total", result="hit")
+            return entry["session"]
+    registry.inc("session_cache_total", result="miss")
+    session = _load_session_from_disk(context, session_id, username)
     if session is None:
-        return
-    session["messages"].append({"role": role, "content": content})
-    if role == "user" and len(session["messages"]) == 1:
-        session["title"] = content[:50]  # First user message becomes title
-    session["updated_at"] = datetime.utcnow().isoformat()
-    _save_session(context, username, session)
+        _cache_drop(key)
+        return None
+    _cache_put(key, session, stamp)
+    return session
+
+@timed("session.save_message")
+def save_message(context, session_id, role, content, username):
+    """Appends one message to the session log; cost does not grow with history length."""
+    global _session_cache_bytes
+    with _write_lock:
+        header_path = _header_path(context, username, session_id)
+        if not os.path.exists(header_path):
+            return
+        session = _read_header(header_path)
+        # Sessions from the old single-file format are migrated before the first append
+        if "messages" in session:
+            load_session(context, session_id, username)
+            session = _read_header(header_path)
+        key = (username, context, session_id)
+        stamp_before = _file_stamp(context, username, session_id)
+        timestamp = datetime.utcnow().isoformat()
+        record = json.dumps({"role": role, "content": content}, ensure_ascii=False)
+        with open(_log_path(context, username, session_id), "ab+") as f:
+            # Start on a fresh line if an earlier append was torn by a crash
+            if f.tell() and (f.seek(-1, os.SEEK_END), f.read(1))[1] != b"\n":
+                f.write(b"\n")
+            f.write(record.encode("utf-8") + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        message_count = session.get("message_count", 0) + 1
+        session["message_count"] = message_count
+        if role == "user" and message_count == 1:
+            session["title"] = content[:50]  # First user message becomes title
+        session["updated_at"] = timestamp
+        _save_session(context, username, session)
+
+        # Extend a still-valid cached copy in place instead of re-reading the log
+        with _session_cache_lock:
+            entry = _session_cache.get(key)
+            if entry is not None and entry["stamp"] == stamp_before:
+                cached = entry["session"]
+                cached.update(session)
+                cached["messages"].append({"role": role, "content": content})
+                entry["stamp"] = _file_stamp(context, username, session_id)
+                entry["size"] += _message_size(cached["messages"][-1])
+                _session_cache_bytes += _message_size(cached["messages"][-1])
+            else:
+                _cache_drop(key)
+
+def save_session_summary(context, session_id, username, summary, summarized_count):
+    """
+    Stores the rolling conversation summary in the session header.
+
+    Args:
+        summary (str): Summary of the first summarized_count messages.
+        summarized_count (int): Number of leading messages the summary covers.
+    """
+    with _write_lock:
+        header_path = _header_path(context, username, session_id)
+        if not os.path.exists(header_path):
+            return
+        key = (username, context, session_id)
+        stamp_before = _file_stamp(context, username, session_id)
+        session = _read_header(header_path)
+        session["summary"] = {"summary": summary, "summarized_count": summarized_count}
+        _save_session(context, username, session)
+
+        with _session_cache_lock:
+            entry = _session_cache.get(key)
+            if entry is not None and entry["stamp"] == stamp_before:
+                entry["session"]["summary"] = session["summary"]
+                entry["stamp"] = _file_stamp(context, username, session_id)
+            else:
+                _cache_drop(key)
+
+def set_session_dataset(context, session_id, username, dataset):
+    """
+    Attaches an uploaded table to the session header so it is reloaded with
+    the session.
+
+    Args:
+        dataset (dict): {"file_hash", "filename"} as recorded by data_loader.
+    """
+    with _write_lock:
+        header_path = _header_path(context, username, session_id)
+        if not os.path.exists(header_path):
+            return
+        key = (username, context, session_id)
+        stamp_before = _file_stamp(context, username, session_id)
+        session = _read_header(header_path)
+        if session.get("dataset") == dataset:
+            return
+        session["dataset"] = dataset
+        _save_session(context, username, session)
+
+        with _session_cache_lock:
+            entry = _session_cache.get(key)
+            if entry is not None and entry["stamp"] == stamp_before:
+                entry["session"]["dataset"] = dataset
+                entry["stamp"] = _file_stamp(context, username, session_id)
+            else:
+                _cache_drop(key)
+
+def compact_session(context, session_id, username, session=None):
+    """
+    Rewrites a session as a clean header plus log: migrates messages still
+    stored in an old-format header and drops torn lines left by a crash.
+    Both files are replaced atomically.
+    """
+    with _write_lock:
+        if session is None:
+            session = load_session(context, session_id, username)
+            if session is None:
+                return
+        messages = session["messages"]
+        log_path = _log_path(context, username, session_id)
+        tmp_path = log_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for message in messages:
+                f.write(json.dumps({"role": message["role"], "content": message["content"]}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, log_path)
+        header = {key: value for key, value in session.items() if key != "messages"}
+        header["message_count"] = len(messages)
+        _save_session(context, username, header)
 
 def _save_session(context, username, session_data):
-    session_path = os.path.join(_get_context_dir(username, context), f"{session_data['session_id']}.json")
-    with open(session_path, "w") as f:
+    session_path = _header_path(context, username, session_data["session_id"])
+    tmp_path = session_path + ".tmp"
+    with open(tmp_path, "w") as f:
         json.dump(session_data, f, indent=2)
+    os.replace(tmp_path, session_path)
+    _catalog_upsert(context, username, session_data)
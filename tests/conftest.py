@@ -0,0 +1,18 @@
+import os
+import sys
+import pytest
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def session_dir(tmp_path, monkeypatch):
+    """Points the session store (and the Parquet copies inside it) at a temporary directory."""
+    from collections import OrderedDict
+    import session_manager
+
+    monkeypatch.setattr(session_manager, "BASE_DIR", str(tmp_path / "chat_sessions"))
+    monkeypatch.setattr(session_manager, "_session_cache", OrderedDict())
+    monkeypatch.setattr(session_manager, "_session_cache_bytes", 0)
+    monkeypatch.setattr(session_manager, "_catalogs", {})
+    return tmp_path / "chat_sessions"
@@ -0,0 +1,53 @@
+import asyncio
+import context_builder
+from context_builder import build_history_context, SUMMARIZE_BATCH
+from session_manager import create_new_session, load_session
+
+def _message(role, turn):
+    # About 100 tokens each with the speaker prefix
+    return {"role": role, "content": f"{role} turn {turn} " + "x" * 380}
+
+def test_folds_only_full_batches_and_keeps_the_budgeted_window(session_dir):
+    session_id = create_new_session("chatbot", "alice")
+    folded = []
+
+    async def summarize(summary, messages, username):
+        folded.append(len(messages))
+        return f"summary of {sum(folded)} messages"
+
+    history = []
+    windows = []
+    for turn in range(40):
+        question = f"question {turn}"
+        text = asyncio.run(build_history_context(history + [{"role": "user", "content": question}], question,
+                                                 "chatbot", session_id, "alice", budget=600, summarize_fn=summarize))
+        windows.append(text.count("User: ") + text.count("Assistant: "))
+        history += [_message("user", turn), _message("assistant", turn)]
+
+    assert folded and all(count >= SUMMARIZE_BATCH for count in folded)
+    assert len(folded) <= 80 // SUMMARIZE_BATCH
+    # The budget fits five ~100-token messages next to the short summary
+    assert min(windows[3:]) >= 5
+    state = load_session("chatbot", session_id, "alice")["summary"]
+    assert state["summarized_count"] == sum(folded)
+
+def test_overflow_below_a_batch_is_left_out_without_summarizing(session_dir):
+    session_id = create_new_session("chatbot", "alice")
+    calls = []
+
+    async def summarize(summary, messages, username):
+        calls.append(messages)
+        return "summary"
+
+    history = [_message("user" if i % 2 == 0 else "assistant", i // 2) for i in range(8)]
+    text = asyncio.run(build_history_context(history, None, "chatbot", session_id, "alice",
+                                             budget=600, summarize_fn=summarize))
+    assert calls == []
+    assert "Summary" not in text
+    assert text.count("turn") == 5
+    assert context_builder.estimate_tokens(text) <= 600 + 10
+
+def test_without_a_session_overflow_is_dropped():
+    history = [_message("user", i) for i in range(20)]
+    text = asyncio.run(build_history_context(history, budget=250))
+    assert text.count("turn") == 2
@@ -0,0 +1,160 @@
+import gzip
+from functools import partial
+import pytest
+import requests
+import crawler
+import document_registry
+import lexical_index
+from http_client import HttpResponse
+from lexical_index import BM25Index
+
+class FakeWeb:
+    """fetch_fn serving a dict of url -> (status, content type, body)."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.fetched = []
+
+    def __call__(self, url):
+        self.fetched.append(url)
+        status, content_type, body = self.pages.get(url, (404, "text/plain", b"not found"))
+        response = HttpResponse(url, status, {"Content-Type": content_type}, body)
+        if status >= 400:
+            error_response = requests.Response()
+            error_response.status_code = status
+            raise requests.exceptions.HTTPError(f"{status} for {url}", response=error_response)
+        return response
+
+def _html(text):
+    return (200, "text/html; charset=utf-8",
+            f"<html><head><title>T</title></head><body><main><p>{text}</p></main></body></html>".encode())
+
+def _sitemap(urls, index=False):
+    tag, item = ("sitemapindex", "sitemap") if index else ("urlset", "url")
+    locs = "".join(f"<{item}><loc>{url}</loc></{item}>" for url in urls)
+    return f'<?xml version="1.0"?><{tag} xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{locs}</{tag}>'.encode()
+
+def test_only_xml_paths_are_sitemaps():
+    assert crawler.is_sitemap_url("https://a.test/sitemap.xml")
+    assert crawler.is_sitemap_url("https://a.test/maps/pages.xml.gz")
+    assert not crawler.is_sitemap_url("https://a.test/blog/how-to-build-a-sitemap")
+
+def test_sitemap_index_children_and_gzip_are_followed_through_the_limiter():
+    web = FakeWeb({
+        "https://a.test/sitemap.xml": (200, "application/xml", _sitemap(["https://a.test/nested"], index=True)),
+        "https://a.test/nested": (200, "application/gzip", gzip.compress(_sitemap(["https://a.test/p1"]))),
+    })
+    waits = []
+
+    class RecordingLimiter(crawler.RateLimiter):
+        def wait(self, host):
+            waits.append(host)
+            super().wait(host)
+
+    urls = crawler.discover_urls(["https://a.test/sitemap.xml", "https://a.test/blog/sitemap-guide"],
+                                 fetch_fn=web, limiter=RecordingLimiter(0, host_delay=0))
+    assert urls == ["https://a.test/blog/sitemap-guide", "https://a.test/p1"]
+    assert waits == ["a.test", "a.test"]
+
+def test_rate_limiter_spaces_starts_per_host():
+    limiter = crawler.RateLimiter(0, host_delay=10)
+    limiter.reserve("a.test", now=100.0)
+    assert limiter.start_at("a.test") == 110.0
+    assert limiter.start_at("b.test") <= 100.0
+
+@pytest.mark.parametrize("status, allowed", [(401, False), (403, False), (404, True)])
+def test_robots_auth_errors_disallow_the_host(status, allowed):
+    web = FakeWeb({"https://a.test/robots.txt": (status, "text/plain", b""), "https://a.test/p": _html("hello")})
+    results = list(crawler.crawl_pages(["https://a.test/p"], pages_per_sec=0, host_delay=0, fetch_fn=web))
+    assert (results[0]["error"] is None) == allowed
+    if not allowed:
+        assert results[0]["error"] == "Disallowed by robots.txt"
+        assert "https://a.test/p" not in web.fetched
+
+def test_bm25_remove_documents_updates_postings():
+    index = BM25Index()
+    index.add(["old:1", "new:1"], ["alpha beta", "alpha gamma"], [{"doc_id": "old"}, {"doc_id": "new"}])
+    assert index.remove_documents(["old"]) == 1
+    assert len(index) == 1
+    assert "beta" not in index.postings
+    assert [chunk_id for chunk_id, _ in index.search("alpha")] == ["new:1"]
+
+@pytest.fixture
+def registry_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(document_registry, "REGISTRY_PATH", str(tmp_path / "document_registry.json"))
+    monkeypatch.setattr(lexical_index, "LEXICAL_INDEX_DIR", str(tmp_path / "lexical"))
+    monkeypatch.setattr(lexical_index, "_indexes", {})
+
+def test_new_page_version_replaces_the_old_one_in_the_session(registry_path):
+    url = "https://a.test/p"
+    document_registry.register_document("c", "v1", url, 3)
+    assert document_registry.replace_page_version("c", "s1", url, "v1") == []
+    document_registry.register_document("c", "v2", url, 3)
+    assert document_registry.replace_page_version("c", "s1", url, "v2") == ["v1"]
+    assert document_registry.session_documents("c", "s1") == ["v2"]
+    assert not document_registry.is_document_indexed("c", "v1")
+
+def test_old_page_version_still_used_by_another_session_is_kept(registry_path):
+    url = "https://a.test/p"
+    document_registry.replace_page_version("c", "s1", url, "v1")
+    document_registry.replace_page_version("c", "s2", url, "v1")
+    assert document_registry.replace_page_version("c", "s1", url, "v2") == []
+    assert document_registry.session_documents("c", "s2") == ["v1"]
+    # Once the last session moves on, the old version is released
+    assert document_registry.replace_page_version("c", "s2", url, "v2") == ["v1"]
+
+class FakeCollection:
+    def __init__(self):
+        self.rows = {}
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        for chunk_id, text, metadata in zip(ids, documents, metadatas):
+            self.rows[chunk_id] = (text, metadata)
+
+    def delete(self, where):
+        doc_ids = set(where["doc_id"]["$in"])
+        self.rows = {key: row for key, row in self.rows.items() if row[1]["doc_id"] not in doc_ids}
+
+    def count(self):
+        return len(self.rows)
+
+class FakeVectorStore:
+    def __init__(self):
+        self._collection = FakeCollection()
+
+    def get(self, ids=None, include=None):
+        return {"ids": [chunk_id for chunk_id in ids if chunk_id in self._collection.rows]}
+
+class ParagraphSplitter:
+    def split_text(self, text):
+        return [part for part in text.split("\n") if part.strip()]
+
+def test_recrawl_of_a_changed_page_drops_the_stale_version(registry_path, monkeypatch):
+    pytest.importorskip("langchain_core")
+    import vector_store_api
+    from fakes import FakeEmbeddings
+
+    web = FakeWeb({"https://a.test/p": _html("version one"), "https://a.test/q": _html("unchanged page")})
+    store = FakeVectorStore()
+    monkeypatch.setattr(vector_store_api, "_open_collection", lambda name: store)
+    monkeypatch.setattr(vector_store_api, "_text_splitter", ParagraphSplitter)
+    monkeypatch.setattr(vector_store_api, "get_cached_embeddings", lambda: FakeEmbeddings(dim=8))
+    monkeypatch.setattr(vector_store_api, "discover_urls", partial(crawler.discover_urls, fetch_fn=web))
+    monkeypatch.setattr(vector_store_api, "crawl_pages", partial(crawler.crawl_pages, fetch_fn=web, respect_robots=False))
+    monkeypatch.setattr(vector_store_api, "RateLimiter", lambda pages_per_sec: crawler.RateLimiter(0, host_delay=0))
+
+    targets = ["https://a.test/p", "https://a.test/q"]
+    assert vector_store_api.crawl_to_chroma(targets, "alice", "s1", pages_per_sec=0).startswith("Site successfully")
+    collection = document_registry.collection_name_for("alice")
+    first_docs = set(document_registry.session_documents(collection, "s1"))
+
+    web.pages["https://a.test/p"] = _html("version two")
+    message = vector_store_api.crawl_to_chroma(targets, "alice", "s1", pages_per_sec=0)
+    assert "1 outdated page versions removed" in message
+
+    docs = set(document_registry.session_documents(collection, "s1"))
+    assert len(docs) == 2 and len(docs - first_docs) == 1
+    texts = [text for text, _ in store._collection.rows.values()]
+    assert "version one" not in texts and "version two" in texts
+    bm25 = lexical_index.get_lexical_index(collection)
+    assert {doc["metadata"]["doc_id"] for doc in bm25.docs.values()} == docs
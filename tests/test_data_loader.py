@@ -0,0 +1,38 @@
+import pandas as pd
+import data_loader
+
+def _csv(rows, header="id,group"):
+    return (header + "\n" + "\n".join(rows) + "\n").encode()
+
+def test_chunks_with_numeric_then_text_ids_load_and_persist(session_dir):
+    data = _csv([f"{i},{i % 3}" for i in range(20)] + [f"A{i},{i % 3}" for i in range(20, 25)])
+    df = data_loader.read_table(data, "orders.csv", chunk_rows=10)
+    assert df["id"].tolist() == [str(i) for i in range(20)] + [f"A{i}" for i in range(20, 25)]
+    assert str(df["group"].dtype) == "uint8"
+
+    data_loader._frames.clear()
+    loaded, info = data_loader.load_table(data, "orders.csv", "alice")
+    assert info["rows"] == 25
+    # The Parquet copy was written and reads back the same values
+    data_loader._frames.clear()
+    reloaded, _ = data_loader._load_persisted(info["file_hash"], "alice")
+    assert reloaded["id"].astype(str).tolist() == loaded["id"].astype(str).tolist()
+
+def test_mixed_values_within_one_chunk_become_text():
+    frame = pd.DataFrame({"code": pd.Series([1, "B2", 3.5, None], dtype=object)})
+    optimized = data_loader.optimize_frame(frame)
+    assert optimized["code"].tolist()[:3] == ["1", "B2", "3.5"]
+    assert pd.isna(optimized["code"].iloc[3])
+
+def test_categories_merge_across_chunks_and_integers_widen():
+    rows = [f"{i},{'north' if i % 2 else 'south'}" for i in range(30)] + ["70000,east"]
+    df = data_loader.read_table(_csv(rows, "qty,region"), "sales.csv", chunk_rows=10, category_max_ratio=0.5)
+    assert isinstance(df["region"].dtype, pd.CategoricalDtype)
+    assert set(df["region"].cat.categories) == {"north", "south", "east"}
+    assert df["qty"].iloc[-1] == 70000
+    assert str(df["qty"].dtype) == "uint32"
+
+def test_floats_keep_full_precision():
+    df = data_loader.read_table(_csv(["1,19.99", "2,0.1"], "id,price"), "prices.csv", chunk_rows=1)
+    assert df["price"].dtype == "float64"
+    assert df["price"].iloc[0] == 19.99
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import data_profile
+from document_registry import file_hash
+
+def _profile(*chunks):
+    return data_profile.profile_chunks([pd.DataFrame({"code": chunk}) for chunk in chunks])["columns"]["code"]
+
+def test_text_chunk_then_numeric_chunk_is_profiled_as_text():
+    column = _profile(["b", "c", "b"], [3, 1, 3])
+    assert column["dtype"] == "object"
+    assert column["count"] == 6
+    assert (column["min"], column["max"]) == ("1", "c")
+    assert "mean" not in column and "quantiles" not in column
+    assert dict(column["top"]) == {"b": 2, "3": 2, "c": 1, "1": 1}
+
+def test_numeric_chunk_then_text_chunk_drops_numeric_statistics():
+    column = _profile([1, 2, 200000], ["A200001", "A200002"])
+    assert column["dtype"] == "object"
+    assert (column["min"], column["max"]) == ("1", "A200002")
+    assert "mean" not in column and "histogram" not in column
+    assert dict(column["top"])["200000"] == 1
+
+def test_numeric_chunks_widen_the_dtype():
+    column = _profile(np.array([1, 2], dtype=np.int64), [2.5, np.nan])
+    assert column["dtype"] == "float64"
+    assert column["nulls"] == 1
+    assert column["mean"] == np.mean([1, 2, 2.5])
+    assert (column["min"], column["max"]) == (1.0, 2.5)
+
+def test_empty_chunk_does_not_change_the_kind():
+    column = _profile(["x", "y"], [np.nan, np.nan], ["x"])
+    assert column["dtype"] in ("str", "object")
+    assert (column["min"], column["max"]) == ("x", "y")
+
+def test_path_source_is_hashed_like_bytes(session_dir, tmp_path, monkeypatch):
+    data = b"id,amount\n" + b"".join(b"%d,%d.5\n" % (i, i) for i in range(1000))
+    path = tmp_path / "sales.csv"
+    path.write_bytes(data)
+    monkeypatch.setattr(data_profile, "HASH_BLOCK_BYTES", 64)
+    profile = data_profile.get_profile(str(path), "sales.csv", "alice")
+    assert profile["file_hash"] == file_hash(data)
+    assert profile["columns"]["amount"]["count"] == 1000
@@ -0,0 +1,46 @@
+import asyncio
+import pandas as pd
+import pytest
+import data_query
+import llm_accounting
+from data_query import PlanError, validate_plan
+from fakes import FakeResponse
+
+FRAME = pd.DataFrame({"region": ["north", "south", "north"], "amount": [10.0, 20.0, 30.0]})
+
+@pytest.mark.parametrize("plan", [
+    {"filters": ["amount > 3"]},
+    {"aggregations": [["sum", "amount"]]},
+    {"sort": "amount"},
+    {"group_by": [{"column": "region"}]},
+    {"columns": [["region"]]},
+])
+def test_malformed_plan_entries_raise_plan_error(plan):
+    with pytest.raises(PlanError):
+        validate_plan(plan, FRAME)
+
+def test_sort_on_a_column_missing_from_the_result_is_rejected():
+    with pytest.raises(PlanError):
+        validate_plan({"columns": ["region"], "sort": [{"column": "amount"}]}, FRAME)
+
+class ScriptedModel:
+    """Replies with the given texts in turn and records the prompts."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.prompts = []
+
+    async def generate_content_async(self, prompt, stream=False):
+        self.prompts.append(prompt)
+        return FakeResponse(self.replies.pop(0))
+
+def test_plan_query_retries_after_a_malformed_plan(monkeypatch):
+    monkeypatch.setattr(llm_accounting, "accountant", llm_accounting.UsageAccountant(":memory:"))
+    model = ScriptedModel([
+        '{"filters": ["amount > 15"]}',
+        '{"filters": [{"column": "amount", "op": ">", "value": 15}]}',
+    ])
+    plan = asyncio.run(data_query.plan_query("Which rows are above 15?", FRAME, model=model))
+    assert plan["filters"] == [{"column": "amount", "op": ">", "value": 15}]
+    assert len(model.prompts) == 2
+    assert "must be a JSON object" in model.prompts[1]
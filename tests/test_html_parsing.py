@@ -0,0 +1,25 @@
+import pytest
+import html_parsing
+
+BACKENDS = html_parsing.available_backends()
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("head, codec", [
+    ("<meta charset='windows-1251'>", "cp1251"),
+    ('<meta http-equiv="Content-Type" content="text/html; charset=koi8-r">', "koi8_r"),
+])
+def test_meta_charset_is_honoured_without_a_declared_encoding(backend, head, codec):
+    content = f"<html><head>{head}<title>t</title></head><body><p>Привет мир</p></body></html>".encode(codec)
+    assert html_parsing.parse_html(content, backend=backend)["text_content"] == "Привет мир"
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_undeclared_utf8_and_cp1252_are_decoded(backend):
+    for codec in ("utf-8", "cp1252"):
+        content = "<html><body><p>café</p></body></html>".encode(codec)
+        assert html_parsing.parse_html(content, backend=backend)["text_content"] == "café"
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_truncation_and_unknown_charsets_do_not_garble_text(backend):
+    content = ("<html><body><p>" + "é" * 100 + "</p></body></html>").encode("utf-8")
+    page = html_parsing.parse_html(content, encoding="x-unknown", backend=backend, max_bytes=16 + 51)
+    assert set(page["text_content"]) == {"é"}
@@ -0,0 +1,49 @@
+import threading
+import session_manager
+from session_manager import create_new_session, load_session, save_message
+
+def test_write_during_a_load_is_not_hidden_by_the_cache(session_dir, monkeypatch):
+    session_id = create_new_session("chatbot", "alice")
+    save_message("chatbot", session_id, "user", "first", "alice")
+    read_from_disk = session_manager._load_session_from_disk
+
+    def read_then_concurrent_write(context, session_id, username):
+        session = read_from_disk(context, session_id, username)
+        # Another writer appends after the files were read but before the load returns
+        monkeypatch.setattr(session_manager, "_load_session_from_disk", read_from_disk)
+        save_message(context, session_id, "assistant", "second", username)
+        return session
+
+    session_manager._cache_drop(("alice", "chatbot", session_id))
+    monkeypatch.setattr(session_manager, "_load_session_from_disk", read_then_concurrent_write)
+    stale = load_session("chatbot", session_id, "alice")
+    assert [m["content"] for m in stale["messages"]] == ["first"]
+
+    fresh = load_session("chatbot", session_id, "alice")
+    assert [m["content"] for m in fresh["messages"]] == ["first", "second"]
+
+def test_cached_session_is_extended_by_appends(session_dir):
+    session_id = create_new_session("chatbot", "alice")
+    save_message("chatbot", session_id, "user", "hello", "alice")
+    assert len(load_session("chatbot", session_id, "alice")["messages"]) == 1
+    save_message("chatbot", session_id, "assistant", "hi", "alice")
+    session = load_session("chatbot", session_id, "alice")
+    assert [m["content"] for m in session["messages"]] == ["hello", "hi"]
+    assert session["title"] == "hello"
+
+def test_concurrent_appends_keep_the_header_count(session_dir):
+    session_id = create_new_session("chatbot", "alice")
+
+    def writer(name):
+        for i in range(25):
+            save_message("chatbot", session_id, "user", f"{name} {i}", "alice")
+
+    threads = [threading.Thread(target=writer, args=(f"w{n}",)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    session_manager._cache_drop(("alice", "chatbot", session_id))
+    session = load_session("chatbot", session_id, "alice")
+    assert len(session["messages"]) == 100
+    assert session["message_count"] == 100
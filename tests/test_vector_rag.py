@@ -0,0 +1,69 @@
+import asyncio
+import pytest
+
+pytest.importorskip("langchain_core")
+
+import document_registry
+import vector_rag
+
+@pytest.fixture
+def registry_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(document_registry, "REGISTRY_PATH", str(tmp_path / "document_registry.json"))
+
+def test_session_without_documents_skips_retrieval(registry_path, monkeypatch):
+    def no_search(*args, **kwargs):
+        raise AssertionError("retrieval must not run")
+
+    monkeypatch.setattr(vector_rag, "get_hybrid_retriever", no_search)
+    answer = asyncio.run(vector_rag.async_query_rag("what is clause 4?", username="ann", session_id="s1"))
+    assert answer == vector_rag.NO_DOCUMENTS_MESSAGE
+
+    async def collect():
+        return [part async for part in vector_rag.async_stream_rag("what is clause 4?", username="ann", session_id="s1")]
+
+    assert asyncio.run(collect()) == [vector_rag.NO_DOCUMENTS_MESSAGE]
+
+def test_cache_scope_is_per_feature_context(registry_path, monkeypatch):
+    collection = document_registry.collection_name_for("ann")
+    document_registry.register_document(collection, "d1", "a.pdf", 3)
+    document_registry.link_session(collection, "s1", "d1")
+    monkeypatch.setattr(vector_rag, "get_hybrid_retriever", lambda *args, **kwargs: None)
+    monkeypatch.setattr(vector_rag, "build_rag_chain", lambda retriever: None)
+
+    async def no_history(*args, **kwargs):
+        return ""
+
+    monkeypatch.setattr(vector_rag, "build_history_context", no_history)
+
+    async def scope(context):
+        cache_scope, _, _, _ = await vector_rag._prepare_rag("q", None, "ann", "s1", context)
+        return cache_scope
+
+    doc_scope, url_scope = asyncio.run(scope("doc")), asyncio.run(scope("url"))
+    assert doc_scope[2] == url_scope[2] == ("d1",)
+    assert doc_scope != url_scope
+
+def test_lexical_index_recounts_only_when_version_changes(monkeypatch):
+    from lexical_index import BM25Index
+
+    class FakeCollection:
+        counts = 0
+
+        def count(self):
+            FakeCollection.counts += 1
+            return 0
+
+    class FakeStore:
+        _collection = FakeCollection()
+
+    index = BM25Index()
+    monkeypatch.setattr(vector_rag, "_reconciled_versions", {})
+    monkeypatch.setattr(vector_rag, "get_lexical_index", lambda name: index)
+    monkeypatch.setattr(vector_rag, "get_vector_store", lambda username: FakeStore())
+
+    for _ in range(3):
+        assert vector_rag._ensure_lexical_index("ann", version=1) is index
+    assert FakeCollection.counts == 1
+    vector_rag._ensure_lexical_index("ann", version=2)
+    vector_rag._ensure_lexical_index("ann")
+    assert FakeCollection.counts == 3
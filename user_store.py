@@ -0,0 +1,248 @@
+# user_store.py
+import os
+import time
+import sqlite3
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Backend for user accounts: "mysql" (pooled) or "sqlite" (local stand-in for development and load tests)
+USER_STORE = os.getenv("USER_STORE", "mysql")
+MYSQL_CONFIG = {
+    "host": os.getenv("MYSQL_HOST", "localhost"),
+    "port": int(os.getenv("MYSQL_PORT", "3306")),
+    "user": os.getenv("MYSQL_USER", "root"),
+    "password": os.getenv("MYSQL_PASSWORD", "root"),
+    "database": os.getenv("MYSQL_DATABASE", "smartlexicon")
+}
+MYSQL_POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", "5"))
+# Seconds a caller waits for a free pooled connection before giving up
+POOL_WAIT_TIMEOUT = 5.0
+USER_DB_PATH = os.getenv("USER_DB_PATH", "users.sqlite3")
+# Lifetime of a login token, extended on every use
+AUTH_TOKEN_TTL = float(os.getenv("AUTH_TOKEN_TTL", "1800"))
+MAX_AUTH_TOKENS = 10_000
+
+class UserStoreError(Exception):
+    """Raised when the user database cannot be reached or queried."""
+
+def hash_password(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+class SQLiteUserStore:
+    """
+    User accounts in a local SQLite file, behind a single shared connection.
+
+    Args:
+        path (str): Database file; ":memory:" for a throwaway store.
+    """
+
+    def __init__(self, path=USER_DB_PATH):
+        self._lock = threading.Lock()
+        try:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT NOT NULL)"
+            )
+            self._conn.commit()
+        except sqlite3.Error as e:
+            raise UserStoreError(str(e))
+
+    def authenticate(self, username, password):
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT 1 FROM users WHERE username = ? AND password = ?", (username, hash_password(password))
+                ).fetchone()
+            return row is not None
+        except sqlite3.Error as e:
+            raise UserStoreError(str(e))
+
+    def create_user(self, username, password):
+        """Returns False when the username is already taken."""
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO users (username, password) VALUES (?, ?)", (username, hash_password(password))
+                )
+                self._conn.commit()
+            return True
+        except sqlite3.IntegrityError:
+            return False
+        except sqlite3.Error as e:
+            raise UserStoreError(str(e))
+
+class MySQLUserStore:
+    """
+    User accounts in MySQL, served from a connection pool so logins reuse
+    open connections instead of paying a handshake each time. The pool is
+    created on first use.
+
+    Args:
+        config (dict): mysql.connector connection arguments.
+        pool_size (int): Connections kept open.
+    """
+
+    def __init__(self, config=None, pool_size=MYSQL_POOL_SIZE):
+        self.config = dict(config or MYSQL_CONFIG)
+        self.pool_size = pool_size
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                from mysql.connector import pooling
+
+                self._pool = pooling.MySQLConnectionPool(
+                    pool_name="smartlexicon_users", pool_size=self.pool_size, pool_reset_session=True, **self.config
+                )
+            return self._pool
+
+    @contextmanager
+    def _connection(self):
+        from mysql.connector import Error, PoolError
+
+        deadline = time.monotonic() + POOL_WAIT_TIMEOUT
+        try:
+            while True:
+                try:
+                    connection = self._get_pool().get_connection()
+                    break
+                except PoolError:
+                    # Every pooled connection is busy; wait for one to be returned
+                    if time.monotonic() >= deadline:
+                        raise
+                    time.sleep(0.01)
+        except Error as e:
+            raise UserStoreError(str(e))
+        try:
+            yield connection
+        except Error as e:
+            raise UserStoreError(str(e))
+        finally:
+            # Returns the connection to the pool
+            connection.close()
+
+    def authenticate(self, username, password):
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT 1 FROM users WHERE username = %s AND password = %s",
+                               (username, hash_password(password)))
+                return cursor.fetchone() is not None
+            finally:
+                cursor.close()
+
+    def create_user(self, username, password):
+        """Returns False when the username is already taken."""
+        from mysql.connector import IntegrityError
+
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("INSERT INTO users (username, password) VALUES (%s, %s)",
+                               (username, hash_password(password)))
+                connection.commit()
+                return True
+            except IntegrityError:
+                return False
+            finally:
+                cursor.close()
+
+@lru_cache(maxsize=None)
+def get_user_store(backend=USER_STORE):
+    """Returns the process-wide user store selected by USER_STORE."""
+    if backend == "sqlite":
+        return SQLiteUserStore()
+    if backend == "mysql":
+        return MySQLUserStore()
+    raise UserStoreError(f"Unknown USER_STORE backend {backend!r}")
+
+class TokenCache:
+    """
+    In-memory login tokens with a sliding TTL, so reruns of a logged-in
+    session are validated without touching the database.
+
+    Args:
+        ttl (float): Seconds a token stays valid after its last use.
+        max_tokens (int): Oldest tokens are dropped beyond this many.
+    """
+
+    def __init__(self, ttl=AUTH_TOKEN_TTL, max_tokens=MAX_AUTH_TOKENS):
+        self.ttl = ttl
+        self.max_tokens = max_tokens
+        self._tokens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def issue(self, username):
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._tokens[token] = (username, time.monotonic() + self.ttl)
+            while len(self._tokens) > self.max_tokens:
+                self._tokens.popitem(last=False)
+        return token
+
+    def validate(self, token):
+        """Returns the token's username and extends its lifetime, or None if it is unknown or expired."""
+        if not token:
+            return None
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is None:
+                return None
+            username, expires_at = entry
+            now = time.monotonic()
+            if expires_at < now:
+                del self._tokens[token]
+                return None
+            self._tokens[token] = (username, now + self.ttl)
+            self._tokens.move_to_end(token)
+            return username
+
+    def revoke(self, token):
+        with self._lock:
+            self._tokens.pop(token, None)
+
+# Process-wide token cache used by the app
+auth_tokens = TokenCache()
+
+def login(username, password, store=None):
+    """Checks the credentials and returns a new session token, or None when they are wrong."""
+    store = store or get_user_store()
+    if store.authenticate(username, password):
+        return auth_tokens.issue(username)
+    return None
+
+
+# Offline load test: concurrent logins and token validations against a throwaway SQLite store
+if __name__ == "__main__":
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+
+    num_logins = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    store = SQLiteUserStore(":memory:")
+    for i in range(100):
+        store.create_user(f"user{i}", f"password{i}")
+
+    def attempt(i):
+        token = login(f"user{i % 100}", f"password{i % 100}" if i % 10 else "wrong", store)
+        # Every rerun of a logged-in page only validates the token
+        for _ in range(10):
+            auth_tokens.validate(token)
+        return token is not None
+
+    for workers in (1, 8, 32):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            succeeded = sum(executor.map(attempt, range(num_logins)))
+        elapsed = time.perf_counter() - started
+        print(f"workers={workers:>2}: {num_logins / elapsed:8.0f} logins/s ({succeeded} ok, "
+              f"{num_logins - succeeded} rejected, 10 token checks each)")
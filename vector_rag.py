@@ -1,37 +1,180 @@
 import os
-from langchain_chroma import Chroma  # Updated import
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema.runnable import RunnablePassthrough
-from langchain.schema.output_parser import StrOutputParser
+import time
+import asyncio
+from functools import lru_cache
+from operator import itemgetter
 from dotenv import load_dotenv
+from embedding_cache import get_cached_embeddings
+from response_cache import response_cache
+from model_client import model_client
+from context_builder import build_history_context, history_fingerprint
+from document_registry import collection_version, collection_name_for, session_documents, chunk_hash
+from lexical_index import get_lexical_index, reciprocal_rank_fusion, tokenize
+from metrics import span, record, registry, timed
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Google Gemini Embeddings
-gemini_embeddings = GoogleGenerativeAIEmbeddings( 
-    model="models/embedding-001",
-    google_api_key=os.getenv("GEMINI_API_KEY")
-)
-
-# Initialize ChromaDB vector store
+# ChromaDB location; each user has their own collection inside it
 chroma_db_path = "chroma_db"
-vector_store = Chroma(
-    persist_directory=chroma_db_path,
-    embedding_function=gemini_embeddings
-)
-
-# Initialize Google Gemini Chat Model
-gemini_chat = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash",
-    google_api_key=os.getenv("GEMINI_API_KEY"),
-    temperature=0.7
-)
-
-# Define the RAG prompt template
-rag_prompt = ChatPromptTemplate.from_template(
-    """You are a helpful assistant. Use the following context to answer the user's question.
+# Chunks retrieved per question
+RETRIEVAL_K = 4
+# Candidates taken from each retriever before fusion
+FUSION_CANDIDATES = 10
+# The lexical index answers alone when its top hit beats the runner-up by this factor
+LEXICAL_CONFIDENCE_RATIO = 1.5
+# Answer for a session that has no documents to search yet
+NO_DOCUMENTS_MESSAGE = "No documents are attached to this chat yet. Upload a PDF or crawl a site first."
+
+def get_vector_store(username=None):
+    """Returns the (process-wide, reused) vector store over one user's collection."""
+    return _open_vector_store(collection_name_for(username))
+
+@lru_cache(maxsize=None)
+def _open_vector_store(collection_name):
+    # Chroma and the embedding model are only loaded once retrieval is first needed
+    from langchain_chroma import Chroma
+
+    return Chroma(
+        collection_name=collection_name,
+        persist_directory=chroma_db_path,
+        embedding_function=get_cached_embeddings()
+    )
+
+def _search_filter(doc_ids):
+    if not doc_ids:
+        return {}
+    return {"filter": {"doc_id": doc_ids[0]} if len(doc_ids) == 1 else {"doc_id": {"$in": list(doc_ids)}}}
+
+def get_retriever(username=None, doc_ids=None):
+    """
+    Returns a retriever over the user's collection, restricted by metadata
+    filter to the given documents when doc_ids is non-empty.
+    """
+    search_kwargs = {"k": RETRIEVAL_K}
+    search_kwargs.update(_search_filter(doc_ids))
+    return get_vector_store(username).as_retriever(search_kwargs=search_kwargs)
+
+# Collection version each BM25 index was last reconciled against, by collection name
+_reconciled_versions = {}
+
+def _ensure_lexical_index(username, version=None):
+    """
+    Backfills the BM25 index with the chunks Chroma holds but it lacks: whole
+    collections indexed before it existed, and writes that reached Chroma but
+    not the index (e.g. an ingestion interrupted before the index was saved).
+    Chroma is only recounted when the collection version differs from the
+    one last reconciled (or is not known).
+    """
+    collection_name = collection_name_for(username)
+    lexical_index = get_lexical_index(collection_name)
+    if version is not None and _reconciled_versions.get(collection_name) == version:
+        return lexical_index
+    vector_store = get_vector_store(username)
+    if len(lexical_index) < vector_store._collection.count():
+        stored_ids = vector_store.get(include=[])["ids"]
+        missing = [chunk_id for chunk_id in stored_ids if lexical_index.get(chunk_id) is None]
+        if missing:
+            stored = vector_store.get(ids=missing, include=["documents", "metadatas"])
+            lexical_index.add(stored["ids"], stored["documents"], stored["metadatas"])
+            lexical_index.save()
+    if version is not None:
+        _reconciled_versions[collection_name] = version
+    return lexical_index
+
+def _lexical_is_confident(question, hits, lexical_index):
+    """
+    The lexical ranking is trusted on its own when the question contains
+    exact identifiers (tokens with digits, such as clause numbers or part
+    IDs), the top chunk contains all of them, and it clearly outscores the
+    runner-up.
+    """
+    identifiers = {token for token in tokenize(question) if any(ch.isdigit() for ch in token)}
+    if not identifiers or not hits:
+        return False
+    top_tokens = set(tokenize(lexical_index.get(hits[0][0])["text"]))
+    if not identifiers <= top_tokens:
+        return False
+    return len(hits) == 1 or hits[0][1] >= LEXICAL_CONFIDENCE_RATIO * hits[1][1]
+
+def hybrid_search(question, username=None, doc_ids=None, k=RETRIEVAL_K, version=None):
+    """
+    Retrieves chunks by fusing BM25 and dense similarity rankings with
+    reciprocal rank fusion. When the lexical index is confident the dense
+    search (and its query embedding) is skipped entirely.
+
+    Args:
+        question (str): The user's question.
+        username (str, optional): Selects the user's collection.
+        doc_ids (list, optional): Restricts both searches to these documents.
+        k (int): Number of chunks returned.
+        version (int, optional): Current collection version; the lexical index
+            is only reconciled with Chroma when it changes.
+
+    Returns:
+        list: LangChain Documents, best first.
+    """
+    from langchain.schema import Document
+
+    lexical_index = _ensure_lexical_index(username, version)
+    with span("rag.retrieve.lexical"):
+        lexical_hits = lexical_index.search(question, k=FUSION_CANDIDATES, doc_ids=doc_ids)
+
+    docs_by_key = {}
+    lexical_ranking = []
+    for chunk_id, _ in lexical_hits:
+        entry = lexical_index.get(chunk_id)
+        key = chunk_hash(entry["text"])
+        docs_by_key[key] = Document(page_content=entry["text"], metadata=entry["metadata"])
+        lexical_ranking.append(key)
+
+    if _lexical_is_confident(question, lexical_hits, lexical_index):
+        registry.inc("retrievals_total", path="lexical")
+        return [docs_by_key[key] for key in lexical_ranking[:k]]
+
+    registry.inc("retrievals_total", path="hybrid")
+    # Includes embedding the question
+    with span("rag.retrieve.dense"):
+        dense_docs = get_vector_store(username).similarity_search(
+            question, k=FUSION_CANDIDATES, **_search_filter(doc_ids)
+        )
+    dense_ranking = []
+    for doc in dense_docs:
+        key = chunk_hash(doc.page_content)
+        docs_by_key.setdefault(key, doc)
+        dense_ranking.append(key)
+
+    fused = reciprocal_rank_fusion([lexical_ranking, dense_ranking])
+    return [docs_by_key[key] for key in fused[:k]]
+
+def get_hybrid_retriever(username=None, doc_ids=None, version=None):
+    """Runnable retriever for build_rag_chain backed by hybrid_search."""
+    from langchain.schema.runnable import RunnableLambda
+
+    return RunnableLambda(lambda question: hybrid_search(question, username, doc_ids, version=version))
+
+@timed("rag.format_context")
+def format_docs(docs):
+    return "\n\n".join(doc.page_content for doc in docs)
+
+@lru_cache(maxsize=None)
+def get_chat_model():
+    """Returns the process-wide Gemini chat model used by the RAG chain, created on first use."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
+        model="gemini-2.0-flash",
+        google_api_key=os.getenv("GEMINI_API_KEY"),
+        temperature=0.7
+    )
+
+@lru_cache(maxsize=None)
+def get_rag_prompt():
+    """Returns the RAG prompt template, built on first use."""
+    from langchain.prompts import ChatPromptTemplate
+
+    return ChatPromptTemplate.from_template(
+        """You are a helpful assistant. Use the following context to answer the user's question.
     If you don't know the answer, just say that you don't know. Be concise and accurate.
 
     Context: {context}
@@ -39,47 +182,129 @@ rag_prompt = ChatPromptTemplate.from_template(
     Question: {question}
 
     Answer:"""
-)
+    )
+
+def build_rag_chain(retriever):
+    """
+    Builds the RAG chain. It is invoked with {"query": ..., "question": ...}:
+    the bare question drives retrieval while the history-enriched prompt is
+    what the model sees.
+    """
+    from langchain.schema.output_parser import StrOutputParser
 
-# Define the RAG chain
-rag_chain = (
-    {"context": vector_store.as_retriever(), "question": RunnablePassthrough()}
-    | rag_prompt
-    | gemini_chat
-    | StrOutputParser()
-)
+    return (
+        {
+            "context": itemgetter("query") | retriever | format_docs,
+            "question": itemgetter("question")
+        }
+        | get_rag_prompt()
+        | get_chat_model()
+        | StrOutputParser()
+    )
 
-def query_rag(question, chat_history=None):
+async def _prepare_rag(question, chat_history, username, session_id, context="doc"):
+    """
+    Resolves the retrieval partition and cache scope and builds the chain
+    inputs. Returns None when the session has no documents to search.
+    """
+    collection_name = collection_name_for(username)
+    # Registry lookups read files; keep them off the shared model loop
+    doc_ids = await asyncio.to_thread(session_documents, collection_name, session_id) if session_id else []
+    if session_id and not doc_ids:
+        return None
+    cache_scope = (context, username, tuple(sorted(doc_ids)), history_fingerprint(chat_history, question))
+    version = await asyncio.to_thread(collection_version, collection_name)
+
+    # Build enriched question with the budgeted conversation history
+    enriched_prompt = ""
+
+    with span("rag.history"):
+        history_context = await build_history_context(chat_history, question, context, session_id, username)
+    if history_context:
+        enriched_prompt += f"Conversation so far for context:\n{history_context}\n"
+
+    # Add the new user question
+    enriched_prompt += f"\nUser's current question:\n{question}"
+
+    rag_chain = build_rag_chain(get_hybrid_retriever(username, doc_ids, version))
+    return cache_scope, version, rag_chain, {"query": question, "question": enriched_prompt}
+
+async def async_query_rag(question, chat_history=None, username=None, session_id=None, context="doc"):
     """
     Queries the RAG system with a user question and optional chat history for context.
 
+    Retrieval only searches the user's own collection, narrowed to the
+    documents attached to the given session; a session without documents gets
+    NO_DOCUMENTS_MESSAGE instead of an answer. Answers are cached per feature
+    context, user and document set and invalidated whenever the collection
+    changes. The chain runs under the shared model client's concurrency limits.
+
     Args:
         question (str): The user's question.
         chat_history (list, optional): Chat history to extract previous assistant responses.
+        username (str, optional): Selects the user's collection and response cache scope.
+        session_id (str, optional): Limits retrieval to the documents attached to this session;
+            without one the whole collection is searched.
+        context (str): Feature context of the session ("doc", or "url" for crawled sites).
 
     Returns:
         str: The RAG-generated response.
     """
     try:
-        # Build enriched question with chat history if available
-        enriched_prompt = ""
+        prepared = await _prepare_rag(question, chat_history, username, session_id, context)
+        if prepared is None:
+            return NO_DOCUMENTS_MESSAGE
+        cache_scope, version, rag_chain, inputs = prepared
+        cached = await response_cache.aget(question, cache_scope, version=version)
+        registry.inc("response_cache_total", feature=context, result="miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
 
-        if chat_history:
-            assistant_msgs = [
-                msg["content"] for msg in chat_history
-                if msg["role"] == "assistant"
-            ][-3:]  # Last 3 assistant replies
+        # Retrieval runs inside the chain, so this span contains the rag.retrieve.* spans
+        with span("rag.answer"):
+            response = await model_client.invoke(rag_chain, inputs, username=username, feature=f"rag_{context}")
+        answer = response.strip()
+        await response_cache.aput(question, answer, cache_scope, version=version)
+        return answer
 
-            if assistant_msgs:
-                enriched_prompt += "Previous assistant responses for context:\n"
-                for i, msg in enumerate(assistant_msgs, 1):
-                    enriched_prompt += f"{i}. {msg}\n"
+    except Exception as e:
+        return f"Error: {str(e)}"
 
-        # Add the new user question
-        enriched_prompt += f"\nUser's current question:\n{question}"
+async def async_stream_rag(question, chat_history=None, username=None, session_id=None, context="doc"):
+    """
+    Streaming variant of async_query_rag: yields text fragments as the model
+    produces them. Cached answers are yielded in one piece, and the complete
+    answer is cached once the stream finishes.
+    """
+    try:
+        prepared = await _prepare_rag(question, chat_history, username, session_id, context)
+        if prepared is None:
+            yield NO_DOCUMENTS_MESSAGE
+            return
+        cache_scope, version, rag_chain, inputs = prepared
+        cached = await response_cache.aget(question, cache_scope, version=version)
+        registry.inc("response_cache_total", feature=context, result="miss" if cached is None else "hit")
+        if cached is not None:
+            yield cached
+            return
 
-        response = rag_chain.invoke(enriched_prompt)
-        return response.strip()
+        parts = []
+        started = time.perf_counter()
+        with span("rag.answer"):
+            async for chunk in model_client.astream(rag_chain, inputs, username=username, feature=f"rag_{context}"):
+                if not parts:
+                    record("rag.first_token", time.perf_counter() - started)
+                parts.append(chunk)
+                yield chunk
+        await response_cache.aput(question, "".join(parts).strip(), cache_scope, version=version)
 
     except Exception as e:
-        return f"Error: {str(e)}"
+        yield f"Error: {str(e)}"
+
+def query_rag(question, chat_history=None, username=None, session_id=None, context="doc"):
+    """Synchronous wrapper around async_query_rag."""
+    return model_client.run_sync(async_query_rag(question, chat_history, username, session_id, context))
+
+def stream_rag(question, chat_history=None, username=None, session_id=None, context="doc"):
+    """Synchronous wrapper around async_stream_rag for the Streamlit app."""
+    return model_client.iter_sync(async_stream_rag(question, chat_history, username, session_id, context))
@@ -1,62 +1,352 @@
 import os
 import tempfile
-from PyPDF2 import PdfReader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from collections import defaultdict
+from embedding_cache import get_cached_embeddings
 from dotenv import load_dotenv
+from document_registry import (
+    file_hash, chunk_id, collection_name_for, is_document_indexed,
+    register_document, bump_collection_version, link_session, replace_page_version
+)
+from ingestion_pipeline import run_ingestion, chroma_sink, iter_batches, DEFAULT_BATCH_SIZE, DEFAULT_MAX_WORKERS
+from lexical_index import get_lexical_index
+from pdf_extraction import count_pages, iter_pdf_pages, iter_pdf_pages_parallel, iter_chunks
+from crawler import discover_urls, crawl_pages, RateLimiter, CRAWL_MAX_PAGES, CRAWL_MAX_IN_FLIGHT, CRAWL_PAGES_PER_SEC
+from metrics import span, record, registry, StageTimer
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Google Gemini Embeddings
-gemini_embeddings = GoogleGenerativeAIEmbeddings(
-    model="models/embedding-001",
-    google_api_key=os.getenv("GEMINI_API_KEY") 
-)
-
 # Initialize ChromaDB vector store
 chroma_db_path = "chroma_db"
 if not os.path.exists(chroma_db_path):
     os.makedirs(chroma_db_path)
 
-def upload_pdf_to_chroma(uploaded_file):
+# Chunk IDs looked up in Chroma per round-trip when filtering out stored chunks
+EXISTING_LOOKUP_BATCH = 256
+
+def _new_chunk_records(chunks, vector_store, metadata, counts):
+    """
+    Yields ingestion records, tagged with the document metadata, for chunks
+    that are neither repeated within the document nor already stored in the
+    collection.
+    """
+    seen_ids = set()
+    for batch in iter_batches(((chunk_id(metadata["doc_id"], chunk), chunk) for chunk in chunks), EXISTING_LOOKUP_BATCH):
+        counts["chunks"] += len(batch)
+        fresh = {}
+        for record_id, chunk in batch:
+            if record_id not in seen_ids:
+                seen_ids.add(record_id)
+                fresh[record_id] = chunk
+        if not fresh:
+            continue
+        with span("chroma.lookup"):
+            existing_ids = set(vector_store.get(ids=list(fresh), include=[])["ids"])
+        for record_id, chunk in fresh.items():
+            if record_id not in existing_ids:
+                counts["new"] += 1
+                yield {"id": record_id, "text": chunk, "metadata": metadata}
+
+def _open_collection(collection_name):
+    """Opens a user's Chroma collection for writing; LangChain and Chroma are imported on first use."""
+    from langchain_community.vectorstores import Chroma
+
+    return Chroma(
+        collection_name=collection_name,
+        persist_directory=chroma_db_path,
+        embedding_function=get_cached_embeddings()
+    )
+
+def _index_sink(vector_store, lexical_index, written_by_doc=None):
+    """Ingestion sink writing each batch to Chroma and the BM25 index, optionally counting chunks per document."""
+    write_to_chroma = chroma_sink(vector_store)
+
+    def sink(ids, texts, embeddings, metadatas):
+        with span("chroma.write"):
+            write_to_chroma(ids, texts, embeddings, metadatas)
+        with span("bm25.add"):
+            lexical_index.add(ids, texts, metadatas)
+        registry.inc("chunks_indexed_total", len(ids))
+        if written_by_doc is not None:
+            for metadata in metadatas:
+                written_by_doc[metadata["doc_id"]] += 1
+    return sink
+
+def _delete_documents(vector_store, lexical_index, doc_ids):
+    """Removes every chunk of the given documents from Chroma and the BM25 index."""
+    if not doc_ids:
+        return
+    with span("chroma.delete"):
+        vector_store._collection.delete(where={"doc_id": {"$in": list(doc_ids)}})
+    with span("bm25.remove"):
+        lexical_index.remove_documents(doc_ids)
+        lexical_index.save()
+
+def _text_splitter():
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    return RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=200,
+        length_function=len
+    )
+
+class _TimedSplitter:
+    """Text splitter wrapper adding the time of every split_text call to a StageTimer."""
+
+    def __init__(self, splitter, timer):
+        self.splitter = splitter
+        self.timer = timer
+
+    def split_text(self, text):
+        with self.timer.measure():
+            return self.splitter.split_text(text)
+
+def upload_pdf_to_chroma(uploaded_file, username=None, session_id=None, progress_callback=None,
+                         batch_size=DEFAULT_BATCH_SIZE, max_workers=DEFAULT_MAX_WORKERS,
+                         extraction_workers=0):
     """
     Processes the uploaded PDF file, splits the text, generates embeddings,
     and stores them in ChromaDB.
+
+    Each user's chunks go into their own collection, tagged with the username,
+    session and document ID so retrieval can be limited to that partition,
+    and are mirrored into the collection's BM25 index for keyword lookups.
+    Files whose content hash is already registered are skipped entirely,
+    chunks already stored for the document are not written again, and text
+    embedded before (e.g. unchanged chunks of a revised document) is served
+    by the embedding cache without a remote call.
+
+    Pages are extracted, split and embedded as a stream, so peak memory stays
+    roughly flat with document size. New chunks are embedded in batches
+    across a worker pool and written batch by batch, so a failed batch only
+    loses its own chunks; re-uploading the file retries just those.
+
+    Args:
+        uploaded_file: The Streamlit UploadedFile (anything with getvalue()).
+        username (str, optional): Owner of the document; selects the Chroma collection.
+        session_id (str, optional): Chat session the document is attached to.
+        progress_callback (callable, optional): Receives ingestion stats plus
+            "pages_done" and "pages_total" after each embedded batch.
+        batch_size (int): Chunks per embedding call.
+        max_workers (int): Concurrent embedding batches.
+        extraction_workers (int): Worker processes for page extraction; 0 extracts in-process.
     """
+    tmp_file_path = None
+    # Extraction and splitting run interleaved with embedding, so their time is summed per upload
+    extract_timer = StageTimer("pdf.extract")
+    split_timer = StageTimer("pdf.split")
     try:
-        # Save the uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            tmp_file_path = tmp_file.name
+        file_bytes = uploaded_file.getvalue()
+        doc_hash = file_hash(file_bytes)
+        collection_name = collection_name_for(username)
+        if is_document_indexed(collection_name, doc_hash):
+            link_session(collection_name, session_id, doc_hash)
+            return "PDF already indexed in ChromaDB, successfully skipped re-embedding."
+
+        # Extract text page by page, optionally in worker processes reading a temp copy
+        if extraction_workers:
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
+                tmp_file.write(file_bytes)
+                tmp_file_path = tmp_file.name
+            pages_total = count_pages(tmp_file_path)
+            pages = iter_pdf_pages_parallel(tmp_file_path, max_workers=extraction_workers)
+        else:
+            pages_total = count_pages(file_bytes)
+            pages = iter_pdf_pages(file_bytes)
+
+        progress = {"pages_done": 0, "pages_total": pages_total}
+
+        def counted(pages):
+            for page_text in pages:
+                progress["pages_done"] += 1
+                yield page_text
+
+        def report(stats):
+            if progress_callback:
+                stats.update(progress)
+                progress_callback(stats)
 
-        # Extract text from the PDF
-        pdf_reader = PdfReader(tmp_file_path)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text()
+        # Split the text into chunks as pages arrive
+        chunks = iter_chunks(extract_timer.wrap(counted(pages)), _TimedSplitter(_text_splitter(), split_timer))
 
+        vector_store = _open_collection(collection_name)
+
+        # Skip chunks already stored by an earlier upload before any embedding call
+        metadata = {
+            "doc_id": doc_hash,
+            "source": getattr(uploaded_file, "name", None) or "upload.pdf",
+            "username": username or "",
+            "session_id": session_id or ""
+        }
+        counts = {"chunks": 0, "new": 0}
+        records = _new_chunk_records(chunks, vector_store, metadata, counts)
+
+        # Keep the BM25 index in step with every batch written to Chroma
+        lexical_index = get_lexical_index(collection_name)
+
+        # Generate embeddings and store in ChromaDB batch by batch
+        with span("pdf.ingest"):
+            stats = run_ingestion(
+                records,
+                get_cached_embeddings(),
+                _index_sink(vector_store, lexical_index),
+                batch_size=batch_size,
+                max_workers=max_workers,
+                progress_callback=report
+            )
+
+        if stats["chunks_written"]:
+            with span("bm25.save"):
+                lexical_index.save()
+
+        if stats["batches_failed"]:
+            if stats["chunks_written"]:
+                bump_collection_version(collection_name)
+                link_session(collection_name, session_id, doc_hash)
+            return (f"Error: {stats['chunks_failed']} of {counts['new']} chunks failed to index "
+                    f"({stats['errors'][-1]}). Upload the file again to retry the remaining chunks.")
+
+        register_document(collection_name, doc_hash, metadata["source"], counts["chunks"])
+        link_session(collection_name, session_id, doc_hash)
+
+        skipped = counts["chunks"] - counts["new"]
+        return f"PDF successfully uploaded and indexed in ChromaDB! ({counts['new']} new chunks, {skipped} duplicates skipped)"
+
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+    finally:
+        extract_timer.record()
+        split_timer.record()
         # Clean up the temporary file
-        os.unlink(tmp_file_path)
-
-        # Split the text into chunks
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len
-        )
-        chunks = text_splitter.split_text(text)
-
-        # Generate embeddings and store in ChromaDB
-        vector_store = Chroma.from_texts(
-            texts=chunks,
-            embedding=gemini_embeddings,
-            persist_directory=chroma_db_path
-        )
-        vector_store.persist()
-
-        return "PDF successfully uploaded and indexed in ChromaDB!"
+        if tmp_file_path:
+            os.unlink(tmp_file_path)
+
+def crawl_to_chroma(targets, username=None, session_id=None, progress_callback=None,
+                    max_pages=CRAWL_MAX_PAGES, max_in_flight=CRAWL_MAX_IN_FLIGHT,
+                    pages_per_sec=CRAWL_PAGES_PER_SEC, batch_size=DEFAULT_BATCH_SIZE,
+                    max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Crawls a list of page and/or sitemap URLs and indexes the text of every
+    page into the user's ChromaDB collection and BM25 index, so query_rag
+    can answer across the whole set.
+
+    Pages are fetched concurrently under the crawler's politeness limits and
+    flow straight into one embedding pipeline, so embedding overlaps with
+    fetching. Each page is a document identified by its URL and extracted
+    text: unchanged pages that were indexed before are only linked to the
+    session, and chunks carry "source"/"url"/"title" metadata. A page whose
+    text changed replaces its earlier version in the session; versions no
+    session links any more are deleted from Chroma and the BM25 index.
+
+    Args:
+        targets (list): Page URLs and sitemap URLs.
+        username (str, optional): Owner of the pages; selects the Chroma collection.
+        session_id (str, optional): Chat session the pages are attached to.
+        progress_callback (callable, optional): Receives ingestion stats plus
+            "pages_done" and "pages_total" as pages are fetched and embedded.
+        max_pages (int): Most pages crawled after sitemap expansion.
+        max_in_flight (int): Concurrent page requests.
+        pages_per_sec (float): Overall request rate; 0 for unlimited.
+        batch_size (int): Chunks per embedding call.
+        max_workers (int): Concurrent embedding batches.
+    """
+    split_timer = StageTimer("crawl.split")
+    try:
+        # Sitemap and page requests share one politeness budget
+        limiter = RateLimiter(pages_per_sec)
+        with span("crawl.discover"):
+            urls = discover_urls(targets, max_pages=max_pages, limiter=limiter)
+        if not urls:
+            return "Error: No crawlable URLs found."
+        collection_name = collection_name_for(username)
+        vector_store = _open_collection(collection_name)
+        lexical_index = get_lexical_index(collection_name)
+        text_splitter = _text_splitter()
+
+        progress = {"pages_done": 0, "pages_total": len(urls)}
+        documents = {}
+        failures = []
+        skipped = []
+        stale = []
+        written_by_doc = defaultdict(int)
+
+        def report(stats):
+            if progress_callback:
+                stats.update(progress)
+                progress_callback(stats)
+
+        def records():
+            for result in crawl_pages(urls, max_in_flight=max_in_flight, limiter=limiter):
+                progress["pages_done"] += 1
+                record("crawl.page", result["elapsed"], error=bool(result["error"]))
+                if result["error"]:
+                    failures.append(f"{result['url']}: {result['error']}")
+                    continue
+                doc_id = result["doc_id"]
+                if is_document_indexed(collection_name, doc_id):
+                    stale.extend(replace_page_version(collection_name, session_id, result["url"], doc_id))
+                    skipped.append(result["url"])
+                    continue
+                page = result["page"]
+                metadata = {
+                    "doc_id": doc_id,
+                    "source": result["url"],
+                    "url": result["url"],
+                    "title": page["title"],
+                    "username": username or "",
+                    "session_id": session_id or ""
+                }
+                counts = {"chunks": 0, "new": 0}
+                documents[doc_id] = (metadata, counts)
+                with split_timer.measure():
+                    chunks = text_splitter.split_text(f"{page['title']}\n{page['text_content']}")
+                yield from _new_chunk_records(chunks, vector_store, metadata, counts)
+
+        with span("crawl.ingest"):
+            stats = run_ingestion(
+                records(),
+                get_cached_embeddings(),
+                _index_sink(vector_store, lexical_index, written_by_doc),
+                batch_size=batch_size,
+                max_workers=max_workers,
+                progress_callback=report
+            )
+        report(dict(stats))
+
+        if stats["chunks_written"]:
+            with span("bm25.save"):
+                lexical_index.save()
+
+        # Pages whose chunks were all written are registered; partly written ones are retried next crawl
+        indexed = partial = 0
+        for doc_id, (metadata, counts) in documents.items():
+            if written_by_doc[doc_id] >= counts["new"]:
+                indexed += 1
+                register_document(collection_name, doc_id, metadata["url"], counts["chunks"])
+                stale.extend(replace_page_version(collection_name, session_id, metadata["url"], doc_id))
+            elif written_by_doc[doc_id]:
+                partial += 1
+                link_session(collection_name, session_id, doc_id)
+        if partial:
+            bump_collection_version(collection_name)
+        # Earlier versions of re-crawled pages would otherwise be retrieved next to the current ones
+        _delete_documents(vector_store, lexical_index, stale)
+
+        summary = (f"{indexed} pages indexed, {len(skipped)} unchanged pages skipped, "
+                   f"{len(failures)} pages failed ({stats['chunks_written']} new chunks)")
+        if stale:
+            summary += f", {len(stale)} outdated page versions removed"
+        if not documents and not skipped:
+            return f"Error: Crawl failed for every page. {failures[0] if failures else ''}".strip()
+        if stats["batches_failed"]:
+            return (f"Error: {summary}; {stats['chunks_failed']} chunks failed to index "
+                    f"({stats['errors'][-1]}). Crawl again to retry the remaining pages.")
+        return f"Site successfully crawled and indexed in ChromaDB! ({summary})"
 
     except Exception as e:
-        return f"Error: {str(e)}"
\ No newline at end of file
+        return f"Error: {str(e)}"
+
+    finally:
+        split_timer.record()
@@ -1,16 +1,15 @@
 import requests
-from bs4 import BeautifulSoup
-import google.generativeai as genai
 import json
 from dotenv import load_dotenv
-import os
+from model_client import model_client
+from gemini_backend import get_model
+from context_builder import build_history_context
+from http_client import fetch
+from html_parsing import parse_html
+from page_index import relevant_page_content, FULL_PAGE_CHAR_LIMIT
+from metrics import span, registry
 
-# Configure Gemini API
 load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-
-genai.configure(api_key=api_key)  # Replace with your Gemini API key
-model = genai.GenerativeModel('models/gemini-2.0-flash')
 
 def extract_content(url):
     """
@@ -23,82 +22,102 @@ def extract_content(url):
         dict: A dictionary containing the title, metadata, and text content.
     """
     try:
-        # Send a GET request to the URL
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an error for bad status codes (4xx, 5xx)
-        
-        # Parse the HTML content using BeautifulSoup
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Extract the title of the page
-        title = soup.title.string if soup.title else "No Title Found"
-        
-        # Extract metadata (e.g., description, keywords)
-        metadata = {}
-        meta_tags = soup.find_all('meta')
-        for tag in meta_tags:
-            if 'name' in tag.attrs:
-                metadata[tag.attrs['name']] = tag.attrs.get('content', '')
-            elif 'property' in tag.attrs:
-                metadata[tag.attrs['property']] = tag.attrs.get('content', '')
+        # Fetch through the pooled client; repeat scrapes are served from the
+        # HTTP cache or revalidated with a conditional GET
+        with span("scrape.fetch"):
+            response = fetch(url)  # Raises for bad status codes (4xx, 5xx), timeouts and oversized pages
+        registry.inc("scrape_fetches_total", source="cache" if response.from_cache else "network")
         
-        # Extract all text content from the page
-        for element in soup(['script', 'style', 'head', 'title', 'meta', 'link', 'footer', 'nav']):
-            element.decompose()  # Remove unnecessary elements
-        
-        text_content = soup.get_text(separator='\n', strip=True)  # Get clean text content
-        
-        # Return the content as a dictionary
-        return {
-            'title': title,
-            'metadata': metadata,
-            'text_content': text_content
-        }
+        # Parse with the fastest available backend, keeping only the main content
+        with span("scrape.parse"):
+            return parse_html(response.content, encoding=response.encoding)
     
     except requests.exceptions.RequestException as e:
         print(f"Error fetching the URL: {e}")
         return None
+    except Exception as e:
+        # Undecodable or unparsable markup (e.g. lxml's ParserError)
+        print(f"Error parsing the page: {e}")
+        return None
+
+def _build_format_prompt(json_content, custom_requirement, history_context="", follow_up=False):
+    # Small pages are sent whole on the first request; follow-ups and large pages
+    # only get the chunks relevant to the request plus compact metadata
+    if not follow_up and len(json_content.get("text_content", "")) <= FULL_PAGE_CHAR_LIMIT:
+        page_block = f"Here is the JSON content extracted from a webpage:\n{json.dumps(json_content, indent=4, ensure_ascii=False)}"
+    else:
+        excerpts = relevant_page_content(json_content, custom_requirement)
+        page_block = ("Here are the parts of a webpage most relevant to the request, as JSON:\n"
+                      f"{json.dumps(excerpts, ensure_ascii=False)}")
+
+    # Build base prompt
+    prompt = f"""
+{page_block}
+
+The user has provided the following custom requirement:
+"{custom_requirement}"
+"""
 
-def format_with_gemini(json_content, custom_requirement, chat_history=None):
+    # Add context from the budgeted conversation history
+    if history_context:
+        prompt += f'\nFor context, here is the conversation so far:\n{history_context}\n'
+
+    prompt += "\nPlease format or adjust the content accordingly."
+    return prompt
+
+async def async_format_with_gemini(json_content, custom_requirement, chat_history=None, username=None, session_id=None):
     """
     Formats the JSON content using Gemini based on custom requirement, optionally using chat history.
 
+    Runs under the shared model client's concurrency limits.
+
     Args:
         json_content (dict): The scraped content from the webpage.
         custom_requirement (str): The user's instruction.
         chat_history (list, optional): Previous chat messages to provide context.
+        username (str, optional): Caller, used for per-user fairness.
+        session_id (str, optional): Session whose rolling summary is used and updated.
 
     Returns:
         str: Gemini's formatted output in human language.
     """
     try:
-        # Build base prompt
-        prompt = f"""
-Here is the JSON content extracted from a webpage:
-{json.dumps(json_content, indent=4, ensure_ascii=False)}
+        with span("scrape.history"):
+            history_context = await build_history_context(chat_history, custom_requirement, "url", session_id, username)
+        with span("scrape.prompt"):
+            prompt = _build_format_prompt(json_content, custom_requirement, history_context, follow_up=bool(chat_history))
 
-The user has provided the following custom requirement:
-"{custom_requirement}"
-"""
+        return await model_client.generate(get_model(), prompt, username=username, feature="url_format")
 
-        # Add context from chat history (e.g., previous assistant response)
-        if chat_history:
-            previous_answers = [
-                msg["content"] for msg in reversed(chat_history)
-                if msg["role"] == "assistant"
-            ]
-            if previous_answers:
-                last_answer = previous_answers[0]
-                prompt += f'\nFor context, here is the previous assistant response:\n"{last_answer}"\n'
+    except Exception as e:
+        print(f"Error formatting with Gemini: {e}")
+        return None
 
-        prompt += "\nPlease format or adjust the content accordingly."
+async def async_stream_format_with_gemini(json_content, custom_requirement, chat_history=None, username=None, session_id=None):
+    """
+    Streaming variant of async_format_with_gemini: yields text fragments as
+    Gemini produces them. On failure the stream simply ends, so callers
+    should treat an empty result as an error.
+    """
+    try:
+        with span("scrape.history"):
+            history_context = await build_history_context(chat_history, custom_requirement, "url", session_id, username)
+        with span("scrape.prompt"):
+            prompt = _build_format_prompt(json_content, custom_requirement, history_context, follow_up=bool(chat_history))
 
-        response = model.generate_content(prompt)
-        return response.text
+        async for fragment in model_client.stream(get_model(), prompt, username=username, feature="url_format"):
+            yield fragment
 
     except Exception as e:
         print(f"Error formatting with Gemini: {e}")
-        return None
+
+def format_with_gemini(json_content, custom_requirement, chat_history=None, username=None, session_id=None):
+    """Synchronous wrapper around async_format_with_gemini."""
+    return model_client.run_sync(async_format_with_gemini(json_content, custom_requirement, chat_history, username, session_id))
+
+def stream_format_with_gemini(json_content, custom_requirement, chat_history=None, username=None, session_id=None):
+    """Synchronous wrapper around async_stream_format_with_gemini for the Streamlit app."""
+    return model_client.iter_sync(async_stream_format_with_gemini(json_content, custom_requirement, chat_history, username, session_id))
 
 
 # Main script